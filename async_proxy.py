@@ -0,0 +1,121 @@
+import asyncio
+import contextlib
+
+
+class AsyncRedditProxy:
+    """
+    An asyncio front-end for a RedditProxy. Calling a method returns a coroutine that resolves to its return value, and
+    streamed methods can be iterated with async for. Responses are handed to the event loop by the proxy's consumer
+    thread, so no thread is needed per request.
+    """
+
+    def __init__(self, proxy, max_in_flight=None):
+        """
+        Initializes a new instance of the AsyncRedditProxy class.
+        :param proxy: The RedditProxy or EmbeddedProxy to send commands through.
+        :param max_in_flight: The maximum number of commands waiting on the producers at once, None for no limit.
+        Further calls wait their turn, which keeps a large gather from flooding the request queue.
+        """
+        self.proxy = proxy
+        self.max_in_flight = max_in_flight
+        self.semaphore = asyncio.Semaphore(max_in_flight) if max_in_flight is not None else None
+
+    def __getattr__(self, name):
+        """
+        Used as a pass through to the RedditClient methods.
+        :param name: The name of the method.
+        :return: A function that returns a coroutine calling the method.
+        """
+        return lambda *args, **params: self.call(name, *args, **params)
+
+    def limit(self):
+        """
+        Gets the context that holds one of the in flight slots.
+        :return: The async context manager.
+        """
+        return self.semaphore if self.semaphore is not None else contextlib.AsyncExitStack()
+
+    async def call(self, name, *args, **params):
+        """
+        Calls a method on a producer.
+        :param name: The name of the method to call.
+        :param args: The arguments to pass to the method.
+        :param params: The parameters to pass to the method.
+        :return: The return value of the method.
+        """
+        loop = asyncio.get_running_loop()
+
+        async with self.limit():
+            future = loop.create_future()
+            request = self.proxy.add_command(name, *args, **params)
+            request.add_done_callback(lambda finished: loop.call_soon_threadsafe(resolve, future, finished.value))
+            return await future
+
+    async def stream(self, name, *args, **params):
+        """
+        Calls a method on a producer that streams its results back.
+        :param name: The name of the method to call.
+        :param args: The arguments to pass to the method.
+        :param params: The parameters to pass to the method.
+        :return: An async generator of the streamed items.
+        """
+        loop = asyncio.get_running_loop()
+
+        async with self.limit():
+            # Each entry is a tuple of whether the stream is finished and the streamed item.
+            queue = asyncio.Queue()
+            request = self.proxy.add_command(name, *args, **params)
+            request.then(lambda item: loop.call_soon_threadsafe(queue.put_nowait, (False, item)))
+            request.add_done_callback(lambda finished: loop.call_soon_threadsafe(queue.put_nowait, (True, None)))
+
+            while True:
+                finished, item = await queue.get()
+                if finished:
+                    return
+
+                yield item
+
+    def iter_user_pages(self, username, get_posts, get_comments, page_size=100):
+        """
+        Gets information about a user one page at a time as it is retrieved.
+        :param username: The username to query.
+        :param get_posts: True if posts should be retrieved, false otherwise.
+        :param get_comments: True if comments should be retrieved, false otherwise.
+        :param page_size: The maximum number of items in each page.
+        :return: An async generator of pages, see RedditClient.get_user_pages.
+        """
+        return self.stream("get_user", username, get_posts, get_comments, page_size=page_size)
+
+    async def iter_user_posts(self, username, page_size=100):
+        """
+        Gets the posts of a user as they are retrieved.
+        :param username: The username to query.
+        :param page_size: The number of posts retrieved at a time.
+        :return: An async generator of post records.
+        """
+        async for page in self.iter_user_pages(username, True, False, page_size):
+            if page is not None:
+                for item in page["items"]:
+                    yield item
+
+    async def iter_user_comments(self, username, page_size=100):
+        """
+        Gets the comments of a user as they are retrieved.
+        :param username: The username to query.
+        :param page_size: The number of comments retrieved at a time.
+        :return: An async generator of comment records.
+        """
+        async for page in self.iter_user_pages(username, False, True, page_size):
+            if page is not None:
+                for item in page["items"]:
+                    yield item
+
+
+def resolve(future, value):
+    """
+    Sets the result of a future unless it was cancelled while waiting.
+    :param future: The future.
+    :param value: The result.
+    """
+    if not future.done():
+        future.set_result(value)
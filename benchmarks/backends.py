@@ -0,0 +1,82 @@
+"""
+Compares the process and thread producer backends of the EmbeddedProxy: startup time, memory and the round trip
+latency of a request carrying a page of records. Runs without a login so no requests are made to Reddit.
+
+Usage: python benchmarks/backends.py [producers] [requests]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import Record
+from reddit_client import EmbeddedProxy
+
+
+def rss(pid):
+    """
+    Gets the resident memory of a process.
+    :param pid: The process identifier.
+    :return: The resident memory in kilobytes, 0 if it can't be determined.
+    """
+    try:
+        with open("/proc/" + str(pid) + "/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return 0
+
+
+def measure(backend, producers, requests):
+    """
+    Measures a backend.
+    :param backend: The backend, "process" or "thread".
+    :param producers: The number of producers.
+    :param requests: The number of requests to time.
+    :return: A dictionary of the measurements.
+    """
+    start = time.perf_counter()
+    proxy = EmbeddedProxy(None, producers, backend=backend)
+
+    # The proxy is ready once every producer has answered.
+    for request in [proxy.add_command("ping") for x in range(producers * 4)]:
+        request.result()
+    startup = time.perf_counter() - start
+
+    memory = rss(os.getpid())
+    if backend == "process":
+        memory += sum(rss(producer.pid) for producer in proxy.producers)
+
+    page = [Record("c%d" % x, "t1_c%d" % x, "comment", "benchmark_user", "benchmarks", x, 1450000000.0 + x,
+                   body="This is the body of comment number %d." % x, parent_id="t3_p0") for x in range(100)]
+    latencies = []
+    for x in range(requests):
+        request_start = time.perf_counter()
+        proxy.add_command("ping", page).result()
+        latencies.append(time.perf_counter() - request_start)
+
+    proxy.close()
+    return {"backend": backend, "startup_ms": startup * 1000, "rss_kb": memory,
+            "latency_p50_ms": statistics.median(latencies) * 1000,
+            "latency_p95_ms": sorted(latencies)[int(len(latencies) * 0.95)] * 1000}
+
+
+def main(producers, requests):
+    """
+    Runs the benchmark.
+    :param producers: The number of producers.
+    :param requests: The number of requests to time.
+    """
+    for backend in ("process", "thread"):
+        result = measure(backend, producers, requests)
+        print("{backend:>8}: startup {startup_ms:8.2f} ms  rss {rss_kb:>9,} kB  latency p50 {latency_p50_ms:6.3f} ms  "
+              "p95 {latency_p95_ms:6.3f} ms".format(**result))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5, int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
@@ -0,0 +1,70 @@
+"""
+Times adding rows to the results list of the form. Requires a display.
+
+Usage: python benchmarks/gui_rows.py [count ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tkinter
+
+import gui
+
+
+def measure(root, count):
+    """
+    Measures adding rows to an empty results list.
+    :param root: The root window.
+    :param count: The number of rows to add.
+    :return: A tuple of the seconds until the first row was displayed and until all rows were displayed.
+    """
+    results = gui.ScrollableControlBecauseTkinterIsAShitTechnology(root)
+    results.pack(fill=tkinter.BOTH, expand=True)
+    root.update()
+
+    start = time.perf_counter()
+    results.add_title("COMMENTS")
+    results.add_content("This is the body of comment number 0.")
+    root.update()
+    first_row = time.perf_counter() - start
+
+    for x in range(1, count):
+        results.add_content("This is the body of comment number %d." % x)
+    root.update()
+    all_rows = time.perf_counter() - start
+
+    # Make sure scrolling to the end only costs a redraw of what's visible.
+    scroll_start = time.perf_counter()
+    results.yview("moveto", 1.0)
+    root.update()
+    scroll = time.perf_counter() - scroll_start
+
+    results.destroy()
+    return first_row, all_rows, scroll
+
+
+def main(counts):
+    """
+    Runs the benchmark.
+    :param counts: The numbers of rows to add.
+    """
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError as e:
+        print("A display is required to run this benchmark:", e)
+        return
+
+    root.geometry("800x600")
+    for count in counts:
+        first_row, all_rows, scroll = measure(root, count)
+        print("{0:>8,} rows: first row {1:8.2f} ms  all rows {2:8.2f} ms  scroll to end {3:6.2f} ms".format(
+            count, first_row * 1000, all_rows * 1000, scroll * 1000))
+
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main([int(count) for count in sys.argv[1:]] or [10000, 50000])
@@ -0,0 +1,76 @@
+"""
+Compares expanding a large comment tree with PRAW's Submission.replace_more_comments against
+RedditClient.expand_comments. Reddit is replaced by an offline.OfflineHandler that serves a synthetic thread shaped
+like a large one, where only the first comments are sent inline and the rest are behind MoreComments stubs, some of
+them "continue this thread" stubs, with a fixed latency per request. Both have to come out with the same comments in
+the same order at the same depths.
+
+Usage: python benchmarks/more_comments.py [comments] [latency_ms]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from offline import OfflineHandler, OfflineReddit
+from reddit_client import RedditClient
+
+
+def measure(label, comments, latency, expand):
+    """
+    Measures and prints how long a thread takes to expand.
+    :param label: The label to print.
+    :param comments: The number of comments in the thread.
+    :param latency: The number of seconds each request takes.
+    :param expand: The function that expands the tree, passed the client and the submission.
+    :return: The list of tuples of the fullname and depth of each comment of the expanded tree, in order.
+    """
+    handler = OfflineHandler(site=OfflineReddit(post_comments=comments), latency=latency, rate_limit=10 ** 9)
+    client = RedditClient(None, handler=handler)
+    post = client.api.get_submission(submission_id="bench")
+
+    start = time.perf_counter()
+    expand(client, post)
+    elapsed = time.perf_counter() - start
+
+    tree = list(walk(post.comments))
+    print("{0:>22}: {1:8.2f} s  {2:5} requests  {3:7} of {4} comments".format(label, elapsed, handler.requests,
+                                                                         len(tree), comments))
+    return tree
+
+
+def walk(comments, depth=0):
+    """
+    Walks a comment tree depth first.
+    :param comments: The comments of a level.
+    :param depth: The depth of the level, 0 for top level.
+    :return: A generator of tuples of the fullname and depth of each comment.
+    """
+    for comment in comments:
+        yield comment.fullname, depth
+        yield from walk(getattr(comment, "replies", []), depth + 1)
+
+
+def main(comments, latency):
+    """
+    Runs the benchmark.
+    :param comments: The number of comments in the thread.
+    :param latency: The number of seconds each request takes.
+    """
+    expected = measure("replace_more_comments", comments, latency,
+                       lambda client, post: post.replace_more_comments(limit=None, threshold=0))
+    tree = measure("expand_comments", comments, latency, lambda client, post: client.expand_comments(post))
+
+    # The comments deeper than where threads are continued can only have come from "continue this thread" stubs.
+    continued = sum(1 for name, depth in expected if depth > OfflineReddit().continue_depth)
+    print("{0:>22}: {1:7} comments".format("continued", continued))
+
+    if continued == 0:
+        raise AssertionError("The thread has no \"continue this thread\" stubs")
+    if tree != expected:
+        raise AssertionError("expand_comments and replace_more_comments expanded different trees")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000)
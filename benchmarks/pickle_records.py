@@ -0,0 +1,74 @@
+"""
+Compares the cost of sending PRAW comments across processes against sending their Record snapshots.
+
+Usage: python benchmarks/pickle_records.py [count]
+"""
+import os
+import pickle
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import praw
+import praw.objects
+
+from records import Record
+
+
+def create_comment_json(index):
+    """
+    Creates the JSON Reddit returns for a comment in a user's history.
+    :param index: The index of the comment, used to make it unique.
+    :return: The dictionary of comment attributes.
+    """
+    return {"id": "c%06d" % index, "name": "t1_c%06d" % index, "author": "benchmark_user", "score": index % 50,
+            "created_utc": 1450000000.0 + index, "archived": index % 3 == 0, "parent_id": "t3_p%06d" % (index // 10),
+            "link_id": "t3_p%06d" % (index // 10), "subreddit": "benchmarks", "subreddit_id": "t5_2qh0u",
+            "body": "This is the body of comment number %d. " % index * 4,
+            "body_html": "&lt;div class=\"md\"&gt;&lt;p&gt;This is the body of comment number %d.&lt;/p&gt;" % index,
+            "link_title": "A submission title that is fairly representative in length", "link_author": "op",
+            "link_url": "https://www.reddit.com/r/benchmarks/", "ups": index % 50, "downs": 0, "gilded": 0,
+            "controversiality": 0, "distinguished": None, "edited": False, "likes": None, "saved": False,
+            "score_hidden": False, "stickied": False, "approved_by": None, "banned_by": None, "removal_reason": None,
+            "author_flair_text": None, "author_flair_css_class": None, "mod_reports": [], "user_reports": [],
+            "report_reasons": None, "num_reports": None, "replies": ""}
+
+
+def measure(label, content, number=5):
+    """
+    Measures and prints the pickle size and round trip time of content.
+    :param label: The name of the content.
+    :param content: The content to pickle.
+    :param number: The number of times to repeat the measurement.
+    :return: A tuple of the size in bytes and the best round trip time in seconds.
+    """
+    data = pickle.dumps(content)
+    dump_time = min(timeit.repeat(lambda: pickle.dumps(content), number=1, repeat=number))
+    load_time = min(timeit.repeat(lambda: pickle.loads(data), number=1, repeat=number))
+    print("{0:>8}: {1:>12,} bytes  dump {2:8.2f} ms  load {3:8.2f} ms".format(label, len(data), dump_time * 1000,
+                                                                               load_time * 1000))
+    return len(data), dump_time + load_time
+
+
+def main(count):
+    """
+    Runs the benchmark.
+    :param count: The number of comments to send.
+    """
+    api = praw.Reddit(user_agent="windows:reddit_play_thing:benchmark", disable_update_check=True)
+    comments = [praw.objects.Comment(api, create_comment_json(x)) for x in range(count)]
+
+    conversion_time = min(timeit.repeat(lambda: [Record.from_thing(comment) for comment in comments], number=1,
+                                        repeat=5))
+    records = [Record.from_thing(comment) for comment in comments]
+
+    print("Pickling", count, "comments")
+    praw_size, praw_time = measure("PRAW", comments)
+    record_size, record_time = measure("Record", records)
+    print("Conversion to records: {0:.2f} ms".format(conversion_time * 1000))
+    print("Size reduced {0:.1f}x, round trip {1:.1f}x faster".format(praw_size / record_size, praw_time / record_time))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
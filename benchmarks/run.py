@@ -0,0 +1,428 @@
+"""
+Runs the benchmark suite against the offline stand-in for Reddit and writes the results as JSON, so runs can be
+compared to catch regressions. No network or login is needed. The GUI benchmark needs a display and is skipped without
+one.
+
+Suites:
+    proxy: EmbeddedProxy round trip latency and messages per second by number of producers, for both backends.
+    pickle: The pickled size of each kind of response.
+    fetch: get_user and get_post from end to end through the proxy, for synthetic users and posts of each size, and
+        the memory a streamed get_user still holds on to once it's finished, which mustn't grow with the history.
+    transport: Sending a batch of records from a producer process to the consumer, pickled through the queue or
+        through shared memory, for payloads of 1 MB to 100 MB.
+    gui: The time until the first row and until all rows are shown in the results list.
+    startup: The time main.py takes to import, from -X importtime, and until its window is shown.
+
+Usage: python benchmarks/run.py [--quick] [--output FILE] [suite ...]
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transport
+from offline import OfflineHandler, OfflineReddit
+from records import Record
+from reddit_client import EmbeddedProxy, RedditClient
+
+# The number of requests each offline handler allows per window, high enough to never be in the way
+RATE_LIMIT = 10 ** 9
+
+# The number of bytes a finished streamed command may hold on to beyond what the smallest one does
+RETAINED_SLACK = 64 * 1024
+
+# The directory main.py is in
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The number of milliseconds main.py should take to show its window
+WINDOW_TARGET_MS = 500
+
+# Runs main.py, printing the milliseconds from starting until its window is shown and closing it then
+SHOW_WINDOW = """
+import time
+started = time.perf_counter()
+
+import runpy
+import sys
+import gui
+
+def show(self):
+    def on_map(event):
+        if event.widget is self:
+            print((time.perf_counter() - started) * 1000, flush=True)
+            self.after(0, self.destroy)
+
+    self.bind("<Map>", on_map, add="+")
+    self.mainloop()
+
+gui.MainForm.show = show
+sys.argv = ["main.py"]
+runpy.run_path("main.py", run_name="__main__")
+"""
+
+
+def create_page(size=100, body_words=0):
+    """
+    Creates a page of comment records like the ones streamed back by get_user.
+    :param size: The number of records.
+    :param body_words: The number of extra words in each body.
+    :return: The list of records.
+    """
+    words = " lorem ipsum" * (body_words // 2)
+    return [Record("c%d" % x, "t1_c%d" % x, "comment", "benchmark_user", "benchmarks", x, 1450000000.0 + x,
+                   body="This is the body of comment number %d.%s" % (x, words), parent_id="t3_p0")
+            for x in range(size)]
+
+
+def percentile(values, fraction):
+    """
+    Gets a percentile of measurements.
+    :param values: The measurements.
+    :param fraction: The percentile as a fraction, e.g. 0.95.
+    :return: The measurement at the percentile.
+    """
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run_proxy(quick):
+    """
+    Measures the round trip latency of a command carrying a page of records, one at a time, and the number of
+    messages per second with many commands waiting at once.
+    :param quick: True to take fewer measurements.
+    :return: The list of measurements.
+    """
+    requests = 200 if quick else 2000
+    page = create_page()
+
+    results = []
+    for backend in ("process", "thread"):
+        for producers in (1, 2, 4, 8):
+            log("proxy:", backend, producers, "producers")
+            proxy = EmbeddedProxy(None, producers, backend=backend, min_producers=producers)
+
+            # Wait until every producer is up.
+            for request in [proxy.add_command("ping") for x in range(producers * 4)]:
+                request.result()
+
+            latencies = []
+            for x in range(requests):
+                start = time.perf_counter()
+                proxy.add_command("ping", page).result()
+                latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for request in [proxy.add_command("ping", page) for x in range(requests)]:
+                request.result()
+            elapsed = time.perf_counter() - start
+
+            proxy.close()
+            results.append({"backend": backend, "producers": producers,
+                            "latency_p50_ms": statistics.median(latencies) * 1000,
+                            "latency_p95_ms": percentile(latencies, 0.95) * 1000,
+                            "messages_per_second": requests / elapsed})
+
+    return results
+
+
+def run_pickle(quick):
+    """
+    Measures the pickled size of each kind of response, as it's sent from a producer to the consumer.
+    :param quick: Unused, pickling is always quick.
+    :return: The list of measurements.
+    """
+    site = OfflineReddit(user_items=500, post_comments=1000)
+    client = RedditClient(None, handler=OfflineHandler(site=site, rate_limit=RATE_LIMIT))
+    client.login_first_time("benchmark")
+
+    user = client.get_user("benchmark_user", True, True)
+    page = next(client.get_user_pages("benchmark_user", False, True, 100))
+    post = client.get_post("benchmark", True)
+    vote = next(client.iter_vote(True, post.all_comments[:1]))
+
+    responses = [("get_me", client.get_me(), 1),
+                 ("get_user page", page, len(page["items"])),
+                 ("get_user", user, len(user.posts) + len(user.all_comments)),
+                 ("get_post", post, len(post.all_comments) + 1),
+                 ("vote status", vote, 1),
+                 ("is_logged_in", True, 1)]
+
+    results = []
+    for name, value, items in responses:
+        # Every response travels in a message like this one.
+        size = len(pickle.dumps({"id": 0, "name": name, "return": value, "partial": True}))
+        results.append({"response": name, "items": items, "bytes": size, "bytes_per_item": size / items})
+
+    return results
+
+
+def run_fetch(quick):
+    """
+    Measures get_user and get_post from end to end through a proxy with process producers, from adding the command
+    to the last response, including the time until the first page of a streamed history.
+    :param quick: True to leave out the largest size.
+    :return: The list of measurements.
+    """
+    sizes = (1000, 10000) if quick else (1000, 10000, 100000)
+
+    # Half of a user's items are posts and half are comments.
+    site = OfflineReddit(users={"user_%d" % size: size // 2 for size in sizes},
+                         posts={"post%d" % size: size for size in sizes})
+    proxy = EmbeddedProxy(None, 2, backend="process", min_producers=2,
+                          handler_factory=functools.partial(OfflineHandler, site=site, rate_limit=RATE_LIMIT))
+
+    results = []
+    for size in sizes:
+        log("fetch: get_user", size)
+        first_page = []
+        start = time.perf_counter()
+        request = proxy.add_command("get_user", "user_%d" % size, True, True, page_size=100)
+        request.then(lambda page: first_page or first_page.append(time.perf_counter() - start))
+        request.result()
+        results.append({"command": "get_user", "items": size, "first_page_s": first_page[0] if first_page else None,
+                        "total_s": time.perf_counter() - start})
+
+        log("fetch: get_post", size)
+        start = time.perf_counter()
+        post = proxy.add_command("get_post", "post%d" % size, True).result()
+        results.append({"command": "get_post", "items": len(post.all_comments) if post else 0, "first_page_s": None,
+                        "total_s": time.perf_counter() - start})
+
+    # Identical commands are coalesced by default, which mustn't keep the pages of a stream around for followers.
+    retained = []
+    for size in sizes:
+        log("fetch: retained by get_user", size)
+        retained.append(measure_retained(proxy, "user_%d" % size))
+        results.append({"command": "get_user", "items": size, "retained_bytes": retained[-1]})
+
+    proxy.close()
+    if max(retained) > retained[0] + RETAINED_SLACK:
+        raise AssertionError("A finished get_user holds on to memory that grows with the history: " + str(retained))
+    return results
+
+
+def measure_retained(proxy, username):
+    """
+    Measures the memory a streamed get_user holds on to once it's finished, while the request is still referenced.
+    Its pages are passed to a callback that drops them, like an export writing them out.
+    :param proxy: The EmbeddedProxy.
+    :param username: The user.
+    :return: The number of bytes allocated by this process since adding the command that are still in use.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        request = proxy.add_command("get_user", username, True, True, page_size=100)
+        request.then(lambda page: None)
+        request.result()
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def send_batch(requests, responses, count, shared):
+    """
+    Sends a batch of records to the parent process each time it asks, the way a producer sends a response.
+    :param requests: The queue the parent asks on, None to stop.
+    :param responses: The queue to send the batch on.
+    :param count: The number of records in the batch.
+    :param shared: True to send the batch through shared memory, false to pickle it through the queue.
+    """
+    page = create_page(count, 80)
+    while requests.get() is not None:
+        responses.put({"id": 0, "name": "get_user", "return": transport.pack({"items": page}, 1) if shared else
+                       {"items": page}, "partial": True})
+
+
+def run_transport(quick):
+    """
+    Measures sending a batch of records from a producer process to the consumer, pickled through the queue or through
+    shared memory: the time the consumer thread is busy receiving it, the time until the first record can be used and
+    until every record has been used, and the throughput.
+    :param quick: True to leave out the largest size.
+    :return: The list of measurements.
+    """
+    record_bytes = len(pickle.dumps(create_page(1000, 80))) / 1000
+
+    results = []
+    for megabytes in (1, 10) if quick else (1, 10, 100):
+        count = int(megabytes * 1000000 / record_bytes)
+        for shared in (False, True):
+            log("transport:", megabytes, "MB", "shared memory" if shared else "queue")
+            requests = multiprocessing.Queue()
+            responses = multiprocessing.Queue()
+            producer = multiprocessing.Process(target=send_batch, args=(requests, responses, count, shared))
+            producer.start()
+
+            # The first batch warms up both processes.
+            measurements = []
+            for x in range(4 if megabytes < 100 else 2):
+                requests.put(True)
+                start = time.perf_counter()
+                busy = time.thread_time()
+                items = transport.unpack(responses.get()["return"])["items"]
+                busy = time.thread_time() - busy
+                first = items[0] and time.perf_counter() - start
+                for record in items:
+                    pass
+                measurements.append((time.perf_counter() - start, first, busy))
+                del items
+
+            requests.put(None)
+            producer.join()
+
+            total, first, busy = min(measurements[1:])
+            results.append({"transport": "shared_memory" if shared else "queue", "megabytes": megabytes,
+                            "records": count, "consumer_busy_ms": busy * 1000, "first_record_ms": first * 1000,
+                            "all_records_ms": total * 1000, "megabytes_per_second": megabytes / total})
+
+    return results
+
+
+def run_gui(quick):
+    """
+    Measures the time until the first row and until all rows are shown in the results list.
+    :param quick: True to leave out the largest size.
+    :return: The list of measurements, or a dictionary with the reason the benchmark was skipped.
+    """
+    import tkinter
+    import gui_rows
+
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError as e:
+        return {"skipped": "A display is required: " + str(e)}
+
+    root.geometry("800x600")
+    results = []
+    for count in (1000, 10000) if quick else (1000, 10000, 100000):
+        log("gui:", count, "rows")
+        first_row, all_rows, scroll = gui_rows.measure(root, count)
+        results.append({"rows": count, "first_row_ms": first_row * 1000, "all_rows_ms": all_rows * 1000,
+                        "scroll_to_end_ms": scroll * 1000})
+
+    root.destroy()
+    return results
+
+
+def run_startup(quick):
+    """
+    Measures how long main.py takes to import, which modules take the longest and whether PRAW is among them, and
+    how long it takes until the window is shown, against WINDOW_TARGET_MS.
+    :param quick: True to take fewer measurements.
+    :return: The dictionary of measurements.
+    """
+    runs = 1 if quick else 5
+
+    log("startup: importing")
+    imports = []
+    for x in range(runs):
+        output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT,
+                                capture_output=True, text=True).stderr
+        imports.append(parse_import_times(output))
+    main_ms, slowest, modules = sorted(imports, key=lambda result: result[0])[len(imports) // 2]
+    results = {"main_import_ms": main_ms, "praw_imported": "praw" in modules, "slowest_imports": slowest}
+
+    log("startup: showing the window")
+    windows = []
+    for x in range(runs):
+        process = subprocess.run([sys.executable, "-c", SHOW_WINDOW], cwd=ROOT, capture_output=True, text=True,
+                                 timeout=60)
+        if process.returncode != 0 or process.stdout.strip() == "":
+            lines = process.stderr.strip().splitlines()
+            results["window"] = {"skipped": "A display is required: " + (lines[-1] if lines else "")}
+            return results
+        windows.append(float(process.stdout.split()[0]))
+
+    window_ms = statistics.median(windows)
+    results["window"] = {"time_to_window_ms": window_ms, "target_ms": WINDOW_TARGET_MS,
+                         "meets_target": window_ms <= WINDOW_TARGET_MS}
+    return results
+
+
+def parse_import_times(output):
+    """
+    Parses the output of -X importtime for importing main.
+    :param output: The standard error of the process.
+    :return: A tuple of the milliseconds main took to import including everything it imported, the list of the
+    modules main imports directly that took the longest, and the set of every module imported.
+    """
+    main_ms = None
+    direct = []
+    pending = []
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        modules.add(name)
+
+        # A module is listed after everything it imports, the interpreter's own startup imports come first.
+        if level == 1:
+            pending.append({"module": name, "ms": int(cumulative_us) / 1000})
+        elif level == 0:
+            if name == "main":
+                main_ms = int(cumulative_us) / 1000
+                direct = pending
+            pending = []
+
+    slowest = sorted(direct, key=lambda module: module["ms"], reverse=True)[:5]
+    return main_ms, slowest, modules
+
+
+SUITES = {"proxy": run_proxy, "pickle": run_pickle, "fetch": run_fetch, "transport": run_transport, "gui": run_gui,
+          "startup": run_startup}
+
+
+def log(*args):
+    """
+    Reports progress on standard error, standard output may be the results.
+    :param args: The arguments.
+    """
+    print(*args, file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    """
+    Runs the benchmarks.
+    :param argv: The arguments, None to use the arguments of the process.
+    """
+    parser = argparse.ArgumentParser(description="Runs the benchmark suite and writes the results as JSON.")
+    parser.add_argument("suites", nargs="*", help="the suites to run, one of " + ", ".join(SUITES) + ", the default is all")
+    parser.add_argument("--quick", action="store_true", help="take fewer measurements and leave out the largest sizes")
+    parser.add_argument("--output", help="the file to write the results to, the default is standard output")
+    args = parser.parse_args(argv)
+    for name in args.suites:
+        if name not in SUITES:
+            parser.error("unknown suite \"" + name + "\"")
+
+    results = {"time": time.time(), "python": platform.python_version(), "platform": platform.platform(),
+               "cpus": os.cpu_count(), "quick": args.quick, "suites": {}}
+    for name in args.suites or list(SUITES):
+        start = time.perf_counter()
+        results["suites"][name] = SUITES[name](args.quick)
+        log(name, "took {0:.1f} s".format(time.perf_counter() - start))
+
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Times filling the search index and querying it by text, author, subreddit and date.
+
+Usage: python benchmarks/search_index.py [count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import Record
+from search import SearchIndex
+
+# The words the synthetic comments are made of, the first are far more common than the last, as in real text
+WORDS = ["the", "a", "and", "reddit", "python", "comment", "thread", "vote", "karma", "subreddit", "moderator",
+         "benchmark", "index", "search", "query", "sqlite", "tkinter", "praw", "archive", "history", "zebra"] + \
+        ["word%d" % x for x in range(5000)]
+
+
+def create_records(count, seed=0):
+    """
+    Creates comments by a few hundred authors across a few dozen subreddits over a few years.
+    :param count: The number of comments.
+    :param seed: The seed of the random words.
+    :return: The list of records.
+    """
+    generator = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+    return [Record("c%d" % x, "t1_c%d" % x, "comment", "user_%d" % (x % 300), "subreddit_%d" % (x % 40), x % 100,
+                   1400000000.0 + x * 600, body=" ".join(generator.choices(WORDS, weights, k=20)),
+                   parent_id="t3_p%d" % (x // 50)) for x in range(count)]
+
+
+def measure(index, label, **query):
+    """
+    Times a query, taking the best of a few runs.
+    :param index: The SearchIndex.
+    :param label: What the query is, to print.
+    :param query: The parameters of SearchIndex.search.
+    :return: The number of seconds the query took.
+    """
+    seconds = None
+    for x in range(5):
+        start = time.perf_counter()
+        results = index.search(**query)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    print("{0:>36}: {1:>5} results {2:8.2f} ms".format(label, len(results), seconds * 1000))
+    return seconds
+
+
+def main(count):
+    """
+    Runs the benchmark.
+    :param count: The number of comments to index.
+    """
+    records = create_records(count)
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = SearchIndex(os.path.join(directory, "Search.db"))
+
+        # Pages arrive 100 records at a time.
+        start = time.perf_counter()
+        for x in range(0, count, 100):
+            index.add(records[x:x + 100])
+        print("Indexed {0:,} comments in {1:.2f} s".format(count, time.perf_counter() - start))
+
+        measure(index, "common word", text="the")
+        measure(index, "less common word", text="zebra")
+        measure(index, "two words", text="python sqlite")
+        measure(index, "word prefix", text="mod")
+        measure(index, "author", author="user_7")
+        measure(index, "rare word", text="word4000")
+        measure(index, "common word by author", text="the", author="user_7")
+        measure(index, "rare word by author", text="word400", author="user_7")
+        measure(index, "subreddit in a month", subreddit="subreddit_3", after=1400000000.0 + count * 300,
+                before=1400000000.0 + count * 300 + 30 * 24 * 60 * 60)
+        measure(index, "newest of everything")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
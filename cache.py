@@ -0,0 +1,363 @@
+import abc
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import logger
+
+
+class SQLiteStore(abc.ABC):
+    """
+    A SQLite database shared by every thread and process. Connections can't be shared between threads or processes,
+    so each thread opens its own the first time it needs one, and only the filename is pickled. Subclasses create
+    their schema in create_schema.
+    """
+
+    # The settings of every connection, which can't be changed in a transaction
+    PRAGMAS = ("journal_mode=WAL",)
+
+    def __init__(self, filename):
+        """
+        Initializes a new instance of the SQLiteStore class.
+        :param filename: The SQLite database file.
+        """
+        self.filename = filename
+        self.local = threading.local()
+
+    def __getstate__(self):
+        """
+        Needed for pickle, the connections are not sent to other processes.
+        :return: The state of the object.
+        """
+        state = self.__dict__.copy()
+        del state["local"]
+        return state
+
+    def __setstate__(self, state):
+        """
+        Needed for pickle, restores the state of the object.
+        :param state: The state of the object.
+        """
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def connect(self):
+        """
+        Gets the connection for the current thread, creating the database if necessary.
+        :return: The connection.
+        """
+        # A forked process inherits the thread local storage of its parent, so make sure the connection is ours.
+        if getattr(self.local, "pid", None) == os.getpid():
+            return self.local.connection
+
+        directory = os.path.dirname(self.filename)
+        if directory != "" and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        connection = sqlite3.connect(self.filename, timeout=30)
+        for pragma in self.PRAGMAS:
+            connection.execute("PRAGMA " + pragma)
+
+        # Other processes may be opening the database at the same time, so the schema is created in one transaction.
+        connection.execute("BEGIN IMMEDIATE")
+        self.create_schema(connection)
+        connection.commit()
+
+        self.local.connection = connection
+        self.local.pid = os.getpid()
+        return connection
+
+    @abc.abstractmethod
+    def create_schema(self, connection):
+        """
+        Creates the tables of the database if they don't exist yet.
+        :param connection: The new connection, in a transaction that's committed afterwards.
+        """
+
+
+class HistoryCache(SQLiteStore):
+    """
+    A persistent cache of retrieved content records, such as user histories and post comments, stored in SQLite so it
+    can be shared between producer processes and between runs.
+
+    Content is grouped by an owner, e.g. "user:spez" or "post:3g1jfi", and a kind, e.g. "posts" or "comments". A kind
+    of content is only served from the cache once it has been retrieved completely.
+    """
+
+    # The version of the stored records, a cache of any other version is emptied when it's opened
+    VERSION = 1
+
+    def __init__(self, filename, ttl=3600, max_items=500000):
+        """
+        Initializes a new instance of the HistoryCache class.
+        :param filename: The SQLite database file to store the cache in.
+        :param ttl: The number of seconds after a complete retrieval before cached content is considered stale and
+        must be retrieved again in full.
+        :param max_items: The maximum number of records to store. The least recently used content is evicted first.
+        """
+        super().__init__(filename)
+        self.ttl = ttl
+        self.max_items = max_items
+
+    def create_schema(self, connection):
+        """
+        Creates the tables of the cache.
+        :param connection: The new connection, in a transaction.
+        """
+        # Records pickled by a different version may be missing attributes, so start over.
+        if connection.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            connection.execute("DROP TABLE IF EXISTS owners")
+            connection.execute("DROP TABLE IF EXISTS items")
+            connection.execute("PRAGMA user_version=" + str(self.VERSION))
+
+        connection.execute("CREATE TABLE IF NOT EXISTS owners (owner TEXT, kind TEXT, fetched REAL, accessed REAL, "
+                           "items INTEGER, PRIMARY KEY (owner, kind))")
+        connection.execute("CREATE TABLE IF NOT EXISTS items (owner TEXT, kind TEXT, name TEXT, position REAL, "
+                           "record BLOB, PRIMARY KEY (owner, kind, name))")
+
+    def get(self, owner, kind):
+        """
+        Gets the cached content of an owner.
+        :param owner: The owner of the content.
+        :param kind: The kind of content.
+        :return: The list of records, ordered newest first unless they were added in order, None if nothing complete
+        and fresh is cached.
+        """
+        try:
+            connection = self.connect()
+            row = connection.execute("SELECT fetched FROM owners WHERE owner = ? AND kind = ?",
+                                     (owner, kind)).fetchone()
+
+            if row is None or row[0] is None or row[0] < time.time() - self.ttl:
+                return None
+
+            connection.execute("UPDATE owners SET accessed = ? WHERE owner = ? AND kind = ?",
+                               (time.time(), owner, kind))
+            connection.commit()
+
+            return [pickle.loads(record) for (record,) in connection.execute(
+                "SELECT record FROM items WHERE owner = ? AND kind = ? ORDER BY position", (owner, kind))]
+        except Exception as e:
+            logger.log("HistoryCache.get: Error reading from the cache:", e)
+            return None
+
+    def list_owners(self):
+        """
+        Lists the content that has been retrieved completely, fresh or not.
+        :return: The list of tuples of the owner and kind of content, ordered by owner.
+        """
+        try:
+            connection = self.connect()
+            return connection.execute("SELECT owner, kind FROM owners WHERE fetched IS NOT NULL "
+                                      "ORDER BY owner, kind").fetchall()
+        except Exception as e:
+            logger.log("HistoryCache.list_owners: Error reading from the cache:", e)
+            return []
+
+    def iter_records(self, owner, kind):
+        """
+        Reads the cached content of an owner one record at a time, fresh or not, without holding it all in memory.
+        Unlike get it doesn't count as using the content.
+        :param owner: The owner of the content.
+        :param kind: The kind of content.
+        :return: A generator of records in the same order as get.
+        """
+        # A connection of our own so the cursor isn't disturbed if the thread's connection is used in the meantime.
+        connection = sqlite3.connect(self.filename, timeout=30)
+        try:
+            for (record,) in connection.execute("SELECT record FROM items WHERE owner = ? AND kind = ? "
+                                                "ORDER BY position", (owner, kind)):
+                yield pickle.loads(record)
+        finally:
+            connection.close()
+
+    def clear(self, owner, kind):
+        """
+        Removes the cached content of an owner.
+        :param owner: The owner of the content.
+        :param kind: The kind of content.
+        """
+        try:
+            connection = self.connect()
+            connection.execute("DELETE FROM items WHERE owner = ? AND kind = ?", (owner, kind))
+            connection.execute("DELETE FROM owners WHERE owner = ? AND kind = ?", (owner, kind))
+            connection.commit()
+        except Exception as e:
+            logger.log("HistoryCache.clear: Error clearing the cache:", e)
+
+    def add(self, owner, kind, records, in_order=False):
+        """
+        Adds records to the cached content of an owner, replacing any records with the same fullname.
+        :param owner: The owner of the content.
+        :param kind: The kind of content.
+        :param records: The list of records.
+        :param in_order: True if the records should be kept after the existing records in the order they were given,
+        such as a flattened comment tree, false if they should be ordered newest first.
+        """
+        if len(records) == 0:
+            return
+
+        try:
+            connection = self.connect()
+
+            if in_order:
+                start = connection.execute("SELECT COUNT(*) FROM items WHERE owner = ? AND kind = ?",
+                                           (owner, kind)).fetchone()[0]
+                positions = range(start, start + len(records))
+            else:
+                positions = [-record.created for record in records]
+
+            connection.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)",
+                                   [(owner, kind, record.name, position, pickle.dumps(record))
+                                    for record, position in zip(records, positions)])
+            connection.execute("INSERT OR IGNORE INTO owners VALUES (?, ?, NULL, ?, 0)", (owner, kind, time.time()))
+            connection.execute("UPDATE owners SET items = (SELECT COUNT(*) FROM items WHERE owner = ? AND kind = ?) "
+                               "WHERE owner = ? AND kind = ?", (owner, kind, owner, kind))
+            connection.commit()
+        except Exception as e:
+            logger.log("HistoryCache.add: Error writing to the cache:", e)
+
+    def complete(self, owner, kind):
+        """
+        Marks the cached content of an owner as completely retrieved so it will be served until it expires, then
+        evicts stale and excess content.
+        :param owner: The owner of the content.
+        :param kind: The kind of content.
+        """
+        try:
+            now = time.time()
+            connection = self.connect()
+            connection.execute("INSERT OR IGNORE INTO owners VALUES (?, ?, NULL, ?, 0)", (owner, kind, now))
+            connection.execute("UPDATE owners SET fetched = ?, accessed = ? WHERE owner = ? AND kind = ?",
+                               (now, now, owner, kind))
+            connection.commit()
+        except Exception as e:
+            logger.log("HistoryCache.complete: Error writing to the cache:", e)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes stale content, then removes the least recently used content until the cache is within its size bound.
+        """
+        try:
+            connection = self.connect()
+            # Partially retrieved content that hasn't been touched in a while was abandoned.
+            expiry = time.time() - self.ttl
+            evicted = connection.execute("SELECT owner, kind FROM owners WHERE fetched < ? OR "
+                                         "(fetched IS NULL AND accessed < ?)", (expiry, expiry)).fetchall()
+
+            # Walk the owners from most to least recently used, keeping as many as fit.
+            total = 0
+            for owner, kind, items in connection.execute(
+                    "SELECT owner, kind, items FROM owners WHERE fetched >= ? ORDER BY accessed DESC", (expiry,)):
+                total += items
+                if total > self.max_items:
+                    evicted.append((owner, kind))
+
+            for owner, kind in evicted:
+                connection.execute("DELETE FROM items WHERE owner = ? AND kind = ?", (owner, kind))
+                connection.execute("DELETE FROM owners WHERE owner = ? AND kind = ?", (owner, kind))
+            connection.commit()
+        except Exception as e:
+            logger.log("HistoryCache.evict: Error evicting from the cache:", e)
+
+
+class ResponseCache(SQLiteStore):
+    """
+    A short lived cache of raw responses from Reddit, stored in SQLite so every producer process can answer a request
+    another producer made moments ago without going back to Reddit. Unlike the HistoryCache it knows nothing about the
+    content, responses are stored by a key of the request that made them.
+    """
+
+    # The number of responses added by a process between evictions
+    EVICT_INTERVAL = 100
+
+    def __init__(self, filename, ttl=30, max_items=10000):
+        """
+        Initializes a new instance of the ResponseCache class.
+        :param filename: The SQLite database file to store the cache in.
+        :param ttl: The number of seconds a response is served from the cache.
+        :param max_items: The maximum number of responses to store. The oldest are evicted first.
+        """
+        super().__init__(filename)
+        self.ttl = ttl
+        self.max_items = max_items
+        self.added = 0
+
+    def create_schema(self, connection):
+        """
+        Creates the table of the cache.
+        :param connection: The new connection, in a transaction.
+        """
+        connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored REAL, status INTEGER, "
+                           "url TEXT, headers TEXT, content BLOB)")
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_stored ON responses (stored)")
+
+    def get(self, key):
+        """
+        Gets a cached response.
+        :param key: The key of the request.
+        :return: A tuple of the status code, URL, dictionary of headers and content of the response, None if nothing
+        fresh is cached.
+        """
+        try:
+            row = self.connect().execute("SELECT status, url, headers, content FROM responses WHERE key = ? AND "
+                                         "stored >= ?", (key, time.time() - self.ttl)).fetchone()
+            if row is None:
+                return None
+
+            status, url, headers, content = row
+            return status, url, json.loads(headers), content
+        except Exception as e:
+            logger.log("ResponseCache.get: Error reading from the cache:", e)
+            return None
+
+    def add(self, key, status, url, headers, content):
+        """
+        Adds a response, replacing any cached for the same key.
+        :param key: The key of the request.
+        :param status: The status code.
+        :param url: The URL of the response.
+        :param headers: The dictionary of headers.
+        :param content: The content as bytes.
+        """
+        try:
+            connection = self.connect()
+            connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, time.time(), status, url, json.dumps(headers), content))
+            connection.commit()
+        except Exception as e:
+            logger.log("ResponseCache.add: Error writing to the cache:", e)
+            return
+
+        self.added += 1
+        if self.added % self.EVICT_INTERVAL == 0:
+            self.evict()
+
+    def clear(self):
+        """
+        Removes every cached response.
+        """
+        try:
+            connection = self.connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+        except Exception as e:
+            logger.log("ResponseCache.clear: Error clearing the cache:", e)
+
+    def evict(self):
+        """
+        Removes expired responses, then the oldest responses until the cache is within its size bound.
+        """
+        try:
+            connection = self.connect()
+            connection.execute("DELETE FROM responses WHERE stored < ?", (time.time() - self.ttl,))
+            connection.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY stored DESC "
+                               "LIMIT -1 OFFSET ?)", (self.max_items,))
+            connection.commit()
+        except Exception as e:
+            logger.log("ResponseCache.evict: Error evicting from the cache:", e)
@@ -3,3 +3,31 @@ import appdirs
 
 user_data_folder = appdirs.user_data_dir("Reddit_Bot")
 user_data_file = os.path.join(appdirs.user_data_dir("Reddit_Bot"), "UserData.dat")
+cache_file = os.path.join(appdirs.user_data_dir("Reddit_Bot"), "Cache.db")
+response_cache_file = os.path.join(appdirs.user_data_dir("Reddit_Bot"), "Responses.db")
+search_index_file = os.path.join(appdirs.user_data_dir("Reddit_Bot"), "Search.db")
+
+# How long, in seconds, retrieved content is kept in the cache before it's retrieved again in full
+cache_ttl = 3600
+
+# The maximum number of retrieved items kept in the cache
+cache_max_items = 500000
+
+# How long, in seconds, a response from Reddit is reused for an identical request by any producer
+response_cache_ttl = 30
+
+# The maximum number of responses from Reddit kept for reuse
+response_cache_max_items = 10000
+
+# The number of items retrieved per page when streaming results back to the form
+results_page_size = 100
+
+# The number of most recent comments retrieved for each commenter when looking into who participates in a post
+author_history_limit = 100
+
+# The maximum number of results shown for a search of retrieved content
+search_results_limit = 1000
+
+# The number of records a list in a response needs to be sent from a producer through shared memory instead of the
+# queue, smaller ones are quicker to pickle
+shared_memory_records = 5000
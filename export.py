@@ -0,0 +1,207 @@
+import abc
+import csv
+import importlib.util
+import json
+import sys
+
+from records import Record
+
+# The columns written for each record, the query is the input the record was found for
+FIELDS = Record.__slots__ + ("query",)
+
+# The formats that can be written
+FORMATS = ("jsonl", "csv", "parquet")
+
+
+class RecordWriter(abc.ABC):
+    """
+    Writes records to a file as they arrive, so a history of any size can be exported without holding it in memory.
+    Pages of records can be passed straight from a streaming get_user or get_post.
+    """
+
+    def __init__(self, file, close_file=False):
+        """
+        Initializes a new instance of the RecordWriter class.
+        :param file: The file object to write to.
+        :param close_file: True to close the file when the writer is closed, false to leave it open.
+        """
+        self.file = file
+        self.close_file = close_file
+        self.count = 0
+
+    def __enter__(self):
+        """
+        Needed for with, the writer is closed when the block is left.
+        :return: The writer.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Needed for with, closes the writer.
+        """
+        self.close()
+
+    def write(self, records, query=None):
+        """
+        Writes records.
+        :param records: An iterable of records, e.g. a page.
+        :param query: The input the records were found for, e.g. a username, written with each record.
+        """
+        for record in records:
+            row = record.to_dict()
+            row["query"] = query
+            self.write_row(row)
+            self.count += 1
+
+        self.flush()
+
+    @abc.abstractmethod
+    def write_row(self, row):
+        """
+        Writes the values of a record.
+        :param row: The dictionary of values by field name.
+        """
+
+    def flush(self):
+        """
+        Makes sure what's been written so far is in the file.
+        """
+        self.file.flush()
+
+    def close(self):
+        """
+        Finishes writing.
+        """
+        self.flush()
+        if self.close_file:
+            self.file.close()
+
+
+class JsonLinesWriter(RecordWriter):
+    """
+    Writes records as JSON Lines, one object per line.
+    """
+
+    def write_row(self, row):
+        """
+        Writes the values of a record.
+        :param row: The dictionary of values by field name.
+        """
+        self.file.write(json.dumps(row) + "\n")
+
+
+class CsvWriter(RecordWriter):
+    """
+    Writes records as comma separated values with a header row.
+    """
+
+    def __init__(self, file, close_file=False):
+        """
+        Initializes a new instance of the CsvWriter class.
+        :param file: The file object to write to, opened with newline="".
+        :param close_file: True to close the file when the writer is closed, false to leave it open.
+        """
+        super().__init__(file, close_file)
+        self.writer = csv.DictWriter(file, FIELDS)
+        self.writer.writeheader()
+
+    def write_row(self, row):
+        """
+        Writes the values of a record.
+        :param row: The dictionary of values by field name.
+        """
+        self.writer.writerow(row)
+
+
+class ParquetWriter(RecordWriter):
+    """
+    Writes records as an Apache Parquet file, which stores each field as a compressed column. Records are buffered
+    until there are enough for a row group, so memory stays bounded by the row group size. Requires pyarrow.
+    """
+
+    def __init__(self, file, close_file=False, row_group_size=50000):
+        """
+        Initializes a new instance of the ParquetWriter class.
+        :param file: The binary file object to write to.
+        :param close_file: True to close the file when the writer is closed, false to leave it open.
+        :param row_group_size: The number of records buffered before they're written.
+        """
+        # Imported here since pyarrow is only needed for this format.
+        import pyarrow
+        import pyarrow.parquet
+
+        super().__init__(file, close_file)
+        self.pyarrow = pyarrow
+        self.row_group_size = row_group_size
+
+        self.schema = pyarrow.schema([("id", pyarrow.string()), ("name", pyarrow.string()),
+                                      ("kind", pyarrow.string()), ("author", pyarrow.string()),
+                                      ("subreddit", pyarrow.string()), ("score", pyarrow.int64()),
+                                      ("created", pyarrow.float64()), ("archived", pyarrow.bool_()),
+                                      ("title", pyarrow.string()), ("body", pyarrow.string()),
+                                      ("parent_id", pyarrow.string()), ("depth", pyarrow.int32()),
+                                      ("query", pyarrow.string())])
+        self.writer = pyarrow.parquet.ParquetWriter(file, self.schema, compression="zstd")
+
+        # The buffered values of each field
+        self.columns = {name: [] for name in FIELDS}
+
+    def write_row(self, row):
+        """
+        Buffers the values of a record.
+        :param row: The dictionary of values by field name.
+        """
+        for name, column in self.columns.items():
+            column.append(row[name])
+
+        if len(self.columns["name"]) >= self.row_group_size:
+            self.write_row_group()
+
+    def write_row_group(self):
+        """
+        Writes the buffered records as a row group.
+        """
+        if len(self.columns["name"]) == 0:
+            return
+
+        self.writer.write_table(self.pyarrow.Table.from_pydict(self.columns, schema=self.schema))
+        self.columns = {name: [] for name in FIELDS}
+
+    def flush(self):
+        """
+        Parquet files are written a row group at a time, so there's nothing to do until one is full.
+        """
+
+    def close(self):
+        """
+        Writes the remaining records and the footer of the file.
+        """
+        self.write_row_group()
+        self.writer.close()
+        super().close()
+
+
+def open_writer(format, filename=None):
+    """
+    Creates a writer for a format.
+    :param format: One of FORMATS.
+    :param filename: The file to write to, None for standard output.
+    :return: The RecordWriter. Closing it closes the file, unless it's standard output.
+    """
+    if format == "jsonl":
+        writer_type = JsonLinesWriter
+    elif format == "csv":
+        writer_type = CsvWriter
+    elif format == "parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            raise RuntimeError("Writing Parquet requires pyarrow, install it with: pip install pyarrow")
+        writer_type = ParquetWriter
+    else:
+        raise ValueError("Unknown export format \"" + str(format) + "\"")
+
+    binary = format == "parquet"
+    if filename is None:
+        return writer_type(sys.stdout.buffer if binary else sys.stdout)
+
+    return writer_type(open(filename, "wb") if binary else open(filename, "w", newline="", encoding="utf-8"), True)
@@ -1,6 +1,10 @@
+import collections
+import threading
 from enum import Enum
 from tkinter import *
 
+import logger
+
 
 def setup_resizable(control):
     """
@@ -36,10 +40,18 @@ def setup_state(control, state):
 
 
 class MainForm(Tk):
-    def __init__(self):
+    def __init__(self, flush_interval=50, max_batch_size=500):
+        """
+        Initializes a new instance of the MainForm class.
+        :param flush_interval: The number of milliseconds between running the calls marshalled from other threads.
+        :param max_batch_size: The maximum number of marshalled calls run at once before letting the form respond.
+        """
         # Call base
         Tk.__init__(self)
 
+        # Runs calls from other threads on the main loop
+        self.dispatcher = Dispatcher(self, flush_interval, max_batch_size)
+
         # Log in panel
         self.panel_login = LabelFrame(self, text="Login", padx=5, pady=5)
         Label(self.panel_login, text="Token:").grid(row=0, column=0)
@@ -95,11 +107,32 @@ class MainForm(Tk):
         frame.grid(row=1, column=0, columnspan=2)
         self.panel_data.grid(row=2, column=2, sticky=N + S + E + W)
 
+        # Search panel, dates are YYYY-MM-DD
+        self.panel_search = LabelFrame(self, text="Search Retrieved Content", padx=5, pady=5)
+        Label(self.panel_search, text="Text:").grid(row=0, column=0, sticky=W)
+        self.entry_search_text = Entry(self.panel_search)
+        self.entry_search_text.grid(row=0, column=1, columnspan=3, sticky=E + W)
+        Label(self.panel_search, text="Author:").grid(row=1, column=0, sticky=W)
+        self.entry_search_author = Entry(self.panel_search)
+        self.entry_search_author.grid(row=1, column=1, sticky=E + W)
+        Label(self.panel_search, text="Subreddit:").grid(row=1, column=2, sticky=W)
+        self.entry_search_subreddit = Entry(self.panel_search)
+        self.entry_search_subreddit.grid(row=1, column=3, sticky=E + W)
+        Label(self.panel_search, text="From:").grid(row=2, column=0, sticky=W)
+        self.entry_search_after = Entry(self.panel_search)
+        self.entry_search_after.grid(row=2, column=1, sticky=E + W)
+        Label(self.panel_search, text="To:").grid(row=2, column=2, sticky=W)
+        self.entry_search_before = Entry(self.panel_search)
+        self.entry_search_before.grid(row=2, column=3, sticky=E + W)
+        self.button_search = Button(self.panel_search, text="Search")
+        self.button_search.grid(row=3, column=0, columnspan=4)
+        self.panel_search.grid(row=3, column=0, columnspan=3, sticky=E + W)
+
         # Results panel
         self.panel_results = LabelFrame(self, text="Results")
         self.results = ScrollableControlBecauseTkinterIsAShitTechnology(self.panel_results)
         self.results.grid(sticky=N + S + E + W)
-        self.panel_results.grid(row=3, column=0, columnspan=3, sticky=N + S + E + W)
+        self.panel_results.grid(row=4, column=0, columnspan=3, sticky=N + S + E + W)
 
         # Setup the form to be universally resizable
         setup_resizable(self)
@@ -107,9 +140,12 @@ class MainForm(Tk):
         # Specifically override
         Grid.columnconfigure(self.panel_login, 0, weight=0)
         Grid.columnconfigure(self.panel_data, 0, weight=0)
+        Grid.columnconfigure(self.panel_search, 0, weight=0)
+        Grid.columnconfigure(self.panel_search, 2, weight=0)
         Grid.rowconfigure(self, 0, weight=0)
         Grid.rowconfigure(self, 1, weight=0)
         Grid.rowconfigure(self, 2, weight=0)
+        Grid.rowconfigure(self, 3, weight=0)
 
         # Default values
         self.radiobutton_action_type.set("1")
@@ -125,6 +161,15 @@ class MainForm(Tk):
         elif selection == 2 or selection == 3:
             self.label_data.configure(text="Post Id:")
 
+    def marshal(self, callback, key=None):
+        """
+        Wraps a callback so it can be called from any thread but runs on the main loop.
+        :param callback: The callback.
+        :param key: See Dispatcher.invoke.
+        :return: The wrapped callback.
+        """
+        return lambda *args: self.dispatcher.invoke(callback, *args, key=key)
+
     def show(self):
         """
         Shows the form.
@@ -132,6 +177,76 @@ class MainForm(Tk):
         self.mainloop()
 
 
+class Dispatcher:
+    """
+    Collects calls made from other threads and runs them on the Tk main loop in batches. Tk isn't thread safe, and
+    running many calls at once lets the form redraw once per batch rather than once per call.
+    """
+
+    def __init__(self, root, flush_interval, max_batch_size):
+        """
+        Initializes a new instance of the Dispatcher class and starts flushing.
+        :param root: The root window whose main loop runs the calls.
+        :param flush_interval: The number of milliseconds between flushes.
+        :param max_batch_size: The maximum number of calls run per flush.
+        """
+        self.root = root
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+
+        # The calls waiting to run, in order, and the waiting calls that have a key by key
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.pending_by_key = {}
+
+        self.root.after(self.flush_interval, self.flush)
+
+    def invoke(self, callback, *args, key=None):
+        """
+        Queues a call to run on the main loop. Safe to call from any thread.
+        :param callback: The callback to call.
+        :param args: The arguments to pass to the callback.
+        :param key: If provided, a function of the arguments that identifies what the call updates. A call replaces a
+        waiting call with the same key, keeping its place in line, so only the latest update is run.
+        """
+        identifier = key(*args) if key is not None else None
+
+        with self.lock:
+            if identifier is not None and identifier in self.pending_by_key:
+                entry = self.pending_by_key[identifier]
+                entry[1] = callback
+                entry[2] = args
+                return
+
+            entry = [identifier, callback, args]
+            self.pending.append(entry)
+            if identifier is not None:
+                self.pending_by_key[identifier] = entry
+
+    def flush(self):
+        """
+        Runs a batch of waiting calls, then schedules the next flush.
+        """
+        with self.lock:
+            batch = []
+            while len(self.pending) > 0 and len(batch) < self.max_batch_size:
+                entry = self.pending.popleft()
+                if entry[0] is not None:
+                    del self.pending_by_key[entry[0]]
+                batch.append(entry)
+
+            backlog = len(self.pending) > 0
+
+        for identifier, callback, args in batch:
+            try:
+                callback(*args)
+            except Exception as ex:
+                logger.log("Dispatcher.flush: Caught the following exception during method invocation: ", ex, sep="")
+
+        # If we're behind, carry on as soon as the form has had a chance to handle its own events.
+        self.root.after(1 if backlog else self.flush_interval, self.flush)
+
+
 class ActionType(Enum):
     """
     Specifies the types of actions that can be performed.
@@ -150,101 +265,281 @@ class Action(Enum):
     Clear = 3
 
 
+class Row:
+    """
+    The model of a single row in a ScrollableControlBecauseTkinterIsAShitTechnology. Rows only get a widget while
+    they're visible, so they're styled through configure like a widget and the control redraws them if necessary.
+    """
+
+    __slots__ = ("owner", "text", "title", "style", "_id")
+
+    def __init__(self, owner, text, title):
+        """
+        Initializes a new instance of the Row class.
+        :param owner: The control that displays the row.
+        :param text: The text of the row.
+        :param title: True if the row is a title, false otherwise.
+        """
+        self.owner = owner
+        self.text = text
+        self.title = title
+        self.style = {}
+        self._id = None
+
+    @property
+    def id(self):
+        """
+        Gets the identifier of the row, nominally the fullname of the content it displays.
+        :return: The identifier, None if there isn't one.
+        """
+        return self._id
+
+    @id.setter
+    def id(self, value):
+        """
+        Sets the identifier of the row, keeping the control's index of rows up to date.
+        :param value: The identifier.
+        """
+        self.owner.reindex(self, self._id, value)
+        self._id = value
+
+    def configure(self, **style):
+        """
+        Styles the row with the same options a Label takes.
+        :param style: The options to apply.
+        """
+        self.style.update(style)
+        self.owner.schedule_redraw()
+
+    config = configure
+
+
 class ScrollableControlBecauseTkinterIsAShitTechnology(Frame):
     """
-    A scrollable control that you can add and remove labels from.
+    A scrollable control that you can add and remove labels from. Only the rows that are visible have a label, the
+    rest only exist as Row models, so adding rows is constant time and scrolling only redraws what can be seen.
     """
 
     def __init__(self, root):
         Frame.__init__(self, root)
-        self.canvas = None
+        self.viewport = None
         self.vsb = None
-        self.frame = None
-        self.frame_id = None
+
+        # The models of every row, the rows with an identifier by identifier and the index of the row at the top of
+        # the viewport
+        self.rows = []
+        self.rows_by_id = {}
+        self.top = 0
+
+        # The labels that display the visible rows, reused as the control scrolls
+        self.labels = []
+        self.label_bg = None
+        self.label_fg = None
+        self.row_height = 1
+        self.redraw_pending = False
+
         self.create_controls()
 
     def create_controls(self):
         """
         Creates all the sub-controls of this control.
         """
-        self.canvas = Canvas(self, borderwidth=0)
-        self.canvas.grid(row=0, sticky=N + S + E + W)
-        self.canvas.bind("<Configure>", self.on_canvas_resize)
+        self.viewport = Frame(self, borderwidth=0)
+        self.viewport.grid(row=0, sticky=N + S + E + W)
+        self.viewport.bind("<Configure>", lambda event: self.schedule_redraw())
 
-        self.vsb = Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.vsb = Scrollbar(self, orient="vertical", command=self.yview)
         self.vsb.grid(row=0, sticky=N + S + E)
-        self.canvas.configure(yscrollcommand=self.vsb.set)
 
-        self.frame = Frame(self.canvas)
-        self.frame_id = self.canvas.create_window((4, 4), window=self.frame, anchor="nw")
-        self.frame.bind("<Configure>", self.on_frame_resize)
-        setup_resizable(self.frame)
+        # Measure a row using a throwaway label with the same styling as the real ones.
+        label = Label(self.viewport, text="Measure")
+        self.label_bg = label.cget("bg")
+        self.label_fg = label.cget("fg")
+        self.row_height = label.winfo_reqheight()
+        label.destroy()
+
+        # Scroll with the mouse wheel anywhere over the rows.
+        for control in (self.viewport, self.vsb):
+            self.bind_scrolling(control)
+
+    def bind_scrolling(self, control):
+        """
+        Binds the mouse wheel on a control to scroll the rows.
+        :param control: The control.
+        """
+        control.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1, "units"))
+        control.bind("<Button-4>", lambda event: self.scroll(-1, "units"))
+        control.bind("<Button-5>", lambda event: self.scroll(1, "units"))
 
     def add_title(self, text):
         """
         Adds a title cell to the list.
         :param text: The text to display in the title.
-        :return: The created control.
+        :return: The created row.
         """
-        label = Label(self.frame, text=text, border=1, bg="grey")
-        label.grid(row=len(self.frame.children), sticky=E + W)
-        setup_resizable(self.frame)
-        return label
+        return self.add_row(Row(self, text, True))
 
-    def add_content(self, text):
+    def add_content(self, text, id=None):
         """
-        Add a control to the list.
-        :param text: The text of the label to add.
-        :return: The created control.
+        Add a row to the list.
+        :param text: The text of the row to add.
+        :param id: The identifier used to look the row up later, nominally the fullname of the content it displays.
+        :return: The created row.
         """
         # Sanitize the text
-        text = text.replace("\r", " ").replace("\n", " ").encode("ascii", "ignore")
+        text = text.replace("\r", " ").replace("\n", " ").encode("ascii", "ignore").decode("ascii")
+
+        row = self.add_row(Row(self, text, False))
+        if id is not None:
+            row.id = id
+
+        return row
+
+    def add_row(self, row):
+        """
+        Appends a row. Any number of rows added at once only cause a single redraw.
+        :param row: The row to add.
+        :return: The added row.
+        """
+        self.rows.append(row)
 
-        label = Label(self.frame, text=text)
-        label.grid(row=len(self.frame.children), stick=W)
-        setup_resizable(self.frame)
-        return label
+        # Even if the row isn't visible the scrollbar needs updating, which is done by the redraw.
+        self.schedule_redraw()
+        return row
 
     def get_content(self, query):
         """
         Gets added content that matches a given query.
         :param query: The query.
-        :return: The first instance of a given query, none if nothing is found.
+        :return: The first row matching a given query, none if nothing is found.
         """
-        for child in self.frame.children.values():
-            if query(child):
-                return child
+        for row in self.rows:
+            if query(row):
+                return row
 
         return None
 
+    def get_by_id(self, id):
+        """
+        Gets the row with a given identifier in constant time.
+        :param id: The identifier.
+        :return: The first row added with the identifier, None if there isn't one.
+        """
+        return self.rows_by_id.get(id, None)
+
+    def update_row(self, id, **style):
+        """
+        Styles the row with a given identifier in constant time.
+        :param id: The identifier.
+        :param style: The options to apply, the same options a Label takes.
+        :return: True if the row was found, false otherwise.
+        """
+        row = self.rows_by_id.get(id, None)
+        if row is None:
+            return False
+
+        row.configure(**style)
+        return True
+
+    def reindex(self, row, old_id, new_id):
+        """
+        Updates the index of rows by identifier when the identifier of a row changes.
+        :param row: The row.
+        :param old_id: The previous identifier, may be None.
+        :param new_id: The new identifier, may be None.
+        """
+        if old_id is not None and self.rows_by_id.get(old_id, None) is row:
+            del self.rows_by_id[old_id]
+
+        if new_id is not None:
+            self.rows_by_id.setdefault(new_id, row)
+
     def clear(self):
         """
-        Clears the panel of all added controls.
+        Clears the panel of all added rows.
+        """
+        self.rows = []
+        self.rows_by_id = {}
+        self.top = 0
+        self.schedule_redraw()
+
+    def visible_rows(self):
+        """
+        Gets the number of rows that fit in the viewport.
+        :return: The number of rows.
         """
-        if self.vsb is not None:
-            self.vsb.destroy()
-            self.vsb = None
+        return max(self.viewport.winfo_height() // self.row_height, 1)
 
-        if self.frame is not None:
-            self.frame.destroy()
-            self.frame = None
+    def yview(self, *args):
+        """
+        Handles the scrollbar being dragged or clicked.
+        :param args: Either "moveto" and a fraction or "scroll", a number and "units" or "pages".
+        """
+        if len(args) == 0:
+            return
 
-        if self.canvas is not None:
-            self.canvas.destroy()
-            self.canvas = None
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.rows)))
+        elif args[0] == "scroll":
+            self.scroll(int(args[1]), args[2])
 
-        self.create_controls()
+    def scroll(self, amount, what):
+        """
+        Scrolls the rows.
+        :param amount: The number of units or pages to scroll by, negative to scroll up.
+        :param what: Either "units" to scroll by rows or "pages" to scroll by the height of the viewport.
+        """
+        if what == "pages":
+            amount *= self.visible_rows()
+
+        self.scroll_to(self.top + amount)
+
+    def scroll_to(self, top):
+        """
+        Scrolls so a row is at the top of the viewport.
+        :param top: The index of the row.
+        """
+        top = max(min(top, len(self.rows) - self.visible_rows()), 0)
+        if top != self.top:
+            self.top = top
+            self.schedule_redraw()
 
-    def on_frame_resize(self, event):
+    def schedule_redraw(self):
         """
-        Reset the scroll region to encompass the inner frame.
-        :param event: The event arguments.
+        Redraws the visible rows once the event loop is idle, coalescing any number of changes into a single redraw.
         """
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            self.after_idle(self.redraw)
 
-    def on_canvas_resize(self, event):
+    def redraw(self):
         """
-        Resizes the control region of the canvas.
-        :param event: The event arguments.
+        Displays the visible rows, reusing the labels from the previous redraw.
         """
-        self.canvas.itemconfigure(self.frame_id, width=event.width)
+        self.redraw_pending = False
+
+        visible = self.visible_rows()
+        while len(self.labels) < visible:
+            label = Label(self.viewport, anchor=W)
+            self.bind_scrolling(label)
+            self.labels.append(label)
+
+        width = -self.vsb.winfo_width()
+        for x, label in enumerate(self.labels):
+            index = self.top + x
+            if x >= visible or index >= len(self.rows):
+                label.place_forget()
+                continue
+
+            row = self.rows[index]
+            options = {"text": row.text, "bg": "grey" if row.title else self.label_bg, "fg": self.label_fg,
+                       "anchor": CENTER if row.title else W, "border": 1 if row.title else 0}
+            options.update(row.style)
+            label.configure(**options)
+            label.place(x=0, y=x * self.row_height, relwidth=1, width=width, height=self.row_height)
+
+        # Update the scrollbar to reflect the portion of the rows that are visible.
+        if len(self.rows) == 0:
+            self.vsb.set(0, 1)
+        else:
+            self.vsb.set(self.top / len(self.rows), min((self.top + visible) / len(self.rows), 1))
@@ -0,0 +1,141 @@
+import hashlib
+import threading
+import time
+
+import praw.handlers
+import requests
+import requests.adapters
+
+
+class ScheduledHandler(praw.handlers.DefaultHandler):
+    """
+    A PRAW handler that takes every request made to Reddit from a RateLimiter shared by all producers instead of
+    spacing requests out per process, and feeds the rate limit headers of each response back to it. Reads can be
+    answered from a ResponseCache shared by all producers first, and connections are kept alive in a pool large enough
+    for every thread of a client. Subclasses can change where requests go by overriding dispatch.
+    """
+
+    def __init__(self, limiter=None, response_cache=None, pool_size=10):
+        """
+        Initializes a new instance of the ScheduledHandler class.
+        :param limiter: The RateLimiter shared by all producers, None to make requests as soon as they're asked for.
+        :param response_cache: The ResponseCache shared by all producers, None to always make requests.
+        :param pool_size: The number of connections kept alive to each host, at least the number of threads making
+        requests at once so none of them has to open a new connection.
+        """
+        super().__init__()
+        self.limiter = limiter
+        self.response_cache = response_cache
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+        # The seconds spent waiting on the rate limiter and on responses, and how often the response cache could
+        # answer, across every thread making requests
+        self.stats_lock = threading.Lock()
+        self.stats = {"rate_limit_wait": 0.0, "http": 0.0, "cache_hits": 0, "cache_misses": 0}
+
+    def send(self, request, proxies, timeout, verify, **_):
+        """
+        Answers a request from the response cache or dispatches it once the rate limiter allows it. PRAW's own rate
+        limiting arguments are ignored.
+        :param request: A requests.PreparedRequest containing all the data necessary to perform the request.
+        :param proxies: A dictionary of proxy settings to be utilized for the request.
+        :param timeout: Specifies the maximum time that the actual HTTP request can take.
+        :param verify: Specifies if SSL certificates should be validated.
+        :return: The requests.Response.
+        """
+        key = get_cache_key(request) if self.response_cache is not None else None
+        if key is not None:
+            cached = self.response_cache.get(key)
+            self.add_stat("cache_hits" if cached is not None else "cache_misses", 1)
+            if cached is not None:
+                return create_cached_response(request, *cached)
+
+        start = time.perf_counter()
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+        sent = time.perf_counter()
+        response = self.dispatch(request, proxies, timeout, verify)
+
+        self.add_stat("rate_limit_wait", sent - start)
+        self.add_stat("http", time.perf_counter() - sent)
+
+        if self.limiter is not None:
+            self.limiter.update(response.status_code, response.headers)
+
+        if key is not None and response.status_code == 200:
+            self.response_cache.add(key, response.status_code, response.url, dict(response.headers), response.content)
+        return response
+
+    def add_stat(self, name, value):
+        """
+        Adds to one of the statistics of the requests made.
+        :param name: The name of the statistic.
+        :param value: The amount to add.
+        """
+        with self.stats_lock:
+            self.stats[name] += value
+
+    def get_stats(self):
+        """
+        Gets the statistics of the requests made so far.
+        :return: A dictionary of the seconds spent waiting on the rate limiter and on responses, under rate_limit_wait
+        and http, and the number of requests the response cache did and didn't answer, under cache_hits and
+        cache_misses.
+        """
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def dispatch(self, request, proxies, timeout, verify):
+        """
+        Makes a request to Reddit.
+        :param request: A requests.PreparedRequest containing all the data necessary to perform the request.
+        :param proxies: A dictionary of proxy settings to be utilized for the request.
+        :param timeout: Specifies the maximum time that the actual HTTP request can take.
+        :param verify: Specifies if SSL certificates should be validated.
+        :return: The requests.Response.
+        """
+        settings = self.http.merge_environment_settings(request.url, proxies, False, verify, None)
+        return self.http.send(request, timeout=timeout, allow_redirects=False, **settings)
+
+
+# Cached responses don't need to be scheduled, so the cache is checked first.
+ScheduledHandler.request = praw.handlers.DefaultHandler.with_cache(ScheduledHandler.send)
+
+
+def get_cache_key(request):
+    """
+    Gets the key a request's response is cached under. Only reads are cached, and the login is part of the key so
+    no one is answered with what someone else was allowed to see.
+    :param request: The requests.PreparedRequest.
+    :return: The key, None if the response can't be cached.
+    """
+    if request.method != "GET" or "access_token" in request.url:
+        return None
+
+    body = request.body.decode("utf-8") if isinstance(request.body, bytes) else request.body or ""
+    identity = request.url + " " + body + " " + request.headers.get("Authorization", "")
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+def create_cached_response(request, status, url, headers, content):
+    """
+    Creates a response to a request from a cached one.
+    :param request: The requests.PreparedRequest.
+    :param status: The HTTP status code.
+    :param url: The URL of the response.
+    :param headers: The dictionary of headers.
+    :param content: The content as bytes.
+    :return: The requests.Response.
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.url = url
+    response.request = request
+    response.headers.update(headers)
+    response._content = content
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
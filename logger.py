@@ -1,11 +1,131 @@
+"""
+The log of the application, written to standard error so it doesn't mix with any output. Messages have a level and
+are dropped before they're formatted when it's below the configured level, so debug messages on hot paths cost next
+to nothing. Any keyword arguments are written as structured fields after the message, e.g.
+    logger.debug("EmbeddedProxy.producer_main: Finished", method="get_user", seconds=0.25)
+
+The level is WARNING unless set with configure or the REDDIT_BOT_LOG_LEVEL environment variable, and the format is
+text unless REDDIT_BOT_LOG_FORMAT is json.
+"""
+import json
+import logging
+import os
 import sys
 
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+# The logger everything is written to, kept apart from the root logger of any library
+base = logging.getLogger("reddit_bot")
+base.propagate = False
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats a message and its fields either as text, with the fields as key=value pairs, or as a JSON object per line.
+    """
+
+    def __init__(self, json_format=False):
+        """
+        Initializes a new instance of the StructuredFormatter class.
+        :param json_format: True to write JSON objects, false to write text.
+        """
+        super().__init__()
+        self.json_format = json_format
+
+    def format(self, record):
+        """
+        Formats a record.
+        :param record: The logging.LogRecord.
+        :return: The line to write.
+        """
+        fields = getattr(record, "fields", {})
+        if self.json_format:
+            entry = {"time": record.created, "level": record.levelname, "process": record.process,
+                     "message": record.getMessage()}
+            entry.update(fields)
+            return json.dumps(entry, default=str)
+
+        text = record.getMessage()
+        if record.levelno != WARNING:
+            text = record.levelname + " " + text
+        for name, value in fields.items():
+            text += " " + name + "=" + (json.dumps(value) if isinstance(value, str) and " " in value else str(value))
+        return text
+
+
+def configure(level=None, json_format=None, stream=None):
+    """
+    Sets up where and how the log is written. Called on import with the settings of the environment.
+    :param level: The lowest level written, a number or a name such as "debug", None for the environment's or WARNING.
+    :param json_format: True to write JSON objects, false to write text, None for the environment's or text.
+    :param stream: The file to write to, None for standard error.
+    """
+    if level is None:
+        level = os.environ.get("REDDIT_BOT_LOG_LEVEL", WARNING)
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    if json_format is None:
+        json_format = os.environ.get("REDDIT_BOT_LOG_FORMAT", "text").lower() == "json"
+
+    handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    handler.setFormatter(StructuredFormatter(json_format))
+
+    for existing in list(base.handlers):
+        base.removeHandler(existing)
+    base.addHandler(handler)
+    base.setLevel(level)
+
+
+def log(*args, level=WARNING, sep=" ", file=None, **fields):
+    """
+    Writes to the log. Takes the same arguments as print, which is how it used to be written.
+    :param args: The arguments, joined by the separator into the message.
+    :param level: The level of the message, WARNING by default.
+    :param sep: The separator between the arguments.
+    :param file: A file to print the message to instead of the log, None for the log.
+    :param fields: The structured fields of the message.
+    """
+    if file is not None and file is not sys.stderr:
+        print(*args, sep=sep, file=file)
+        file.flush()
+        return
+
+    # Don't even format the message if it won't be written.
+    if not base.isEnabledFor(level):
+        return
+
+    base.log(level, sep.join(str(arg) for arg in args), extra={"fields": fields})
+
+
+def debug(*args, **fields):
+    """
+    Writes a debug message to the log, see log.
+    """
+    log(*args, level=DEBUG, **fields)
+
+
+def info(*args, **fields):
+    """
+    Writes an informational message to the log, see log.
+    """
+    log(*args, level=INFO, **fields)
+
 
-def log(*args, **params):
+def warning(*args, **fields):
     """
-    Prints to the log.
-    :param args: The arguments.
-    :param params: The parameters.
+    Writes a warning to the log, see log.
     """
-    print(*args, **params)
-    sys.stdout.flush()
+    log(*args, level=WARNING, **fields)
+
+
+def error(*args, **fields):
+    """
+    Writes an error to the log, see log.
+    """
+    log(*args, level=ERROR, **fields)
+
+
+configure()
@@ -1,8 +1,10 @@
 import tkinter
 
+import cache
 import gui
 import logger
 import reddit_client
+import search
 from constants import *
 
 
@@ -14,7 +16,7 @@ def on_button_login_click():
     gui.setup_state(main_form.panel_login, tkinter.DISABLED)
 
     # Asynchronously login
-    reddit.login_first_time(main_form.entry_access_token.get())
+    reddit.login_first_time(main_form.entry_access_token.get()).then(main_form.marshal(on_login_first_time))
 
 
 def on_login_first_time(is_logged_in):
@@ -39,8 +41,7 @@ def on_is_logged_in(is_logged_in):
     if is_logged_in:
         main_form.entry_access_token.configure(bg="white")
         gui.setup_state(main_form.panel_login, tkinter.DISABLED)
-        reddit.add_callback("get_me", lambda username: main_form.label_current_user.configure(text=username), 1)
-        reddit.get_me()
+        reddit.get_me().then(main_form.marshal(lambda username: main_form.label_current_user.configure(text=username)))
     else:
         gui.setup_state(main_form.panel_login, tkinter.NORMAL)
         main_form.label_current_user.configure(text="")
@@ -60,44 +61,39 @@ def on_button_get_click():
     if main_form.radiobutton_action_type.get() == gui.ActionType.User.value:
         username = main_form.entry_data.get()
         if username is not None:
-            reddit.add_callback("get_user", on_get_user, 1)
-            reddit.get_user(username, True, True)
+            reddit.get_user(username, True, True, page_size=results_page_size).then(main_form.marshal(on_get_user))
     elif main_form.radiobutton_action_type.get() == gui.ActionType.Post_Comments.value:
         post_id = main_form.entry_data.get()
         if post_id is not None:
-            reddit.add_callback("get_post", on_get_post, 1)
-            reddit.get_post(post_id, True)
+            reddit.get_post(post_id, True).then(main_form.marshal(on_get_post))
     elif main_form.radiobutton_action_type.get() == gui.ActionType.Post_User_Comments.value:
-        pass
+        post_id = main_form.entry_data.get()
+        if post_id is not None:
+            reddit.get_post(post_id, True).then(main_form.marshal(on_get_post_users))
 
 
-def on_get_user(user):
+def on_get_user(page):
     """
-    Writes all user data to the form.
-    :param user: The user data.
+    Writes a page of user data to the form as it arrives.
+    :param page: The page of user data, see RedditClient.get_user_pages.
     """
-    if user is None:
+    if page is None:
         main_form.results.add_content("User not found!")
         enable_actions()
         return
 
-    # Write all the posts to the screen.
-    main_form.results.add_title("POSTS")
-    if user.posts is not None and len(user.posts) > 0:
-        for post in user.posts:
-            create_result_control(post)
-    else:
-        main_form.results.add_content("No posts!")
+    # Start a new section when we move on to a new kind of content.
+    if page["first"]:
+        main_form.results.add_title(page["kind"].upper())
+        if len(page["items"]) == 0:
+            main_form.results.add_content("No " + page["kind"] + "!")
 
-    # Write all the comments to the screen.
-    main_form.results.add_title("COMMENTS")
-    if user.all_comments is not None and len(user.all_comments) > 0:
-        for comment in user.all_comments:
-            create_result_control(comment)
-    else:
-        main_form.results.add_content("No comments!")
+    # Write the page to the screen.
+    for item in page["items"]:
+        create_result_control(item)
 
-    enable_actions()
+    if page["last"]:
+        enable_actions()
 
 
 def on_get_post(post):
@@ -121,36 +117,99 @@ def on_get_post(post):
     enable_actions()
 
 
+def on_get_post_users(post):
+    """
+    Looks up the recent comments of everyone who commented on a post. The lookups are spread across the producers and
+    each commenter is written to the form as soon as their comments arrive.
+    :param post: The post data.
+    """
+    if post is None:
+        main_form.results.add_content("Post not found!")
+        enable_actions()
+        return
+
+    # Each commenter is only looked up once, in the order they first commented. Deleted accounts have no history.
+    authors = list(dict.fromkeys(comment.author for comment in post.all_comments or []
+                                 if comment.author is not None and comment.author != "[deleted]"))
+
+    if len(authors) == 0:
+        main_form.results.add_content("No comments!")
+        enable_actions()
+        return
+
+    request = reddit.fan_out("get_user", [(author, False, True) for author in authors], {"limit": author_history_limit})
+    request.then(main_form.marshal(on_get_post_user))
+    request.add_done_callback(main_form.marshal(lambda finished: enable_actions()))
+
+
+def on_get_post_user(result):
+    """
+    Writes the recent comments of a commenter to the form.
+    :param result: A tuple of the arguments of the lookup and the user data.
+    """
+    args, user = result
+    main_form.results.add_title(args[0].upper())
+
+    if user is None:
+        main_form.results.add_content("User not found!")
+    elif user.all_comments is None or len(user.all_comments) == 0:
+        main_form.results.add_content("No comments!")
+    else:
+        for comment in user.all_comments:
+            create_result_control(comment)
+
+
 def create_result_control(result):
     """
     Creates a new result control.
     :param result: The result to make a control of.
     :return: The new control.
     """
-    content = main_form.results.add_content(str(result))
-    content.id = result.name
+    content = main_form.results.add_content(str(result), result.name)
 
     if result.archived:
         content.configure(bg="cyan")
 
 
+def on_button_search_click():
+    """
+    Handles clicking the search button which finds retrieved content in the search index.
+    """
+    # Dates that can't be read are marked red like a bad token.
+    dates = []
+    for entry in (main_form.entry_search_after, main_form.entry_search_before):
+        try:
+            dates.append(search.parse_date(entry.get()))
+            entry.configure(bg="white")
+        except ValueError:
+            entry.configure(bg="red")
+            return
+
+    # The to date is included, so search up to the start of the day after.
+    after, before = dates
+    if before is not None:
+        before += 24 * 60 * 60
+
+    records = search_index.search(main_form.entry_search_text.get(), main_form.entry_search_author.get().strip(),
+                                  main_form.entry_search_subreddit.get().strip(), after, before, search_results_limit)
+
+    main_form.results.clear()
+    main_form.results.add_title("SEARCH")
+    if len(records) == 0:
+        main_form.results.add_content("Nothing found!")
+
+    for record in records:
+        create_result_control(record)
+
+
 def on_vote(entry, success):
     """
     The results of a vote.
     :param entry: The entry that was voted on.
     :param success: True if successful, false otherwise.
     """
-    control = main_form.results.get_content(
-        lambda control: control.id == entry.name if hasattr(control, "id") else False)
-
-    if control is None:
+    if not main_form.results.update_row(entry.name, bg="green" if success else "red"):
         logger.log("main.on_vote: Unable to find control associated with comment.")
-        return
-
-    if success:
-        control.configure(bg="green")
-    else:
-        control.configure(bg="red")
 
 
 def on_button_execute_click():
@@ -167,37 +226,27 @@ def on_button_execute_click():
     if main_form.radiobutton_action_type.get() == gui.ActionType.User.value:
         username = main_form.entry_data.get()
         if username is not None:
-            reddit.add_callback("get_user", on_execute_user, 1)
-            reddit.get_user(username, True, True)
+            reddit.get_user(username, True, True, page_size=results_page_size).then(main_form.marshal(on_execute_user))
     elif main_form.radiobutton_action_type.get() == gui.ActionType.Post_Comments.value:
         post_id = main_form.entry_data.get()
         if post_id is not None:
-            reddit.add_callback("get_post", on_execute_post, 1)
-            reddit.get_post(post_id, True)
+            reddit.get_post(post_id, True).then(main_form.marshal(on_execute_post))
     elif main_form.radiobutton_action_type.get() == gui.ActionType.Post_User_Comments.value:
-        pass
+        # Looking into the commenters is read only, there's nothing to vote on.
+        post_id = main_form.entry_data.get()
+        if post_id is not None:
+            reddit.get_post(post_id, True).then(main_form.marshal(on_get_post_users))
 
 
-def on_execute_user(user):
+def on_execute_user(page):
     """
-    Handles response from the execute user request.
-    :param user: The user data.
+    Handles a page of the response from the execute user request.
+    :param page: The page of user data, see RedditClient.get_user_pages.
     """
-    if user is None:
-        main_form.results.add_content("User not found!")
-        enable_actions()
-        return
+    on_get_user(page)
 
-    on_get_user(user)
-    if main_form.radiobutton_action.get() == gui.Action.Upvote.value:
-        reddit.vote(True, [post for post in user.posts if not post.archived], on_vote)
-        reddit.vote(True, [comment for comment in user.all_comments if not comment.archived], on_vote)
-    elif main_form.radiobutton_action.get() == gui.Action.Downvote.value:
-        reddit.vote(False, [post for post in user.posts if not post.archived], on_vote)
-        reddit.vote(False, [comment for comment in user.all_comments if not comment.archived], on_vote)
-    elif main_form.radiobutton_action.get() == gui.Action.Clear.value:
-        reddit.vote(None, [post for post in user.posts if not post.archived], on_vote)
-        reddit.vote(None, [comment for comment in user.all_comments if not comment.archived], on_vote)
+    if page is not None:
+        execute_vote(page["items"])
 
 
 def on_execute_post(post):
@@ -211,12 +260,25 @@ def on_execute_post(post):
         return
 
     on_get_post(post)
+    execute_vote(post.all_comments)
+
+
+def execute_vote(all_content):
+    """
+    Votes on content according to the selected action. Archived content can't be voted on and is skipped.
+    :param all_content: The list of content.
+    """
+    all_content = [content for content in all_content if not content.archived]
+
+    # Only the latest status of each row matters, so statuses for the same row waiting to be shown are coalesced.
+    on_vote_status = main_form.marshal(on_vote, key=lambda entry, success: entry.name)
+
     if main_form.radiobutton_action.get() == gui.Action.Upvote.value:
-        reddit.vote(True, [post for post in post.all_comments if not post.archived], on_vote)
+        reddit.vote(True, all_content, on_vote_status)
     elif main_form.radiobutton_action.get() == gui.Action.Downvote.value:
-        reddit.vote(False, [post for post in post.all_comments if not post.archived], on_vote)
+        reddit.vote(False, all_content, on_vote_status)
     elif main_form.radiobutton_action.get() == gui.Action.Clear.value:
-        reddit.vote(None, [post for post in post.all_comments if not post.archived], on_vote)
+        reddit.vote(None, all_content, on_vote_status)
 
 
 def disable_actions():
@@ -226,6 +288,7 @@ def disable_actions():
     gui.setup_state(main_form.panel_data, tkinter.DISABLED)
     gui.setup_state(main_form.panel_actions, tkinter.DISABLED)
     gui.setup_state(main_form.panel_actions_type, tkinter.DISABLED)
+    gui.setup_state(main_form.panel_search, tkinter.DISABLED)
 
 
 def enable_actions():
@@ -235,6 +298,7 @@ def enable_actions():
     gui.setup_state(main_form.panel_data, tkinter.NORMAL)
     gui.setup_state(main_form.panel_actions, tkinter.NORMAL)
     gui.setup_state(main_form.panel_actions_type, tkinter.NORMAL)
+    gui.setup_state(main_form.panel_search, tkinter.NORMAL)
 
 
 if __name__ == "__main__":
@@ -246,12 +310,20 @@ if __name__ == "__main__":
     main_form.button_login.configure(command=on_button_login_click)
     main_form.button_get.configure(command=on_button_get_click)
     main_form.button_execute.configure(command=on_button_execute_click)
+    main_form.button_search.configure(command=on_button_search_click)
+    main_form.entry_search_text.bind("<Return>", lambda event: on_button_search_click())
 
-    # Create reddit client
-    reddit = reddit_client.RedditProxy(user_data_file, 5)
-    reddit.add_callback("is_logged_in", on_is_logged_in)
-    reddit.add_callback("login_first_time", on_login_first_time)
-    reddit.is_logged_in()
+    # Create reddit client, everything it retrieves is added to the search index
+    search_index = search.SearchIndex(search_index_file)
+    reddit = reddit_client.RedditProxy(user_data_file, 5, cache.HistoryCache(cache_file, cache_ttl, cache_max_items),
+                                       response_cache=cache.ResponseCache(response_cache_file, response_cache_ttl,
+                                                                          response_cache_max_items),
+                                       search_index=search_index, shared_memory_records=shared_memory_records)
+
+    # The form shows while the producers start in the background, the login status follows once one is up.
+    gui.setup_state(main_form.panel_login, tkinter.DISABLED)
+    main_form.label_current_user.configure(text="Logging in...")
+    reddit.is_logged_in().then(main_form.marshal(on_is_logged_in))
 
     # Show form
     main_form.show()
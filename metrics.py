@@ -0,0 +1,276 @@
+import collections
+import os
+import threading
+import time
+
+
+class Histogram:
+    """
+    Keeps the most recent samples of a measurement to report percentiles from, along with the count and sum of every
+    sample ever added.
+    """
+
+    def __init__(self, size=10000):
+        """
+        Initializes a new instance of the Histogram class.
+        :param size: The number of most recent samples kept for percentiles.
+        """
+        self.samples = collections.deque(maxlen=size)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        """
+        Adds a sample.
+        :param value: The sample.
+        """
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def percentiles(self, fractions):
+        """
+        Gets percentiles of the kept samples.
+        :param fractions: The percentiles as fractions, e.g. 0.95.
+        :return: The list of samples at the percentiles, None for each if there are no samples.
+        """
+        if len(self.samples) == 0:
+            return [None for fraction in fractions]
+
+        ordered = sorted(self.samples)
+        return [ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] for fraction in fractions]
+
+
+class ProxyMetrics:
+    """
+    Aggregates how long the commands of an EmbeddedProxy spend in each stage, from being added to the producer queue
+    to their final response being delivered, along with queue depths and how busy the producers are.
+
+    The stages of a command are:
+        queue_wait: Waiting on the producer queue.
+        rate_limit_wait: Waiting on the rate limiter before requests to Reddit.
+        http: Waiting on the responses of requests to Reddit, including PRAW parsing them.
+        run: Running the method, including streaming its results, so it includes the two above.
+        transfer: From the producer putting the final response on the consumer queue to the consumer getting it,
+            which is mostly pickling for the process backend.
+        callback: The consumer delivering the final response to the request and callbacks.
+        total: From being added to being delivered.
+    """
+
+    STAGES = ("queue_wait", "rate_limit_wait", "http", "run", "transfer", "callback", "total")
+
+    # The percentiles reported for each stage
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, sample_size=10000):
+        """
+        Initializes a new instance of the ProxyMetrics class.
+        :param sample_size: The number of most recent samples kept for the percentiles of each method and stage.
+        """
+        self.sample_size = sample_size
+        self.lock = threading.Lock()
+
+        # The histograms of each method, by method name and then stage
+        self.methods = {}
+
+        # The latest and the greatest value of each gauge, e.g. queue depths
+        self.gauges = {}
+        self.gauge_maximums = {}
+
+        # The number of times each event happened, e.g. commands coalesced
+        self.counters = collections.Counter()
+
+        # The producer seconds that have passed and the seconds producers spent running methods
+        self.started = time.perf_counter()
+        self.workers = 0
+        self.workers_changed = self.started
+        self.worker_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def record(self, name, timings):
+        """
+        Records the stages of a finished command.
+        :param name: The name of the method.
+        :param timings: The dictionary of timestamps from time.perf_counter, which is the same clock in every process,
+        by event: enqueued, dequeued, started, finished, put, received and completed. The seconds spent waiting on the
+        rate limiter and on Reddit are under rate_limit_wait and http, and the number of requests the response cache
+        did and didn't answer under cache_hits and cache_misses, if known.
+        """
+        stages = {"queue_wait": timings["dequeued"] - timings["enqueued"],
+                  "run": timings["finished"] - timings["started"],
+                  "transfer": timings["received"] - timings["put"],
+                  "callback": timings["completed"] - timings["received"],
+                  "total": timings["completed"] - timings["enqueued"]}
+        for stage in ("rate_limit_wait", "http"):
+            if timings.get(stage, None) is not None:
+                stages[stage] = timings[stage]
+
+        with self.lock:
+            histograms = self.methods.get(name, None)
+            if histograms is None:
+                histograms = self.methods[name] = {stage: Histogram(self.sample_size) for stage in self.STAGES}
+
+            for stage, seconds in stages.items():
+                histograms[stage].add(seconds)
+            self.busy_seconds += stages["run"]
+
+            for counter in ("cache_hits", "cache_misses"):
+                if timings.get(counter, None):
+                    self.counters["response_" + counter] += timings[counter]
+
+    def set_gauge(self, name, value):
+        """
+        Sets the current value of a gauge.
+        :param name: The name of the gauge, e.g. producer_queue.
+        :param value: The value, None if it isn't known.
+        """
+        if value is None:
+            return
+
+        with self.lock:
+            self.gauges[name] = value
+            self.gauge_maximums[name] = max(value, self.gauge_maximums.get(name, value))
+
+    def increment(self, name):
+        """
+        Counts an event.
+        :param name: The name of the event, e.g. coalesced_commands.
+        """
+        with self.lock:
+            self.counters[name] += 1
+
+    def set_workers(self, workers):
+        """
+        Sets the number of producers running, which are counted toward utilization from now on.
+        :param workers: The number of producers.
+        """
+        with self.lock:
+            self.update_worker_seconds()
+            self.workers = workers
+
+    def update_worker_seconds(self):
+        """
+        Adds the producer seconds that have passed since the last update. Called with the lock held.
+        """
+        now = time.perf_counter()
+        self.worker_seconds += self.workers * (now - self.workers_changed)
+        self.workers_changed = now
+
+    def snapshot(self):
+        """
+        Gets the current metrics.
+        :return: A dictionary of the uptime in seconds, the number of producers, their utilization as the fraction of
+        their time spent running methods, the gauges with their maximums, the counts of events and, by method, the
+        count of commands and the count, sum and percentiles of each stage in seconds.
+        """
+        with self.lock:
+            self.update_worker_seconds()
+
+            methods = {}
+            for name, histograms in self.methods.items():
+                stages = {}
+                for stage, histogram in histograms.items():
+                    if histogram.count == 0:
+                        continue
+
+                    summary = {"count": histogram.count, "sum": histogram.sum}
+                    for quantile, value in zip(self.QUANTILES, histogram.percentiles(self.QUANTILES)):
+                        summary["p" + str(round(quantile * 100))] = value
+                    stages[stage] = summary
+
+                methods[name] = {"count": histograms["total"].count, "stages": stages}
+
+            return {"uptime": time.perf_counter() - self.started,
+                    "workers": self.workers,
+                    "utilization": self.busy_seconds / self.worker_seconds if self.worker_seconds > 0 else 0.0,
+                    "gauges": {name: {"value": value, "max": self.gauge_maximums[name]}
+                               for name, value in self.gauges.items()},
+                    "counters": dict(self.counters),
+                    "methods": methods}
+
+    def to_prometheus(self):
+        """
+        Formats the current metrics in the Prometheus text exposition format.
+        :return: The text.
+        """
+        snapshot = self.snapshot()
+
+        lines = ["# HELP reddit_bot_command_seconds Seconds proxied commands spent in each stage.",
+                 "# TYPE reddit_bot_command_seconds summary"]
+        for name, method in sorted(snapshot["methods"].items()):
+            for stage, summary in method["stages"].items():
+                labels = 'method="' + name + '",stage="' + stage + '"'
+                for quantile in self.QUANTILES:
+                    value = summary["p" + str(round(quantile * 100))]
+                    lines.append("reddit_bot_command_seconds{" + labels + ',quantile="' + str(quantile) + '"} ' +
+                                 repr(value))
+                lines.append("reddit_bot_command_seconds_sum{" + labels + "} " + repr(summary["sum"]))
+                lines.append("reddit_bot_command_seconds_count{" + labels + "} " + str(summary["count"]))
+
+        lines += ["# HELP reddit_bot_gauge The current value of each proxy gauge, e.g. queue depths.",
+                  "# TYPE reddit_bot_gauge gauge"]
+        lines += ['reddit_bot_gauge{name="' + name + '"} ' + str(gauge["value"])
+                  for name, gauge in sorted(snapshot["gauges"].items())]
+
+        lines += ["# HELP reddit_bot_gauge_max The greatest value of each proxy gauge so far.",
+                  "# TYPE reddit_bot_gauge_max gauge"]
+        lines += ['reddit_bot_gauge_max{name="' + name + '"} ' + str(gauge["max"])
+                  for name, gauge in sorted(snapshot["gauges"].items())]
+
+        lines += ["# HELP reddit_bot_events_total The number of times each proxy event happened.",
+                  "# TYPE reddit_bot_events_total counter"]
+        lines += ['reddit_bot_events_total{name="' + name + '"} ' + str(count)
+                  for name, count in sorted(snapshot["counters"].items())]
+
+        lines += ["# HELP reddit_bot_workers The number of producers running.",
+                  "# TYPE reddit_bot_workers gauge",
+                  "reddit_bot_workers " + str(snapshot["workers"]),
+                  "# HELP reddit_bot_worker_utilization The fraction of producer time spent running methods.",
+                  "# TYPE reddit_bot_worker_utilization gauge",
+                  "reddit_bot_worker_utilization " + repr(snapshot["utilization"])]
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, filename):
+        """
+        Writes the current metrics in the Prometheus text exposition format to a file, e.g. for the node exporter's
+        textfile collector. The file is replaced at once so it's never read half written.
+        :param filename: The file to write to.
+        """
+        temporary = filename + ".tmp"
+        with open(temporary, "w") as file:
+            file.write(self.to_prometheus())
+        os.replace(temporary, filename)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serves the current metrics in the Prometheus text exposition format over HTTP on a background thread.
+        :param port: The port to listen on, 0 for any free port.
+        :param host: The address to listen on, only this machine by default.
+        :return: The http.server.ThreadingHTTPServer, shut it down to stop serving.
+        """
+        # Imported here since most runs never serve the metrics.
+        import http.server
+
+        metrics = self
+
+        class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes aren't worth logging.
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        server.daemon_threads = True
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
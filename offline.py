@@ -0,0 +1,569 @@
+"""
+Stand-ins for Reddit that let the RedditClient and the proxies run on a machine without a network or a login.
+
+OfflineHandler is a PRAW handler that answers requests from OfflineReddit, a deterministic synthetic site with users
+of any size, comment trees behind MoreComments stubs and rate limit headers, with a configurable latency.
+RecordingHandler saves the responses of real requests to a file that ReplayHandler serves them back from.
+
+Pass one of them as the handler of a RedditClient, or as the handler factory of an EmbeddedProxy, e.g.
+    EmbeddedProxy(None, 5, handler_factory=functools.partial(OfflineHandler, site=OfflineReddit(), latency=0.05))
+"""
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+
+import requests
+
+import logger
+from handlers import ScheduledHandler
+
+# The time the newest synthetic content was created
+EPOCH = 1450000000.0
+
+# The scopes of the offline login, the same as we ask Reddit for
+SCOPE = "creddits edit flair history identity modconfig modcontributors modflair modlog modothers modposts modself " \
+        "modwiki mysubreddits privatemessages read report save submit subscribe vote wikiedit wikiread"
+
+
+class OfflineReddit:
+    """
+    A synthetic Reddit that answers the requests the RedditClient makes. Everything is generated from the names and
+    ids in the requests, so the same request always gets the same answer and any user or post exists.
+
+    A user's history is their posts and comments, newest first. A post's comments are a random tree in which only the
+    first few comments of the first levels are sent with the post, the rest are behind MoreComments stubs the way
+    Reddit sends large threads. The replies of deep comments are behind "continue this thread" stubs instead.
+    """
+
+    def __init__(self, user_items=1000, post_comments=1000, users=None, posts=None, inline_top_level=20,
+                 inline_replies=3, inline_depth=1, continue_depth=4):
+        """
+        Initializes a new instance of the OfflineReddit class.
+        :param user_items: The number of posts and of comments in the history of a user.
+        :param post_comments: The number of comments on a post.
+        :param users: A dictionary of the history sizes of particular users by lowercase username.
+        :param posts: A dictionary of the number of comments of particular posts by id.
+        :param inline_top_level: The number of top level comments sent with a post.
+        :param inline_replies: The number of replies to a comment sent with it.
+        :param inline_depth: The number of levels of replies sent with a post.
+        :param continue_depth: The depth of the comments, 0 for top level, from which replies that aren't sent with a
+        comment are behind a "continue this thread" stub, which has no count and is retrieved like a post focused on
+        the comment. None for never.
+        """
+        self.user_items = user_items
+        self.post_comments = post_comments
+        self.users = users or {}
+        self.posts = posts or {}
+        self.inline_top_level = inline_top_level
+        self.inline_replies = inline_replies
+        self.inline_depth = inline_depth
+        self.continue_depth = continue_depth
+
+        # The generated comment trees by post id
+        self.threads = {}
+
+    def __getstate__(self):
+        """
+        Needed for pickle, generated comment trees are generated again rather than sent to other processes.
+        :return: The state of the object.
+        """
+        state = self.__dict__.copy()
+        state["threads"] = {}
+        return state
+
+    def respond(self, method, url, body):
+        """
+        Answers a request.
+        :param method: The HTTP method.
+        :param url: The URL.
+        :param body: The form encoded body, may be None.
+        :return: A tuple of the HTTP status code and the JSON data.
+        """
+        parsed = urllib.parse.urlparse(url)
+        path = re.sub(r"\.json$", "", parsed.path).strip("/").split("/")
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(parsed.query).items()}
+        if body:
+            form = body.decode("utf-8") if isinstance(body, bytes) else body
+            params.update({key: values[-1] for key, values in urllib.parse.parse_qs(form).items()})
+
+        if path[:3] == ["api", "v1", "access_token"]:
+            return 200, {"access_token": "offline_access_token", "refresh_token": "offline_refresh_token",
+                         "scope": SCOPE, "expires_in": 3600, "token_type": "bearer"}
+
+        if path[:3] == ["api", "v1", "me"]:
+            return 200, {"name": "offline_user", "id": "offline", "created_utc": EPOCH, "link_karma": 1,
+                         "comment_karma": 1}
+
+        if path[:2] == ["api", "morechildren"]:
+            return 200, self.get_more_children(params["link_id"][3:], params["children"].split(","))
+
+        if path[:2] == ["api", "info"]:
+            return 200, create_listing([self.get_thing(name) for name in params.get("id", "").split(",") if name])
+
+        if path[:1] == ["api"]:
+            # Voting and anything else we only need a success from.
+            return 200, {}
+
+        if path[:1] == ["user"] and len(path) >= 2:
+            kind = path[2] if len(path) >= 3 else "about"
+            if kind == "about":
+                return 200, {"kind": "t2", "data": {"name": path[1], "id": self.get_user_id(path[1]),
+                                                    "created_utc": EPOCH, "link_karma": 1, "comment_karma": 1}}
+            if kind in ("comments", "submitted"):
+                return 200, self.get_user_listing(path[1], kind, params)
+
+        if "comments" in path:
+            index = path.index("comments")
+            if len(path) > index + 1:
+                focus = path[index + 3] if len(path) > index + 3 else None
+                return 200, self.get_submission(path[index + 1], focus)
+
+        return 404, {"error": 404}
+
+    @staticmethod
+    def get_user_id(username):
+        """
+        Gets the identifier of a user.
+        :param username: The username.
+        :return: The identifier, the same for every capitalization of the name.
+        """
+        return to_base36(zlib.crc32(username.lower().encode("utf-8")))
+
+    def get_user_listing(self, username, kind, params):
+        """
+        Gets a page of a user's history.
+        :param username: The username.
+        :param kind: Either "comments" or "submitted".
+        :param params: The query parameters: limit, after and before.
+        :return: The listing.
+        """
+        count = self.users.get(username.lower(), self.user_items)
+        limit = min(int(params.get("limit", 25)), 100)
+        letter = "c" if kind == "comments" else "s"
+        prefix = self.get_user_id(username) + letter
+
+        def index_of(name):
+            item_id = name.split("_", 1)[-1]
+            if not item_id.startswith(prefix):
+                return None
+            return int(item_id[len(prefix):])
+
+        # The items are numbered from the newest, Reddit returns the items on either side of a cursor.
+        if params.get("before") and index_of(params["before"]) is not None:
+            end = index_of(params["before"])
+            start = max(end - limit, 0)
+        else:
+            after = index_of(params["after"]) if params.get("after") else None
+            start = after + 1 if after is not None else 0
+            end = min(start + limit, count)
+
+        create = self.create_user_comment if kind == "comments" else self.create_user_post
+        children = [create(username, prefix + str(index), index) for index in range(start, end)]
+        return {"kind": "Listing", "data": {"children": children,
+                                            "after": children[-1]["data"]["name"] if end < count and children
+                                            else None,
+                                            "before": children[0]["data"]["name"] if start > 0 and children
+                                            else None}}
+
+    @staticmethod
+    def create_user_comment(username, comment_id, index):
+        """
+        Creates the JSON of a comment in a user's history.
+        :param username: The username.
+        :param comment_id: The identifier of the comment.
+        :param index: The position of the comment in the history, 0 for the newest.
+        :return: The comment thing.
+        """
+        return {"kind": "t1", "data": {"id": comment_id, "name": "t1_" + comment_id, "author": username,
+                                       "subreddit": "offline", "score": index % 100, "created_utc": EPOCH - index * 600,
+                                       "archived": index % 7 == 0, "body": "Comment %d of %s." % (index, username),
+                                       "parent_id": "t3_" + comment_id + "p", "link_id": "t3_" + comment_id + "p",
+                                       "link_title": "A post", "replies": ""}}
+
+    @staticmethod
+    def create_user_post(username, post_id, index):
+        """
+        Creates the JSON of a post in a user's history.
+        :param username: The username.
+        :param post_id: The identifier of the post.
+        :param index: The position of the post in the history, 0 for the newest.
+        :return: The submission thing.
+        """
+        return {"kind": "t3", "data": {"id": post_id, "name": "t3_" + post_id, "author": username,
+                                       "subreddit": "offline", "score": index % 100, "created_utc": EPOCH - index * 600,
+                                       "archived": index % 7 == 0, "title": "Post %d of %s" % (index, username),
+                                       "selftext": "", "num_comments": 0,
+                                       "permalink": "/r/offline/comments/%s/post/" % post_id,
+                                       "url": "https://www.reddit.com/r/offline/comments/%s/post/" % post_id}}
+
+    def get_thing(self, name):
+        """
+        Gets the JSON of any comment or post by fullname, e.g. to vote on it.
+        :param name: The fullname.
+        :return: The thing.
+        """
+        if name.startswith("t3_"):
+            return self.create_user_post("offline_user", name[3:], 0)
+
+        return self.create_user_comment("offline_user", name[3:], 0)
+
+    def get_thread(self, post_id):
+        """
+        Gets the comment tree of a post, generating it the first time.
+        :param post_id: The post id.
+        :return: The Thread.
+        """
+        thread = self.threads.get(post_id)
+        if thread is None:
+            thread = self.threads[post_id] = Thread(post_id, self.posts.get(post_id, self.post_comments))
+        return thread
+
+    def get_submission(self, post_id, focus=None):
+        """
+        Gets a post and the comments sent with it.
+        :param post_id: The post id.
+        :param focus: The id of a comment to get the replies of instead, as for "continue this thread".
+        :return: The listings of the post and of its comments.
+        """
+        thread = self.get_thread(post_id)
+        submission = {"kind": "t3", "data": {"id": post_id, "name": "t3_" + post_id, "author": "offline_user",
+                                             "subreddit": "offline", "title": "A thread of %d comments" % thread.size,
+                                             "selftext": "", "score": 1000, "archived": False, "created_utc": EPOCH,
+                                             "num_comments": thread.size,
+                                             "permalink": "/r/offline/comments/%s/thread/" % post_id,
+                                             "url": "https://www.reddit.com/r/offline/comments/%s/thread/" % post_id}}
+
+        if focus is not None and "t1_" + focus in thread.parents:
+            comments = [thread.create_comment("t1_" + focus,
+                                              self.create_replies(thread, "t1_" + focus, self.inline_replies,
+                                                                  self.inline_depth))]
+        else:
+            comments = self.create_replies(thread, thread.name, self.inline_top_level, self.inline_depth)
+
+        return [create_listing([submission]), create_listing(comments)]
+
+    def create_replies(self, thread, parent, limit, depth):
+        """
+        Creates the JSON of the replies of a comment or the post the way they are sent with it.
+        :param thread: The Thread.
+        :param parent: The fullname of the parent.
+        :param limit: The number of replies sent inline.
+        :param depth: The number of further levels of replies sent inline.
+        :return: The list of things.
+        """
+        children = thread.children[parent]
+
+        # Below the last level sent inline the replies are entirely behind a stub.
+        limit_below = self.inline_replies if depth > 0 else 0
+        things = [thread.create_comment(child, self.create_replies(thread, child, limit_below, depth - 1))
+                  for child in children[:limit]]
+
+        if len(children) > limit:
+            things.append(thread.create_stub(parent, children[limit:], limit == 0 and self.is_continued(thread, parent)))
+
+        return things
+
+    def get_more_children(self, post_id, children):
+        """
+        Gets comments by id the way Reddit does, each on its own with its replies behind a stub. Anything past the
+        request limit is left behind a stub as well.
+        :param post_id: The post id.
+        :param children: The ids of the comments.
+        :return: The response.
+        """
+        thread = self.get_thread(post_id)
+        names = ["t1_" + child for child in children if "t1_" + child in thread.parents]
+
+        things = []
+        for name in names[:100]:
+            things.append(thread.create_comment(name, None))
+            if thread.children[name]:
+                things.append(thread.create_stub(name, thread.children[name], self.is_continued(thread, name)))
+
+        if len(names) > 100:
+            things.append(thread.create_stub(thread.parents[names[100]], names[100:]))
+
+        return {"json": {"errors": [], "data": {"things": things}}}
+
+    def is_continued(self, thread, parent):
+        """
+        Checks if the replies of a comment that aren't sent with it are behind a "continue this thread" stub.
+        :param thread: The Thread.
+        :param parent: The fullname of the comment, or of the post.
+        :return: True if they are, false if they're behind a more children stub.
+        """
+        return self.continue_depth is not None and thread.depths.get(parent, -1) >= self.continue_depth
+
+
+class Thread:
+    """
+    The generated comment tree of a post. Every comment replies to the post or to an earlier comment, with most of
+    them near the top.
+    """
+
+    def __init__(self, post_id, size):
+        """
+        Initializes a new instance of the Thread class.
+        :param post_id: The post id.
+        :param size: The number of comments.
+        """
+        self.post_id = post_id
+        self.name = "t3_" + post_id
+        self.size = size
+
+        generator = random.Random(zlib.crc32(post_id.encode("utf-8")))
+        self.children = {self.name: []}
+        self.parents = {}
+        self.depths = {}
+        for index in range(size):
+            name = "t1_%sc%d" % (post_id, index)
+            parent = self.name if index < 10 or generator.random() < 0.2 else \
+                "t1_%sc%d" % (post_id, int(index * generator.random() ** 2))
+            self.parents[name] = parent
+            self.depths[name] = self.depths[parent] + 1 if parent in self.depths else 0
+            self.children[parent].append(name)
+            self.children[name] = []
+
+    def create_comment(self, name, replies):
+        """
+        Creates the JSON of a comment.
+        :param name: The fullname of the comment.
+        :param replies: The things of the replies sent with it, None if they aren't.
+        :return: The comment thing.
+        """
+        index = int(name.rsplit("c", 1)[1])
+        return {"kind": "t1", "data": {"id": name[3:], "name": name, "parent_id": self.parents[name],
+                                       "link_id": self.name, "author": "user%d" % (index % 500),
+                                       "subreddit": "offline", "score": index % 37 - 5, "archived": False,
+                                       "created_utc": EPOCH + index, "body": "Comment %d of the thread." % index,
+                                       "replies": create_listing(replies) if replies else ""}}
+
+    @staticmethod
+    def create_stub(parent, children, continued=False):
+        """
+        Creates the JSON of a MoreComments stub.
+        :param parent: The fullname of the parent of the comments.
+        :param children: The fullnames of the comments.
+        :param continued: True for a "continue this thread" stub, which has no count, false for a more children stub.
+        :return: The stub thing.
+        """
+        return {"kind": "more", "data": {"id": children[0][3:], "name": children[0], "parent_id": parent,
+                                         "count": 0 if continued else len(children),
+                                         "children": [child[3:] for child in children]}}
+
+
+class OfflineHandler(ScheduledHandler):
+    """
+    A PRAW handler that answers requests from an OfflineReddit instead of Reddit, after a fixed latency. Responses
+    carry rate limit headers for a window of requests counted per handler, and once the window is used up requests
+    are answered with 429 Too Many Requests until it resets.
+    """
+
+    def __init__(self, limiter=None, site=None, latency=0.0, rate_limit=600, rate_window=600, response_cache=None):
+        """
+        Initializes a new instance of the OfflineHandler class.
+        :param limiter: The RateLimiter shared by all producers, None to make requests as soon as they're asked for.
+        :param site: The OfflineReddit, None for one with the default sizes.
+        :param latency: The number of seconds each request takes.
+        :param rate_limit: The number of requests allowed per window.
+        :param rate_window: The number of seconds in a window.
+        :param response_cache: The ResponseCache shared by all producers, None to always make requests.
+        """
+        super().__init__(limiter, response_cache)
+        self.site = site if site is not None else OfflineReddit()
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+
+        # The number of requests made and the start of the current window
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.used = 0
+        self.window_start = time.monotonic()
+
+    def dispatch(self, request, proxies, timeout, verify):
+        """
+        Answers a request from the offline site.
+        :param request: A requests.PreparedRequest containing all the data necessary to perform the request.
+        :param proxies: Ignored.
+        :param timeout: Ignored.
+        :param verify: Ignored.
+        :return: The requests.Response.
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.rate_window:
+                self.window_start = now
+                self.used = 0
+
+            self.requests += 1
+            self.used += 1
+            remaining = self.rate_limit - self.used
+            headers = {"X-Ratelimit-Used": str(self.used), "X-Ratelimit-Remaining": str(max(remaining, 0)),
+                       "X-Ratelimit-Reset": str(int(self.rate_window - (now - self.window_start)))}
+
+        if remaining < 0:
+            return create_response(request, 429, {"error": 429}, headers)
+
+        status, data = self.site.respond(request.method, request.url, request.body)
+        return create_response(request, status, data, headers)
+
+
+class RecordingHandler(ScheduledHandler):
+    """
+    A PRAW handler that makes requests to Reddit as usual and appends every response to a file, one JSON object per
+    line, so they can be replayed later by a ReplayHandler.
+    """
+
+    def __init__(self, limiter=None, filename="recording.jsonl", response_cache=None):
+        """
+        Initializes a new instance of the RecordingHandler class.
+        :param limiter: The RateLimiter shared by all producers, None to make requests as soon as they're asked for.
+        :param filename: The file to append the responses to.
+        :param response_cache: The ResponseCache shared by all producers, None to always make requests. Cached
+        responses aren't recorded again.
+        """
+        super().__init__(limiter, response_cache)
+        self.filename = filename
+        self.lock = threading.Lock()
+
+    def dispatch(self, request, proxies, timeout, verify):
+        """
+        Makes a request to Reddit and records the response.
+        :param request: A requests.PreparedRequest containing all the data necessary to perform the request.
+        :param proxies: A dictionary of proxy settings to be utilized for the request.
+        :param timeout: Specifies the maximum time that the actual HTTP request can take.
+        :param verify: Specifies if SSL certificates should be validated.
+        :return: The requests.Response.
+        """
+        response = super().dispatch(request, proxies, timeout, verify)
+
+        # Only the headers we act on are kept, the rest may identify the session.
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower().startswith("x-ratelimit") or name.lower() in ("content-type", "retry-after")}
+        entry = {"key": get_request_key(request), "status": response.status_code, "headers": headers,
+                 "content": response.text}
+
+        with self.lock:
+            with open(self.filename, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+
+        return response
+
+
+class ReplayHandler(ScheduledHandler):
+    """
+    A PRAW handler that answers requests with the responses a RecordingHandler recorded. Repeated requests are
+    answered with the recorded responses in order, the last one is repeated once they run out. Requests that weren't
+    recorded are answered with 404 Not Found.
+    """
+
+    def __init__(self, limiter=None, filename="recording.jsonl", latency=0.0, response_cache=None):
+        """
+        Initializes a new instance of the ReplayHandler class.
+        :param limiter: The RateLimiter shared by all producers, None to make requests as soon as they're asked for.
+        :param filename: The file of recorded responses.
+        :param latency: The number of seconds each request takes.
+        :param response_cache: The ResponseCache shared by all producers, None to always make requests.
+        """
+        super().__init__(limiter, response_cache)
+        self.latency = latency
+        self.lock = threading.Lock()
+
+        # The recorded responses of each request, and how many of them have been replayed
+        self.responses = {}
+        self.replayed = {}
+        with open(filename, encoding="utf-8") as file:
+            for line in file:
+                if line.strip() != "":
+                    entry = json.loads(line)
+                    self.responses.setdefault(entry["key"], []).append(entry)
+
+    def dispatch(self, request, proxies, timeout, verify):
+        """
+        Answers a request with its recorded response.
+        :param request: A requests.PreparedRequest containing all the data necessary to perform the request.
+        :param proxies: Ignored.
+        :param timeout: Ignored.
+        :param verify: Ignored.
+        :return: The requests.Response.
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        key = get_request_key(request)
+        with self.lock:
+            entries = self.responses.get(key)
+            if not entries:
+                logger.log("ReplayHandler.dispatch: No recorded response for", key)
+                return create_response(request, 404, {"error": 404})
+
+            index = self.replayed.get(key, 0)
+            self.replayed[key] = index + 1
+            entry = entries[min(index, len(entries) - 1)]
+
+        response = create_response(request, entry["status"], None, entry["headers"])
+        response._content = entry["content"].encode("utf-8")
+        return response
+
+
+def get_request_key(request):
+    """
+    Gets what identifies a request for recording, its method, path, query and body. The host is left out since PRAW
+    uses a different one once logged in.
+    :param request: The requests.PreparedRequest.
+    :return: The key.
+    """
+    parsed = urllib.parse.urlparse(request.url)
+    body = request.body.decode("utf-8") if isinstance(request.body, bytes) else request.body or ""
+    return request.method + " " + parsed.path + ("?" + parsed.query if parsed.query else "") + " " + body
+
+
+def create_response(request, status, data, headers=None):
+    """
+    Creates a response to a request.
+    :param request: The requests.PreparedRequest.
+    :param status: The HTTP status code.
+    :param data: The JSON data of the body.
+    :param headers: The headers.
+    :return: The requests.Response.
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.url = request.url
+    response.request = request
+    response.encoding = "utf-8"
+    response.headers.update(headers or {})
+    response.headers.setdefault("Content-Type", "application/json; charset=UTF-8")
+    response._content = json.dumps(data).encode("utf-8")
+    return response
+
+
+def create_listing(children):
+    """
+    Creates the JSON of a listing.
+    :param children: The things in the listing.
+    :return: The listing.
+    """
+    return {"kind": "Listing", "data": {"children": children, "after": None, "before": None}}
+
+
+def to_base36(number):
+    """
+    Formats a number in base 36 the way Reddit formats identifiers.
+    :param number: The non-negative number.
+    :return: The digits.
+    """
+    digits = ""
+    while True:
+        number, digit = divmod(number, 36)
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"[digit] + digits
+        if number == 0:
+            return digits
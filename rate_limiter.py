@@ -0,0 +1,147 @@
+import multiprocessing
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    A token bucket shared by every producer, in any process, that each request to Reddit is taken from. The rate
+    follows the X-Ratelimit headers Reddit sends back, spreading the requests remaining in the current window evenly
+    over the time left in it. Interactive requests are served before background requests and a reserve of tokens is
+    kept for them, so a long history download can't hold up a quick lookup.
+    """
+
+    # The priorities of requests, lower is more important
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+    def __init__(self, rate=1.0, burst=5, reserve=1):
+        """
+        Initializes a new instance of the RateLimiter class.
+        :param rate: The initial number of requests per second, used until Reddit tells us otherwise.
+        :param burst: The maximum number of tokens that can build up while idle.
+        :param reserve: The number of tokens only interactive requests may use.
+        """
+        self.burst = burst
+        self.reserve = reserve
+
+        # The state of the bucket, all protected by the lock
+        self.lock = multiprocessing.Lock()
+        self.tokens = multiprocessing.Value("d", burst, lock=False)
+        self.rate = multiprocessing.Value("d", rate, lock=False)
+        self.updated = multiprocessing.Value("d", time.monotonic(), lock=False)
+        self.blocked_until = multiprocessing.Value("d", 0.0, lock=False)
+        self.interactive_waiting = multiprocessing.Value("i", 0, lock=False)
+
+        # The priority of the request being made on the current thread
+        self.local = threading.local()
+
+    def __getstate__(self):
+        """
+        Needed for pickle, the priorities of our threads aren't sent to other processes.
+        :return: The state of the object.
+        """
+        state = self.__dict__.copy()
+        del state["local"]
+        return state
+
+    def __setstate__(self, state):
+        """
+        Needed for pickle, restores the state of the object.
+        :param state: The state of the object.
+        """
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def set_priority(self, priority):
+        """
+        Sets the priority of the requests made on the current thread.
+        :param priority: Either INTERACTIVE or BACKGROUND.
+        """
+        self.local.priority = priority
+
+    def get_priority(self):
+        """
+        Gets the priority of the requests made on the current thread.
+        :return: Either INTERACTIVE or BACKGROUND.
+        """
+        return getattr(self.local, "priority", RateLimiter.BACKGROUND)
+
+    def acquire(self, priority=None):
+        """
+        Waits until a request may be made.
+        :param priority: The priority of the request, None to use the priority of the current thread.
+        """
+        if priority is None:
+            priority = self.get_priority()
+
+        interactive = priority == RateLimiter.INTERACTIVE
+        if interactive:
+            with self.lock:
+                self.interactive_waiting.value += 1
+
+        try:
+            while True:
+                with self.lock:
+                    now = time.monotonic()
+                    self.tokens.value = min(self.tokens.value + (now - self.updated.value) * self.rate.value,
+                                            self.burst)
+                    self.updated.value = now
+
+                    # Reddit has reset the window, so refill enough for a request of either priority to find out the
+                    # new rate, rather than background ones waiting out another window for the reserve to build up.
+                    if self.blocked_until.value and now >= self.blocked_until.value:
+                        self.tokens.value = max(self.tokens.value, min(1 + self.reserve, self.burst))
+                        self.blocked_until.value = 0.0
+
+                    if now < self.blocked_until.value:
+                        # We've used up the window, wait for Reddit to reset it.
+                        delay = self.blocked_until.value - now
+                    else:
+                        # Background requests leave the reserve alone and give way to any waiting interactive ones.
+                        needed = 1 if interactive else 1 + self.reserve
+                        if self.tokens.value >= needed and (interactive or self.interactive_waiting.value == 0):
+                            self.tokens.value -= 1
+                            return
+
+                        delay = max(needed - self.tokens.value, 0) / self.rate.value
+
+                # Wake up regularly so the priority of new arrivals is respected.
+                time.sleep(min(max(delay, 0.01), 0.25))
+        finally:
+            if interactive:
+                with self.lock:
+                    self.interactive_waiting.value -= 1
+
+    def update(self, status_code, headers):
+        """
+        Adjusts the rate from the rate limit headers of a response.
+        :param status_code: The HTTP status code of the response.
+        :param headers: The headers of the response.
+        """
+        try:
+            remaining = float(headers["X-Ratelimit-Remaining"])
+            reset = float(headers["X-Ratelimit-Reset"])
+        except (KeyError, TypeError, ValueError):
+            remaining = None
+            reset = None
+
+        with self.lock:
+            now = time.monotonic()
+
+            if remaining is not None:
+                # Spread what's left of the window over the time left in it, never holding more than that. Once it's
+                # used up a single token builds up by the reset, so one request can find out the new rate.
+                self.rate.value = max(remaining, 1.0) / max(reset, 1.0)
+                self.tokens.value = min(self.tokens.value, remaining)
+
+                if remaining < 1:
+                    self.blocked_until.value = now + reset
+
+            # We were told to back off.
+            if status_code == 429:
+                try:
+                    retry_after = float(headers.get("Retry-After", reset or 10))
+                except (TypeError, ValueError):
+                    retry_after = 10
+                self.blocked_until.value = max(self.blocked_until.value, now + retry_after)
@@ -0,0 +1,237 @@
+class Record:
+    """
+    A compact snapshot of a piece of Reddit content. PRAW objects drag along their reddit session, nested reply trees
+    and lazily loaded attributes, so they are converted to records before being handed to another process.
+    """
+
+    __slots__ = ("id", "name", "kind", "author", "subreddit", "score", "created", "archived", "title", "body",
+                 "parent_id", "depth")
+
+    # The maximum number of characters of a body or title that are kept
+    TEXT_LIMIT = 1000
+
+    def __init__(self, id, name, kind, author=None, subreddit=None, score=0, created=0.0, archived=False, title=None,
+                 body=None, parent_id=None, depth=0):
+        """
+        Initializes a new instance of the Record class.
+        :param id: The identifier of the content, e.g. "c5s96e0".
+        :param name: The fullname of the content, e.g. "t1_c5s96e0".
+        :param kind: The kind of content, one of "comment", "submission" or "redditor".
+        :param author: The username of the author.
+        :param subreddit: The name of the subreddit the content was posted in.
+        :param score: The score of the content.
+        :param created: The time the content was created in seconds since the epoch (UTC).
+        :param archived: True if the content is archived and can no longer be voted on, false otherwise.
+        :param title: The title of a submission.
+        :param body: The text of a comment or self post.
+        :param parent_id: The fullname of the parent comment or submission of a comment.
+        :param depth: The number of comments above a comment in its thread, 0 for top level comments.
+        """
+        self.id = id
+        self.name = name
+        self.kind = kind
+        self.author = author
+        self.subreddit = subreddit
+        self.score = score
+        self.created = created
+        self.archived = archived
+        self.title = title
+        self.body = body
+        self.parent_id = parent_id
+        self.depth = depth
+
+    @classmethod
+    def from_thing(cls, thing, depth=0):
+        """
+        Creates a record from a PRAW object.
+        :param thing: The PRAW comment, submission or redditor.
+        :param depth: The depth of a comment in its thread, see Record.depth.
+        :return: The record.
+        """
+        if thing is None:
+            return None
+
+        kind = type(thing).__name__.lower()
+        if kind == "loggedinredditor":
+            kind = "redditor"
+
+        author = getattr(thing, "author", None) if kind != "redditor" else thing.name
+        subreddit = getattr(thing, "subreddit", None)
+
+        return cls(getattr(thing, "id", None),
+                   getattr(thing, "name", None) if kind != "redditor" else thing.fullname,
+                   kind,
+                   author=str(author) if author is not None else None,
+                   subreddit=str(subreddit) if subreddit is not None else None,
+                   score=getattr(thing, "score", 0),
+                   created=getattr(thing, "created_utc", 0.0),
+                   archived=getattr(thing, "archived", False),
+                   title=truncate(getattr(thing, "title", None), cls.TEXT_LIMIT),
+                   body=truncate(getattr(thing, "body", None) or getattr(thing, "selftext", None), cls.TEXT_LIMIT),
+                   parent_id=getattr(thing, "parent_id", None),
+                   depth=depth)
+
+    def to_dict(self):
+        """
+        Gets the attributes of the record, e.g. for writing it out as JSON.
+        :return: The dictionary of attributes by name.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self):
+        """
+        Gets the text that describes the content the same way PRAW does.
+        :return: The string representation of the record.
+        """
+        if self.kind == "submission":
+            return "{0} :: {1}".format(self.score, self.title)
+
+        if self.kind == "redditor":
+            return self.author or ""
+
+        return self.body or ""
+
+    def __repr__(self):
+        """
+        Gets the string representation of the record.
+        :return: The string representation of the record.
+        """
+        return "Record(" + repr(self.name) + ")"
+
+    def __eq__(self, other):
+        """
+        Checks if two records describe the same content.
+        :param other: The other record.
+        :return: True if they share a fullname, false otherwise.
+        """
+        return isinstance(other, Record) and self.name == other.name
+
+    def __hash__(self):
+        """
+        Gets the hash of the record.
+        :return: The hash of the fullname.
+        """
+        return hash(self.name)
+
+
+class RecordSet:
+    """
+    A record together with the content that was retrieved beneath it, such as a user's history or a post's comments.
+    """
+
+    __slots__ = ("record", "posts", "all_comments")
+
+    def __init__(self, record, posts=None, all_comments=None):
+        """
+        Initializes a new instance of the RecordSet class.
+        :param record: The record of the user or submission.
+        :param posts: The list of post records, if retrieved.
+        :param all_comments: The list of comment records, if retrieved.
+        """
+        self.record = record
+        self.posts = posts
+        self.all_comments = all_comments
+
+    def __str__(self):
+        """
+        Gets the text that describes the underlying record.
+        :return: The string representation of the record.
+        """
+        return str(self.record)
+
+
+def flatten_tree(comments, max_depth=None, min_score=None, authors=None):
+    """
+    Converts a PRAW comment tree to records one comment at a time, in the order the comments are displayed. The tree
+    is walked with a stack instead of recursion, so deep threads can't overflow it, and pruned comments are never
+    converted.
+    :param comments: The top level PRAW comments. MoreComments stubs are skipped.
+    :param max_depth: The depth of the deepest comments to keep, None to keep every level.
+    :param min_score: Comments scoring lower than this are left out along with their replies, None to keep them.
+    :param authors: If provided, only the comments by these usernames are kept. The replies of other comments are
+    still searched.
+    :return: A generator of comment records.
+    """
+    authors = normalize_authors(authors)
+
+    # Each entry is the iterator over a list of siblings and their depth.
+    stack = [(iter(comments), 0)]
+    while stack:
+        siblings, depth = stack[-1]
+        comment = next(siblings, None)
+        if comment is None:
+            stack.pop()
+            continue
+
+        # Only MoreComments stubs have no body.
+        if not hasattr(comment, "body"):
+            continue
+
+        if min_score is not None and comment.score < min_score:
+            continue
+
+        if authors is None or str(comment.author).lower() in authors:
+            yield Record.from_thing(comment, depth)
+
+        # The loaded replies are read directly since the replies property may make a request to Reddit.
+        replies = getattr(comment, "_replies", None)
+        if replies and (max_depth is None or depth < max_depth):
+            stack.append((iter(replies), depth + 1))
+
+
+def filter_comments(records, max_depth=None, min_score=None, authors=None):
+    """
+    Filters comment records that were flattened by flatten_tree, e.g. from the cache, the same way it does.
+    :param records: The comment records in the order they are displayed.
+    :param max_depth: The depth of the deepest comments to keep, None to keep every level.
+    :param min_score: Comments scoring lower than this are left out along with their replies, None to keep them.
+    :param authors: If provided, only the comments by these usernames are kept.
+    :return: A generator of comment records.
+    """
+    authors = normalize_authors(authors)
+
+    # The depth of the comment whose replies are being skipped, if any
+    pruned_depth = None
+    for record in records:
+        if pruned_depth is not None:
+            if record.depth > pruned_depth:
+                continue
+            pruned_depth = None
+
+        if max_depth is not None and record.depth > max_depth:
+            continue
+
+        if min_score is not None and record.score < min_score:
+            pruned_depth = record.depth
+            continue
+
+        if authors is None or str(record.author).lower() in authors:
+            yield record
+
+
+def normalize_authors(authors):
+    """
+    Normalizes usernames for comparison, they are case insensitive.
+    :param authors: The usernames, may be None.
+    :return: The set of lowercase usernames, None if there weren't any.
+    """
+    if authors is None:
+        return None
+
+    if isinstance(authors, str):
+        authors = [authors]
+
+    return {author.lower() for author in authors}
+
+
+def truncate(text, limit):
+    """
+    Truncates text to a maximum number of characters.
+    :param text: The text to truncate, may be None.
+    :param limit: The maximum number of characters.
+    :return: The truncated text.
+    """
+    if text is None or len(text) <= limit:
+        return text
+
+    return text[:limit]
@@ -0,0 +1,251 @@
+"""
+A command line interface for looking up Reddit content without the form, e.g. from cron or a container. Results are
+written to standard output, or a file, as JSON Lines, CSV or Parquet, as they arrive. Log in with the form first, the
+saved login is shared.
+
+Usage:
+    python -m reddit_bot [--format jsonl|csv|parquet] [--output FILE] <command> ...
+    python -m reddit_bot get-user [usernames...] [--input FILE] [--posts] [--comments] [--limit N]
+    python -m reddit_bot get-post [post ids...] [--input FILE] [--max-depth N] [--min-score N] [--author NAME...]
+    python -m reddit_bot export [owners...]
+    python -m reddit_bot search [words...] [--author NAME] [--subreddit NAME] [--after DATE] [--before DATE] [--limit N]
+
+Usernames and post ids are read from the arguments, or from a file with one per line ("-" for standard input), or from
+standard input if neither is given.
+"""
+import argparse
+import sys
+
+import cache
+import export
+import logger
+import search
+from constants import *
+
+
+def main(argv=None):
+    """
+    Runs the command line interface.
+    :param argv: The arguments, None to use the arguments of the process.
+    :return: The exit code, 0 if everything was found, 1 otherwise.
+    """
+    parser = argparse.ArgumentParser(prog="reddit_bot",
+                                     description="Looks up Reddit content and writes out the records as they arrive.")
+    parser.add_argument("--format", choices=export.FORMATS, default="jsonl",
+                        help="the format the records are written in")
+    parser.add_argument("--output", help="the file the records are written to, the default is standard output")
+    parser.add_argument("--producers", type=positive_int, default=5, help="the number of lookups made at once")
+    parser.add_argument("--backend", choices=("thread", "process"), default="thread",
+                        help="whether lookups are made by threads or processes")
+    parser.add_argument("--no-cache", action="store_true", help="always retrieve everything from Reddit")
+    parser.add_argument("--log-level", choices=("debug", "info", "warning", "error"),
+                        help="the lowest level of messages logged to standard error, the default is warning")
+    parser.add_argument("--metrics-file", help="a file to write metrics of the lookups to in the Prometheus text format")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    get_user = commands.add_parser("get-user", help="get the history of users")
+    get_user.add_argument("usernames", nargs="*")
+    get_user.add_argument("--input", help="a file of usernames, one per line, \"-\" for standard input")
+    get_user.add_argument("--posts", action="store_true", help="get posts, the default is both posts and comments")
+    get_user.add_argument("--comments", action="store_true", help="get comments, the default is both")
+    get_user.add_argument("--limit", type=int, help="the number of most recent posts and comments to get")
+    get_user.set_defaults(run=run_get_user)
+
+    get_post = commands.add_parser("get-post", help="get posts and their comments")
+    get_post.add_argument("post_ids", nargs="*")
+    get_post.add_argument("--input", help="a file of post ids, one per line, \"-\" for standard input")
+    get_post.add_argument("--no-comments", action="store_true", help="only get the posts")
+    get_post.add_argument("--max-depth", type=int, help="the depth of the deepest comments, 0 for top level only")
+    get_post.add_argument("--min-score", type=int, help="leave out comments scoring lower, and their replies")
+    get_post.add_argument("--author", action="append", dest="authors", help="only comments by this user, repeatable")
+    get_post.set_defaults(run=run_get_post)
+
+    export_cache = commands.add_parser("export", help="write out content stored in the cache without going to Reddit")
+    export_cache.add_argument("owners", nargs="*", help="the owners to export, e.g. \"user:spez\", the default is all")
+    export_cache.set_defaults(run=run_export)
+
+    search_index = commands.add_parser("search", help="write out retrieved posts and comments found in the search index")
+    search_index.add_argument("words", nargs="*", help="words the title or body must contain, or start with")
+    search_index.add_argument("--author", help="only content by this user")
+    search_index.add_argument("--subreddit", help="only content in this subreddit")
+    search_index.add_argument("--after", type=search.parse_date, help="only content created on or after YYYY-MM-DD")
+    search_index.add_argument("--before", type=search.parse_date, help="only content created before YYYY-MM-DD")
+    search_index.add_argument("--limit", type=int, default=search_results_limit,
+                              help="the maximum number of records written")
+    search_index.set_defaults(run=run_search)
+
+    args = parser.parse_args(argv)
+    if args.log_level is not None:
+        logger.configure(args.log_level)
+
+    try:
+        writer = export.open_writer(args.format, args.output)
+    except (OSError, RuntimeError) as e:
+        logger.log("reddit_bot:", e)
+        return 2
+
+    with writer:
+        return args.run(args, writer)
+
+
+def run_get_user(args, writer):
+    """
+    Runs the get-user command.
+    :param args: The parsed arguments.
+    :param writer: The RecordWriter to write the records with.
+    :return: The exit code.
+    """
+    get_posts = args.posts or not args.comments
+    get_comments = args.comments or not args.posts
+
+    all_args = [(username, get_posts, get_comments) for username in read_inputs(args.usernames, args.input)]
+    return run_lookups(args, "get_user", all_args, {"page_size": results_page_size, "limit": args.limit},
+                       lambda username, page: write_user_page(writer, username, page))
+
+
+def write_user_page(writer, username, page):
+    """
+    Writes a page of a user's history.
+    :param writer: The RecordWriter to write the records with.
+    :param username: The username.
+    :param page: The page, see RedditClient.get_user_pages.
+    :return: True if the user was found, false otherwise.
+    """
+    if page is None:
+        logger.log("reddit_bot: User not found: ", username, sep="")
+        return False
+
+    writer.write(page["items"], username)
+    return True
+
+
+def run_get_post(args, writer):
+    """
+    Runs the get-post command.
+    :param args: The parsed arguments.
+    :param writer: The RecordWriter to write the records with.
+    :return: The exit code.
+    """
+    all_args = [(post_id, not args.no_comments) for post_id in read_inputs(args.post_ids, args.input)]
+    return run_lookups(args, "get_post", all_args,
+                       {"max_depth": args.max_depth, "min_score": args.min_score, "authors": args.authors},
+                       lambda post_id, post: write_post(writer, post_id, post))
+
+
+def write_post(writer, post_id, post):
+    """
+    Writes a post followed by its comments.
+    :param writer: The RecordWriter to write the records with.
+    :param post_id: The post id.
+    :param post: The RecordSet of the post.
+    :return: True if the post was found, false otherwise.
+    """
+    if post is None:
+        logger.log("reddit_bot: Post not found: ", post_id, sep="")
+        return False
+
+    writer.write([post.record], post_id)
+    writer.write(post.all_comments or [], post_id)
+    return True
+
+
+def run_lookups(args, name, all_args, params, write):
+    """
+    Runs lookups concurrently, writing the results as they arrive.
+    :param args: The parsed arguments.
+    :param name: The name of the RedditClient method that looks up one input.
+    :param all_args: The list of tuples of arguments, one per lookup. The first argument is the input.
+    :param params: The parameters to pass to every lookup.
+    :param write: The function that writes a result, passed the input and the result. It returns false if nothing
+    was found.
+    :return: The exit code.
+    """
+    # Imported here so exporting doesn't pay for PRAW.
+    from reddit_client import EmbeddedProxy
+
+    history_cache = None if args.no_cache else cache.HistoryCache(cache_file, cache_ttl, cache_max_items)
+    response_cache = None if args.no_cache else cache.ResponseCache(response_cache_file, response_cache_ttl,
+                                                                    response_cache_max_items)
+    proxy = EmbeddedProxy(user_data_file, args.producers, history_cache, backend=args.backend,
+                          metrics_file=args.metrics_file, response_cache=response_cache,
+                          search_index=search.SearchIndex(search_index_file),
+                          shared_memory_records=shared_memory_records)
+
+    failures = []
+
+    def on_result(result):
+        # Results are written by the proxy's consumer thread, one at a time.
+        lookup_args, value = result
+        if not write(lookup_args[0], value):
+            failures.append(lookup_args[0])
+
+    request = proxy.fan_out(name, all_args, params)
+    request.then(on_result)
+    request.result()
+
+    proxy.close()
+    return 1 if failures else 0
+
+
+def run_export(args, writer):
+    """
+    Runs the export command.
+    :param args: The parsed arguments.
+    :param writer: The RecordWriter to write the records with.
+    :return: The exit code.
+    """
+    history_cache = cache.HistoryCache(cache_file, cache_ttl, cache_max_items)
+    owners = set(args.owners)
+
+    for owner, kind in history_cache.list_owners():
+        if len(owners) == 0 or owner in owners:
+            writer.write(history_cache.iter_records(owner, kind), owner)
+
+    return 0
+
+
+def run_search(args, writer):
+    """
+    Runs the search command.
+    :param args: The parsed arguments.
+    :param writer: The RecordWriter to write the records with.
+    :return: The exit code, 1 if nothing was found.
+    """
+    text = " ".join(args.words)
+    records = search.SearchIndex(search_index_file).search(text, args.author, args.subreddit, args.after, args.before,
+                                                           args.limit)
+    writer.write(records, text)
+    return 0 if len(records) > 0 else 1
+
+
+def read_inputs(arguments, filename):
+    """
+    Reads the inputs to look up.
+    :param arguments: The inputs given as arguments.
+    :param filename: The file of inputs, one per line, "-" for standard input, None for none.
+    :return: The list of inputs. Blank lines and lines starting with # are skipped.
+    """
+    lines = list(arguments)
+    if filename == "-" or (filename is None and len(arguments) == 0):
+        lines.extend(sys.stdin)
+    elif filename is not None:
+        with open(filename) as file:
+            lines.extend(file)
+
+    return [line.strip() for line in lines if line.strip() != "" and not line.strip().startswith("#")]
+
+
+def positive_int(text):
+    """
+    Parses a count given as an argument that must be at least one.
+    :param text: The argument.
+    :return: The count.
+    """
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not {}".format(value))
+    return value
+
+
+if __name__ == "__main__":
+    sys.exit(main())
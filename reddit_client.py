@@ -1,13 +1,22 @@
+import collections
+import concurrent.futures
+import inspect
+import itertools
 import math
 import multiprocessing
 import os
 import pickle
+import queue
 import threading
-
-import praw
-import praw.handlers
+import time
 
 import logger
+import transport
+from metrics import ProxyMetrics
+from rate_limiter import RateLimiter
+from records import Record, RecordSet, filter_comments, flatten_tree
+from search import Indexer
+from token_broker import TokenBroker
 
 
 class RedditClient:
@@ -15,20 +24,43 @@ class RedditClient:
     A facade for dealing with PRAW since PRAW can be a nightmare. You may use the api directly for simple calls.
     """
 
-    def __init__(self, user_data_filename):
+    def __init__(self, user_data_filename, cache=None, access_information=None, login=True, handler=None):
         """
         Initializes a new instance of the RedditClient class.
         :param user_data_filename: The file that should be created or read in with user data.
+        :param cache: The HistoryCache to serve repeated requests from, None to always retrieve everything.
+        :param access_information: Access information that has already been refreshed, e.g. by a TokenBroker, to use
+        instead of refreshing our own.
+        :param login: True to log in with the saved user data, false to only read it in.
+        :param handler: The PRAW handler that makes the requests to Reddit, None for PRAW's default.
         """
-        # The Reddit API instance
-        self.api = praw.Reddit(user_agent="windows:reddit_play_thing:v1.0.0")
+        # The PRAW handler every Reddit API instance of this client makes its requests through, if not the default
+        self.handler = handler
 
-        # The hard coded application information we registered with Reddit
-        self.api.set_oauth_app_info("NvFC9EM7Z1jB4Q", "", "http://127.0.0.1:65010/authorize_callback")
+        # The Reddit API instance
+        self.api = self.create_api()
 
         # The number of times we can fail to make a call before stopping a loop
         self.FAILURE_LIMIT = 10
 
+        # The maximum number of items Reddit will return in a single listing request
+        self.LISTING_LIMIT = 100
+
+        # The maximum number of comments Reddit will return in a single more children request
+        self.MORE_CHILDREN_LIMIT = 100
+
+        # The number of requests made at once when expanding a comment tree
+        self.EXPAND_WORKERS = 8
+
+        # The threads that expand comment trees, started the first time one is expanded
+        self.expander = None
+
+        # The Reddit API instances of the expanding threads, PRAW sessions can't be shared between threads
+        self.local = threading.local()
+
+        # The cache of previously retrieved content, if any
+        self.cache = cache
+
         # The file to save the user data in that needs to be persisted between runs
         self.user_data_filename = user_data_filename
 
@@ -38,6 +70,11 @@ class RedditClient:
         # "refresh_token": The refresh token used to refresh our permissions to the user
         self.access_information = None
 
+        # Reuse access information we were given without making a request.
+        if access_information is not None:
+            self.set_access_information(access_information)
+            return
+
         try:
             if self.user_data_filename is not None and os.path.isfile(self.user_data_filename):
                 with open(self.user_data_filename, "rb") as file:
@@ -46,9 +83,41 @@ class RedditClient:
             logger.log("RedditClient.__init__: Error loading user data and refreshing:", e)
 
         # Try to login if we had information saved
-        if self.access_information is not None:
+        if self.access_information is not None and login:
             self.login(self.access_information["refresh_token"])
 
+    def create_api(self):
+        """
+        Creates a Reddit API instance for our application.
+        :return: The Reddit API instance.
+        """
+        # Imported here so only the processes that make requests pay for PRAW and the requests stack under it.
+        import praw
+
+        # Checking PyPI for a newer PRAW is a blocking request made by every process, and we're pinned to PRAW 3 anyway.
+        api = praw.Reddit(user_agent="windows:reddit_play_thing:v1.0.0", handler=self.handler,
+                          disable_update_check=True)
+
+        # The hard coded application information we registered with Reddit
+        api.set_oauth_app_info("NvFC9EM7Z1jB4Q", "", "http://127.0.0.1:65010/authorize_callback")
+        return api
+
+    def get_thread_api(self):
+        """
+        Gets the Reddit API instance of the current expanding thread, logged in the same as the main instance.
+        :return: The Reddit API instance.
+        """
+        api = getattr(self.local, "api", None)
+        if api is None:
+            api = self.local.api = self.create_api()
+
+        access_information = self.access_information
+        if access_information is not None and api.access_token != access_information["access_token"]:
+            api.set_access_credentials(access_information["scope"], access_information["access_token"],
+                                       access_information["refresh_token"], update_user=False)
+
+        return api
+
     def launch_authorization_page(self):
         """
         Launches the Reddit authorization page in a web browser for the user.
@@ -98,6 +167,15 @@ class RedditClient:
             logger.log("RedditClient.login: Error logging in:", e)
             return False
 
+    def set_access_information(self, access_information):
+        """
+        Uses access information that has already been retrieved or refreshed without making a request.
+        :param access_information: The access information.
+        """
+        self.access_information = access_information
+        self.api.set_access_credentials(access_information["scope"], access_information["access_token"],
+                                        access_information["refresh_token"], update_user=False)
+
     def is_logged_in(self):
         """
         Checks if a user is currently logged into the client.
@@ -111,67 +189,333 @@ class RedditClient:
     def get_me(self):
         """
         Returns the currently authenticated user's username.
-        :return: the username if successful, None otherwise.
+        :return: the record of the user if successful, None otherwise. It converts to the username as a string.
         """
         try:
-            return self.api.get_me()
+            return Record.from_thing(self.api.get_me())
         except:
             return None
 
-    def get_user(self, username, get_posts, get_comments):
+    def get_user(self, username, get_posts, get_comments, page_size=None, limit=None):
         """
         Gets information about a user.
         :param username: The username to query.
         :param get_posts: True if posts should be retrieved, false otherwise.
         :param get_comments: True if comments should be retrieved, false otherwise.
-        :return: An object of user information.
+        :param page_size: If provided, the history is streamed back in pages of this many items as they are retrieved
+        instead of all at once. See get_user_pages.
+        :param limit: The maximum number of the most recent posts and of the most recent comments to retrieve, None to
+        retrieve the whole history.
+        :return: A RecordSet of user information, or a generator of pages if a page size was provided.
         """
         if username is None or username == "":
             return
 
+        if page_size is not None:
+            return self.get_user_pages(username, get_posts, get_comments, page_size, limit)
+
         try:
-            # Get the user object
-            user = self.api.get_redditor(username)
+            # Only the username is known without asking Reddit about the user, which the history doesn't need.
+            user_set = RecordSet(Record(None, None, "redditor", author=username))
+            user_set.posts = [] if get_posts else None
+            user_set.all_comments = [] if get_comments else None
 
-            if get_posts:
-                user.posts = list(user.get_submitted(sort="new", time="all", limit=None))
+            for page in self.get_user_pages(username, get_posts, get_comments, self.LISTING_LIMIT, limit):
+                if page is None:
+                    return None
 
-            if get_comments:
-                user.all_comments = list(user.get_comments(sort="new", time="all", limit=None))
+                if page["kind"] == "posts":
+                    user_set.posts.extend(page["items"])
+                else:
+                    user_set.all_comments.extend(page["items"])
 
-            return user
+            return user_set
         except:
             return None
 
-    def get_post(self, post_id, get_comments):
+    def get_user_pages(self, username, get_posts, get_comments, page_size, limit=None):
+        """
+        Gets information about a user one page at a time as it is retrieved from Reddit.
+        :param username: The username to query.
+        :param get_posts: True if posts should be retrieved, false otherwise.
+        :param get_comments: True if comments should be retrieved, false otherwise.
+        :param page_size: The maximum number of items in each page.
+        :param limit: The maximum number of the most recent items of each kind, None to retrieve them all.
+        :return: A generator of pages. Each page is a dictionary containing the following:
+        "username": The username the page belongs to.
+        "kind": Either "posts" or "comments".
+        "items": The list of content records in the page, possibly empty.
+        "first": True if this is the first page of its kind, false otherwise.
+        "last": True if this is the final page of the whole history, false otherwise.
+        If the user could not be retrieved a single None is generated instead.
+        """
+        user = self.api.get_redditor(username)
+        owner = "user:" + username.lower()
+
+        listings = []
+        if get_posts:
+            listings.append(("posts", user.get_submitted))
+
+        if get_comments:
+            listings.append(("comments", user.get_comments))
+
+        for index, (kind, get_listing) in enumerate(listings):
+            last_kind = index == len(listings) - 1
+            first = True
+
+            try:
+                for items, complete in self.get_listing_pages(owner, kind, get_listing, page_size, limit):
+                    yield {"username": username, "kind": kind, "items": items, "first": first,
+                           "last": last_kind and complete}
+                    first = False
+            except Exception as e:
+                logger.log("RedditClient.get_user_pages: Error retrieving ", kind, ": ", e, sep="")
+
+                # If nothing could be retrieved at all the user most likely doesn't exist.
+                if index == 0 and first:
+                    yield None
+                    return
+
+                yield {"username": username, "kind": kind, "items": [], "first": first, "last": last_kind}
+
+    def get_listing_pages(self, owner, kind, get_listing, page_size, limit=None):
+        """
+        Gets a listing of content, newest first, one page at a time. If the listing is cached only the content newer
+        than the newest cached item is retrieved, which is usually a single request.
+        :param owner: The owner of the content in the cache, e.g. "user:spez".
+        :param kind: The kind of content in the cache, e.g. "comments".
+        :param get_listing: The PRAW method that creates the listing generator, e.g. Redditor.get_comments.
+        :param page_size: The maximum number of items in each page.
+        :param limit: The maximum number of items, None for the whole listing. A listing cut short by the limit is
+        cached apart from the whole listing, so it's only served for the same limit.
+        :return: A generator of tuples of the list of records in the page and whether it is the final page.
+        """
+        cached = self.cache.get(owner, kind) if self.cache is not None else None
+        cache_kind = kind
+
+        # Otherwise a listing retrieved up to the same limit will do, e.g. the latest comments of a commenter.
+        if not cached and self.cache is not None and limit is not None:
+            cache_kind = kind + ":" + str(limit)
+            cached = self.cache.get(owner, cache_kind)
+
+        # Without anything to refresh from retrieve the listing, streaming it into the cache as we go.
+        if not cached:
+            if self.cache is not None:
+                self.cache.clear(owner, cache_kind)
+
+            listing = get_listing(sort="new", time="all", limit=limit)
+            retrieved = 0
+            while True:
+                # A short page means the listing is exhausted, this saves us from having to read ahead a page.
+                items = [Record.from_thing(item) for item in itertools.islice(listing, page_size)]
+                retrieved += len(items)
+                complete = len(items) < page_size or (limit is not None and retrieved >= limit)
+
+                if self.cache is not None:
+                    self.cache.add(owner, cache_kind, items)
+                    if complete:
+                        self.cache.complete(owner, cache_kind)
+
+                yield items, complete
+
+                if complete:
+                    return
+
+        # Walk forward from the newest item we have, Reddit returns the items immediately before the cursor. PRAW
+        # would follow the after cursor of a short page while still sending before, getting the same items again, so
+        # each cursor is a single request.
+        known = set(record.name for record in cached)
+        new_items = []
+        before = cached[0].name
+        while True:
+            page = [Record.from_thing(item) for item in get_listing(sort="new", time="all", limit=0,
+                                                                    params={"before": before,
+                                                                            "limit": self.LISTING_LIMIT})]
+            fresh = [record for record in page if record.name not in known]
+            known.update(record.name for record in fresh)
+            new_items = fresh + new_items
+
+            # Anything we already have means we've caught up.
+            if len(page) < self.LISTING_LIMIT or len(fresh) < len(page):
+                break
+
+            before = page[0].name
+
+        self.cache.add(owner, cache_kind, new_items)
+
+        items = new_items + cached
+        if limit is not None:
+            items = items[:limit]
+
+        for x in range(0, max(len(items), 1), page_size):
+            yield items[x:x + page_size], x + page_size >= len(items)
+
+    def get_post(self, post_id, get_comments, max_depth=None, min_score=None, authors=None):
         """
         Gets information about a submission.
         :param post_id: The submission identifier.
         :param get_comments: True if comments should be retrieved, false otherwise.
-        :return: An object of submission information.
+        :param max_depth: The depth of the deepest comments to return, None to return every level.
+        :param min_score: Comments scoring lower than this are left out along with their replies, None to keep them.
+        :param authors: If provided, only the comments by these usernames are returned.
+        :return: A RecordSet of submission information. The comments are in the order they are displayed.
         """
+        owner = "post:" + post_id
+
+        # Comment trees can't be refreshed incrementally, so a cached post is only served until it expires.
+        if self.cache is not None:
+            cached_post = self.cache.get(owner, "post")
+            cached_comments = self.cache.get(owner, "comments") if get_comments else None
+            if cached_post and (not get_comments or cached_comments is not None):
+                if cached_comments is not None:
+                    cached_comments = list(filter_comments(cached_comments, max_depth, min_score, authors))
+                return RecordSet(cached_post[0], all_comments=cached_comments)
+
         try:
             post = self.api.get_submission(submission_id=post_id)
+            post_set = RecordSet(Record.from_thing(post))
 
             if get_comments:
-                post.replace_more_comments(limit=None, threshold=0)
-                post.all_comments = praw.helpers.flatten_tree(post.comments)
+                self.expand_comments(post)
+
+                # The whole tree is cached so any filter can be served from it later.
+                if self.cache is not None:
+                    all_comments = list(flatten_tree(post.comments))
+                    post_set.all_comments = list(filter_comments(all_comments, max_depth, min_score, authors))
+                else:
+                    post_set.all_comments = list(flatten_tree(post.comments, max_depth, min_score, authors))
+
+            if self.cache is not None:
+                self.cache.clear(owner, "post")
+                self.cache.add(owner, "post", [post_set.record])
+                self.cache.complete(owner, "post")
 
-            return post
+                if get_comments:
+                    self.cache.clear(owner, "comments")
+                    self.cache.add(owner, "comments", all_comments, in_order=True)
+                    self.cache.complete(owner, "comments")
+
+            return post_set
         except:
             return None
 
+    def expand_comments(self, post):
+        """
+        Replaces every MoreComments stub in the comment tree of a submission with the comments it stands for. Unlike
+        Submission.replace_more_comments, which makes one request per stub one after the other, the children of all the
+        stubs found so far are merged into full more children requests that are made concurrently. The stubs those
+        return are expanded in the next round, until there are none left.
+        :param post: The PRAW submission.
+        """
+        if self.expander is None:
+            self.expander = concurrent.futures.ThreadPoolExecutor(self.EXPAND_WORKERS)
+
+        # The requests made for us should be scheduled the same as ours.
+        limiter = getattr(self.handler, "limiter", None)
+        priority = limiter.get_priority() if limiter is not None else None
+
+        stubs = post._extract_more_comments(post.comments)
+        while stubs:
+            # "Continue this thread" stubs have no count and can only be retrieved one at a time.
+            continued = [stub for stub in stubs if stub.count == 0 and len(stub.children) > 0]
+
+            children = []
+            for stub in stubs:
+                if stub.count > 0:
+                    children.extend(child for child in stub.children if "t1_" + child not in post._comments_by_id)
+            children = list(dict.fromkeys(children))
+
+            jobs = [(self.get_more_children, children[x:x + self.MORE_CHILDREN_LIMIT])
+                    for x in range(0, len(children), self.MORE_CHILDREN_LIMIT)]
+            jobs.extend((self.get_continued_comments, stub) for stub in continued)
+
+            futures = [self.expander.submit(self.run_expand_job, limiter, priority, method, post, argument)
+                       for method, argument in jobs]
+
+            # Merge the results in the order they were requested so the tree comes out the same every time.
+            stubs = []
+            for future in futures:
+                comments = future.result()
+                for stub in post._extract_more_comments(comments):
+                    stub._update_submission(post)
+                    stubs.append(stub)
+
+                for comment in comments:
+                    post._insert_comment(comment)
+
+        post._replaced_more = True
+
+    @staticmethod
+    def run_expand_job(limiter, priority, method, post, argument):
+        """
+        Runs a request of a comment tree expansion on an expanding thread.
+        :param limiter: The RateLimiter of our handler, None if there isn't one.
+        :param priority: The priority of the requests.
+        :param method: The method that makes the request.
+        :param post: The PRAW submission being expanded.
+        :param argument: The argument of the method.
+        :return: The list of retrieved comments and stubs, empty if the request failed.
+        """
+        if limiter is not None:
+            limiter.set_priority(priority)
+
+        try:
+            return method(post, argument) or []
+        except Exception as e:
+            logger.log("RedditClient.run_expand_job: Error expanding comments:", e)
+            return []
+
+    def get_more_children(self, post, children):
+        """
+        Retrieves comments of a submission by identifier.
+        :param post: The PRAW submission.
+        :param children: The identifiers of the comments, at most MORE_CHILDREN_LIMIT.
+        :return: The flat list of retrieved comments and stubs for the comments beneath them.
+        """
+        api = self.get_thread_api()
+
+        data = {"children": ",".join(children), "link_id": post.fullname, "r": str(post.subreddit)}
+        if post._comment_sort:
+            data["where"] = post._comment_sort
+
+        return api.request_json(api.config["morechildren"], data=data)["data"]["things"]
+
+    def get_continued_comments(self, post, stub):
+        """
+        Retrieves the comments of a "continue this thread" stub.
+        :param post: The PRAW submission.
+        :param stub: The MoreComments stub.
+        :return: The tree of retrieved comments.
+        """
+        api = self.get_thread_api()
+
+        thread = api.get_submission(post.permalink.rstrip("/") + "/" + stub.parent_id.split("_", 1)[1])
+        return thread.comments[0].replies if len(thread.comments) == 1 else []
+
     def vote(self, upvote, all_content, callback=None):
         """
         Upvotes a list of content.
         :param upvote: True to upvote, false to downvote.
         :param all_content: The list of content.
-        :param callback: The callback to call to report the status of each status item.
+        :param callback: The callback to call to report the status of each status item. It is passed the content
+        that was voted on as it was provided rather than the freshly retrieved item.
+        """
+        for content, success in self.iter_vote(upvote, all_content):
+            # If there is something to call, report the status.
+            if callable(callback):
+                callback(content, success)
+
+    def iter_vote(self, upvote, all_content):
         """
-        for item in all_content:
+        Upvotes a list of content, reporting the status of each item as it's voted on.
+        :param upvote: True to upvote, false to downvote.
+        :param all_content: The list of content.
+        :return: A generator of tuples of the content as it was provided and True if successful, false otherwise.
+        """
+        for content in all_content:
             try:
                 # We have to retrieve the item fresh since this was serialized.
-                item = self.api.get_info(thing_id=item.name)
+                item = self.api.get_info(thing_id=content.name)
 
                 # Upvote or downvote the content.
                 if upvote is None:
@@ -180,53 +524,654 @@ class RedditClient:
                     item.upvote()
                 else:
                     item.downvote()
-
-                # If there is something to call, report success.
-                if callable(callback):
-                    callback(item, True)
             except:
-                # If there is something to call, report failure.
-                if callable(callback):
-                    callback(item, False)
+                yield content, False
+                continue
+
+            yield content, True
+
+
+class Request:
+    """
+    A handle to a command sent to the producers. Responses are routed to the request that sent the command by a unique
+    identifier. Responses that arrive before anyone subscribes are kept until someone does.
+    """
+
+    def __init__(self, request_id, name, key=None, history_size=0):
+        """
+        Initializes a new instance of the Request class.
+        :param request_id: The unique identifier of the request.
+        :param name: The name of the method that was called.
+        :param key: The key of the command that identical commands sent while this one is waiting are coalesced on,
+        None if they aren't.
+        :param history_size: The number of responses kept for followers that join after they were delivered. Once
+        there are more, e.g. a long stream, they're dropped and no one else can follow, so a streamed command doesn't
+        hold on to every page. 0 to only be followed until the first response.
+        """
+        self.id = request_id
+        self.name = name
+        self.key = key
+
+        # Held while responses are delivered so subscribers see them in order, even when replayed
+        self.lock = threading.RLock()
+        self.finished = threading.Event()
+
+        self.callbacks = []
+        self.done_callbacks = []
+
+        # The responses that arrived before there was a callback to pass them to
+        self.responses = []
+
+        # The return value of the final response
+        self.value = None
+
+        # The requests of identical commands that are passed our responses instead of being sent themselves
+        self.followers = []
+
+        # Every response so far, kept for followers that join late, None once no one else can follow
+        self.history = [] if key is not None else None
+        self.history_size = history_size
+
+    def then(self, callback):
+        """
+        Adds a callback that is passed the return value of each response. A streamed command calls it once per
+        streamed item. Only the first callback added receives the responses that arrived before it.
+        :param callback: The callback to pass the return value to.
+        :return: This request, so calls can be chained.
+        """
+        with self.lock:
+            self.callbacks.append(callback)
+
+            responses = self.responses
+            self.responses = []
+            for message in responses:
+                self.call(callback, message)
+
+        return self
+
+    def add_done_callback(self, callback):
+        """
+        Adds a callback that is passed this request once the final response has been delivered. If that has already
+        happened it is called immediately.
+        :param callback: The callback to pass the request to.
+        :return: This request, so calls can be chained.
+        """
+        with self.lock:
+            if not self.finished.is_set():
+                self.done_callbacks.append(callback)
+                return self
+
+        self.call(callback, {"return": self})
+        return self
+
+    def done(self):
+        """
+        Checks if the final response has been delivered.
+        :return: True if finished, false otherwise.
+        """
+        return self.finished.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the final response.
+        :param timeout: The maximum number of seconds to wait, None to wait forever.
+        :return: The return value of the command, None for streamed commands or if we timed out.
+        """
+        self.finished.wait(timeout)
+        return self.value
+
+    def can_follow(self):
+        """
+        Checks if another request can still get every response of this one.
+        :return: True if it can, false if responses were already dropped.
+        """
+        return self.history is not None
+
+    def follow(self, follower):
+        """
+        Passes every response of this request to another request, starting with the ones already delivered.
+        :param follower: The Request of an identical command.
+        :return: True if the follower gets every response, false if some were already dropped and it got none.
+        """
+        with self.lock:
+            if self.history is None:
+                return False
+
+            for message in self.history:
+                follower.respond(message)
+
+            if not self.finished.is_set():
+                self.followers.append(follower)
+
+        return True
+
+    def respond(self, message):
+        """
+        Delivers a response message to the subscribers. Called by the consumer.
+        :param message: The response message.
+        """
+        with self.lock:
+            # A closing message only marks the end of a stream, there's nothing to pass along.
+            if not message.get("closing", False):
+                if len(self.callbacks) == 0:
+                    self.responses.append(message)
+
+                for callback in self.callbacks:
+                    self.call(callback, message)
+
+            # A callback on this thread may start following us while we deliver, it gets the message below.
+            if self.history is not None:
+                self.history.append(message)
+                if len(self.history) > self.history_size:
+                    self.history = None
+            for follower in list(self.followers):
+                follower.respond(message)
+
+            if message.get("partial", False):
+                return
+
+            self.value = message.get("return", None)
+            self.finished.set()
+            self.followers = []
+
+            done_callbacks = self.done_callbacks
+            self.done_callbacks = []
+
+        for callback in done_callbacks:
+            self.call(callback, {"return": self})
+
+    @staticmethod
+    def call(callback, message):
+        """
+        Passes the return value of a message to a callback, if there is one.
+        :param callback: The callback.
+        :param message: The message.
+        """
+        try:
+            if "return" in message:
+                callback(message["return"])
+            else:
+                callback()
+        except Exception as ex:
+            logger.log("Request.call: Caught the following exception during method invocation: ", ex, sep="")
 
 
 class EmbeddedProxy:
-    def __init__(self, user_data_filename, producer_processes):
+    # The number of seconds a producer waits for the token broker before starting without access information
+    LOGIN_TIMEOUT = 30
+
+    # The commands the user is waiting on, their requests to Reddit go ahead of background ones
+    INTERACTIVE_COMMANDS = frozenset(("get_me", "get_post", "is_logged_in", "login", "login_first_time"))
+
+    # The commands that only read, identical ones sent while one is waiting share its responses
+    COALESCED_COMMANDS = frozenset(("get_me", "get_post", "get_user", "get_user_pages", "is_logged_in"))
+
+    # The commands whose responses can be remembered for a while, they don't depend on being logged in
+    MEMOIZED_COMMANDS = frozenset(("get_post", "get_user", "get_user_pages"))
+
+    # The number of responses of a memoized command that are kept for reuse, longer streams aren't reused
+    MEMO_HISTORY_SIZE = 16
+
+    # The commands whose responses are added to the search index
+    INDEXED_COMMANDS = frozenset(("get_post", "get_user", "get_user_pages"))
+
+    # The minimum number of seconds between writes of the metrics file
+    METRICS_INTERVAL = 10
+
+    # The minimum number of seconds between samples of the queue depths as responses arrive
+    DEPTHS_INTERVAL = 0.1
+
+    def __init__(self, user_data_filename, producer_processes, cache=None, backend="process", min_producers=1,
+                 idle_timeout=30, handler_factory=None, metrics_file=None, metrics_port=None, coalesce=True,
+                 memo_ttl=None, memo_size=128, response_cache=None, search_index=None, shared_memory_records=None):
         """
         Initializes a new instance of the RedditProxy class.
         :param user_data_filename: The file that should be created or read in with user data.
-        :param producer_processes: The number of producer processes to make reddit requests with.
+        :param producer_processes: The maximum number of producer processes to make reddit requests with. Producers are
+        started as commands queue up and stopped once they've been idle for a while.
+        :param cache: The HistoryCache the producers share, None to always retrieve everything.
+        :param backend: Either "process" to run the producers in their own processes or "thread" to run them as
+        threads of this process. Threads start faster, use less memory, share a single login and pass requests and
+        responses by reference without serializing them. Processes keep the producers off of this process's GIL.
+        :param min_producers: The number of producers started immediately and kept running even when idle.
+        :param idle_timeout: The number of seconds a producer beyond the minimum waits for a command before stopping.
+        :param handler_factory: Creates the PRAW handler of each producer when passed the shared RateLimiter, e.g. an
+        offline.OfflineHandler to run without Reddit. It must be picklable for the process backend. None for a
+        handlers.ScheduledHandler.
+        :param metrics_file: A file the metrics are written to in the Prometheus text format every METRICS_INTERVAL
+        seconds while commands are running and when closed, None for none.
+        :param metrics_port: A port on this machine to serve the metrics on in the Prometheus text format, None for
+        none.
+        :param coalesce: True to have identical read only commands that are sent while one is waiting share its
+        responses instead of being sent again, false to always send them.
+        :param memo_ttl: The number of seconds the responses of finished read only commands are reused for identical
+        commands, None to not reuse them. Requires coalesce. Streams of more than MEMO_HISTORY_SIZE responses aren't
+        reused.
+        :param memo_size: The maximum number of finished commands whose responses are kept for reuse.
+        :param response_cache: The ResponseCache the handlers of the producers share, passed to the handler factory,
+        None for none.
+        :param search_index: The SearchIndex the posts and comments of responses are added to as they arrive, None for
+        none.
+        :param shared_memory_records: The number of records a list in a response needs to be sent from a producer
+        process through shared memory rather than pickled through the consumer queue, see transport. None to send
+        everything through the queue. Ignored by the thread backend, which doesn't copy responses at all.
         """
-        self.reddit = None
+        if backend not in ("process", "thread"):
+            raise ValueError("Unknown producer backend \"" + str(backend) + "\"")
+
         self.producer_processes = producer_processes
+        self.backend = backend
+        self.min_producers = min(min_producers, producer_processes)
+        self.idle_timeout = idle_timeout
+        self.coalesce = coalesce
+        self.memo_ttl = memo_ttl
+        self.memo_size = memo_size
+        self.user_data_filename = user_data_filename
+        self.cache = cache
+        self.handler_factory = handler_factory
+        self.response_cache = response_cache
+        self.shared_memory_records = shared_memory_records if backend == "process" else None
+
+        # The state of the producer running on the current thread
+        self.worker = threading.local()
+
+        # Set once PRAW is imported and the first producers are started, in the background so creating the proxy
+        # doesn't hold up whoever created it, e.g. the form appearing
+        self.warmed = threading.Event()
 
         # Two queues, one for requests and one for responses.
-        self.producer_queue = multiprocessing.Queue()
-        self.consumer_queue = multiprocessing.Queue()
+        if backend == "thread":
+            self.producer_queue = queue.Queue()
+            self.consumer_queue = queue.Queue()
+        else:
+            self.producer_queue = multiprocessing.Queue()
+            self.consumer_queue = multiprocessing.Queue()
         self.callbacks = {}
 
-        # Create a list of producers in different processes.
+        # Schedules the requests every producer makes to Reddit
+        self.limiter = RateLimiter()
+
+        # Refreshes the access information once for every producer, through the same handler and limiter, started
+        # once they are
+        self.broker = TokenBroker(user_data_filename, handler_factory, self.limiter)
+
+        # Indexes the content of responses in the background, only in this process
+        self.indexer = Indexer(search_index) if search_index is not None else None
+
+        # Measures where the time of each command goes, only in this process
+        self.metrics = ProxyMetrics()
+        self.metrics_file = metrics_file
+        self.metrics_written = time.perf_counter()
+        self.depths_sampled = 0.0
+        self.metrics_server = self.metrics.serve(metrics_port) if metrics_port is not None else None
+
+        # The requests waiting on responses by identifier
+        self.requests = {}
+        self.request_ids = itertools.count()
+        self.requests_lock = threading.Lock()
+
+        # The requests of commands that identical commands are coalesced onto, while waiting and for a while after,
+        # by command key. Protected by the requests lock.
+        self.in_flight = {}
+        self.memo = collections.OrderedDict()
+
+        # The producers in different processes or threads. Only the minimum are started when warmed up, the rest on
+        # demand.
         self.producers = []
-        for x in range(producer_processes):
-            producer = multiprocessing.Process(target=self.producer_main,
-                                               args=(self.producer_queue, self.consumer_queue, user_data_filename))
-            producer.daemon = True
-            producer.start()
-            self.producers.append(producer)
+        self.live_producers = 0
+        self.scale_lock = threading.Lock()
+
+        warmer = threading.Thread(target=self.warm_up)
+        warmer.daemon = True
+        warmer.start()
 
         # Create the consumer in the same process for retrieving responses async.
         self.consumer = threading.Thread(target=self.consumer_main, args=(self.consumer_queue,))
         self.consumer.daemon = True
         self.consumer.start()
 
+    def __getstate__(self):
+        """
+        Needed for pickle, only the state the producers use is sent to their processes.
+        :return: The state of the object.
+        """
+        state = self.__dict__.copy()
+        for name in ("producers", "consumer", "callbacks", "requests", "request_ids", "requests_lock", "worker",
+                     "scale_lock", "metrics", "metrics_server", "in_flight", "memo", "indexer", "warmed"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Needed for pickle, restores the state of the object in a producer process.
+        :param state: The state of the object.
+        """
+        self.__dict__.update(state)
+        self.worker = threading.local()
+
+    @property
+    def reddit(self):
+        """
+        Gets the RedditClient of the producer running on the current thread.
+        :return: The RedditClient, None if this isn't a producer.
+        """
+        return getattr(self.worker, "reddit", None)
+
+    def create_client(self, user_data_filename, cache):
+        """
+        Creates the RedditClient for a producer using the access information from the token broker rather than
+        refreshing its own.
+        :param user_data_filename: The data file that contains existing user data.
+        :param cache: The HistoryCache to serve repeated requests from, may be None.
+        :return: The RedditClient.
+        """
+        # Wait for the first refresh so we don't start out logged out, but don't hang if Reddit is unreachable.
+        if not self.broker.wait(self.LOGIN_TIMEOUT):
+            logger.log("EmbeddedProxy.create_client: Timed out waiting for access information.")
+
+        version, access_information = self.broker.get()
+        client = RedditClient(user_data_filename, cache, access_information, login=False,
+                              handler=create_handler(self.handler_factory, self.limiter, self.response_cache))
+
+        self.worker.token_version = version
+        self.worker.published = client.access_information
+        return client
+
+    def sync_access_information(self):
+        """
+        Keeps the access information of the current producer in sync with the token broker. Called around every
+        request so refreshed access information is picked up and a first time login is shared with everyone.
+        """
+        reddit = self.reddit
+
+        # Share access information we got by logging in ourselves.
+        if reddit.access_information is not self.worker.published:
+            self.broker.publish(reddit.access_information)
+            self.worker.published = reddit.access_information
+            self.worker.token_version = self.broker.version.value
+            return
+
+        # Pick up access information the broker refreshed.
+        if self.broker.version.value != self.worker.token_version:
+            version, access_information = self.broker.get()
+            if access_information is not None:
+                reddit.set_access_information(access_information)
+                self.worker.published = reddit.access_information
+            self.worker.token_version = version
+
+    def warm_up(self):
+        """
+        Imports PRAW so the producers forked from this process start with it, then starts the minimum number of
+        producers, which create their clients right away, and the token broker. Run in the background when the proxy
+        is created, commands added in the meantime wait on the producer queue.
+        """
+        # Forking while another thread is halfway through an import would leave the import locked in the producer, so
+        # nothing is started until PRAW is in.
+        try:
+            import handlers
+        except Exception as e:
+            logger.log("EmbeddedProxy.warm_up: Error importing PRAW:", e)
+
+        self.warmed.set()
+        self.scale()
+
+        with self.scale_lock:
+            # Unless we were closed in the meantime.
+            if self.producer_processes > 0:
+                self.broker.start()
+
+    def scale(self):
+        """
+        Starts producers until there is one for every outstanding command, up to the maximum. Called whenever a
+        command is added or a producer stops, and once warmed up.
+        """
+        if not self.warmed.is_set():
+            return
+
+        with self.scale_lock:
+            with self.requests_lock:
+                outstanding = len(self.requests)
+
+            target = min(max(outstanding, self.min_producers), self.producer_processes)
+            while self.live_producers < target:
+                # The minimum number of producers never time out.
+                idle_timeout = self.idle_timeout if self.live_producers >= self.min_producers else None
+
+                worker_type = threading.Thread if self.backend == "thread" else multiprocessing.Process
+                producer = worker_type(target=self.producer_main,
+                                       args=(self.producer_queue, self.consumer_queue, self.user_data_filename,
+                                             self.cache, idle_timeout))
+                producer.daemon = True
+                producer.start()
+
+                self.producers = [producer for producer in self.producers if producer.is_alive()] + [producer]
+                self.live_producers += 1
+                self.metrics.set_workers(self.live_producers)
+
+    def close(self):
+        """
+        Stops the producers and the consumer. Commands that are still waiting will not be run.
+        """
+        with self.scale_lock:
+            # Stop any more producers from being started.
+            self.producer_processes = 0
+            self.broker.stop()
+            for x in range(self.live_producers):
+                self.producer_queue.put(None)
+
+        for producer in self.producers:
+            producer.join(5)
+
+        self.consumer_queue.put(None)
+        self.consumer.join(5)
+
+        # Free the shared memory of the responses that won't be received now.
+        if self.shared_memory_records is not None:
+            while True:
+                try:
+                    message = self.consumer_queue.get(timeout=0.1)
+                except queue.Empty:
+                    break
+                if message is not None and "return" in message:
+                    transport.discard(message["return"])
+
+        if self.indexer is not None:
+            self.indexer.stop()
+
+        self.metrics.set_workers(0)
+        if self.metrics_file is not None:
+            self.write_metrics()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+
+    def get_metrics(self):
+        """
+        Gets where the time of the commands has gone so far, see ProxyMetrics.snapshot.
+        :return: The dictionary of metrics.
+        """
+        self.update_queue_depths()
+        return self.metrics.snapshot()
+
+    def update_queue_depths(self):
+        """
+        Updates the gauges of the number of messages waiting on each queue and of commands waiting on responses.
+        """
+        for name, waiting in (("producer_queue", self.producer_queue), ("consumer_queue", self.consumer_queue)):
+            try:
+                self.metrics.set_gauge(name, waiting.qsize())
+            except NotImplementedError:
+                # The size of a multiprocessing queue isn't available on macOS.
+                pass
+
+        with self.requests_lock:
+            self.metrics.set_gauge("outstanding_commands", len(self.requests))
+        self.depths_sampled = time.perf_counter()
+
+    def write_metrics(self):
+        """
+        Writes the metrics file.
+        """
+        self.update_queue_depths()
+        try:
+            self.metrics.write_prometheus(self.metrics_file)
+        except OSError as e:
+            logger.log("EmbeddedProxy.write_metrics: Error writing the metrics:", e)
+        self.metrics_written = time.perf_counter()
+
+    def ping(self, payload=None):
+        """
+        A command that does nothing but respond, used to check the producers are responsive.
+        :param payload: Anything to send back.
+        :return: The payload.
+        """
+        return payload
+
     def add_command(self, name, *args, **params):
         """
-        Adds a command to the producer queue for processing.
+        Adds a command to the producer queue for processing. A read only command identical to one that's still
+        waiting, or that finished within the memo's time to live, isn't added but gets that command's responses.
         :param name: The name of the method to call.
         :param args: The arguments to pass to the method.
         :param params: The parameters to pass to the method.
+        :return: The Request that will be notified of the responses.
+        """
+        key = self.get_command_key(name, args, params)
+        with self.requests_lock:
+            leader = self.find_leader(key) if key is not None else None
+
+        # An identical command is already taken care of, so just pass along its responses. This is done without the
+        # lock since the responses it already has may finish the request and start its done callbacks.
+        if leader is not None:
+            request = Request(None, name)
+            if leader.follow(request):
+                return request
+
+        # The leader may have dropped its first responses in the meantime, then the command is sent after all.
+        history_size = self.MEMO_HISTORY_SIZE if self.memo_ttl is not None and name in self.MEMOIZED_COMMANDS else 0
+        with self.requests_lock:
+            request = Request(next(self.request_ids), name, key, history_size)
+            self.requests[request.id] = request
+            if key is not None:
+                self.in_flight[key] = request
+
+        priority = RateLimiter.INTERACTIVE if name in self.INTERACTIVE_COMMANDS else RateLimiter.BACKGROUND
+        self.producer_queue.put({"id": request.id, "name": name, "args": args, "params": params,
+                                 "priority": priority, "enqueued": time.perf_counter()})
+        self.scale()
+        return request
+
+    def get_command_key(self, name, args, params):
+        """
+        Gets the key identical commands are coalesced on.
+        :param name: The name of the method to call.
+        :param args: The arguments to pass to the method.
+        :param params: The parameters to pass to the method.
+        :return: The key, None if the command isn't coalesced, e.g. it isn't read only or has unhashable arguments.
+        """
+        if not self.coalesce or name not in self.COALESCED_COMMANDS:
+            return None
+
+        key = (name, args, tuple(sorted(params.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def find_leader(self, key):
+        """
+        Finds the request an identical command should follow, either because it's waiting and hasn't dropped any
+        responses yet or because it finished recently enough to be reused. Called with the requests lock held.
+        :param key: The key of the command.
+        :return: The Request, None if there isn't one.
+        """
+        leader = self.in_flight.get(key, None)
+        if leader is not None and leader.can_follow():
+            self.metrics.increment("coalesced_commands")
+            return leader
+
+        memoized = self.memo.get(key, None)
+        if memoized is not None:
+            expires, leader = memoized
+            if time.monotonic() < expires and leader.can_follow():
+                self.metrics.increment("memo_hits")
+                return leader
+            del self.memo[key]
+
+        return None
+
+    def finish_leader(self, request):
+        """
+        Stops coalescing commands onto a request once its final response has arrived, remembering it for a while if
+        its command can be. Called with the requests lock held.
+        :param request: The Request.
+        """
+        if self.in_flight.get(request.key, None) is request:
+            del self.in_flight[request.key]
+
+        if self.memo_ttl is None or request.name not in self.MEMOIZED_COMMANDS or not request.can_follow():
+            return
+
+        self.memo[request.key] = (time.monotonic() + self.memo_ttl, request)
+        self.memo.move_to_end(request.key)
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def clear_memo(self):
         """
-        self.producer_queue.put({"name": name, "args": args, "params": params})
+        Forgets the responses of finished commands, so the next identical commands are sent again.
+        """
+        with self.requests_lock:
+            self.memo.clear()
+
+    def fan_out(self, name, all_args, params=None, max_in_flight=None):
+        """
+        Calls a method once for each set of arguments, keeping at most a limited number of the calls waiting on the
+        producers at once so a large batch doesn't crowd out everything else.
+        :param name: The name of the method to call.
+        :param all_args: The list of tuples of arguments, one per call.
+        :param params: The parameters to pass to every call.
+        :param max_in_flight: The maximum number of calls waiting at once, None for one per producer.
+        :return: A Request that is passed a tuple of the arguments and the return value of each call as it finishes,
+        or of each streamed item as it arrives, and that is finished once every call is.
+        """
+        all_args = list(all_args)
+        params = params or {}
+        max_in_flight = max_in_flight or self.producer_processes
+
+        fan_out = Request(None, name)
+        pending = iter(all_args)
+        remaining = [len(all_args)]
+        lock = threading.Lock()
+
+        def start_next():
+            with lock:
+                args = next(pending, None)
+
+            if args is not None:
+                request = self.add_command(name, *args, **params)
+                request.then(lambda value: fan_out.respond({"id": None, "name": name, "return": (args, value),
+                                                            "partial": True}))
+                request.add_done_callback(lambda finished: on_finished())
+
+        def on_finished():
+            with lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+
+            if finished:
+                fan_out.respond({"id": None, "name": name, "closing": True})
+            else:
+                start_next()
+
+        if len(all_args) == 0:
+            fan_out.respond({"id": None, "name": name, "closing": True})
+
+        for x in range(min(max_in_flight, len(all_args))):
+            start_next()
+
+        return fan_out
 
     def add_callback(self, name, callback, calls=None):
         """
@@ -268,24 +1213,34 @@ class EmbeddedProxy:
         if len(callback_list) == 0:
             del self.callbacks[name]
 
-    def producer_main(self, request_queue, response_queue, user_data_filename):
+    def producer_main(self, request_queue, response_queue, user_data_filename, cache, idle_timeout=None):
         """
         The main method for the RedditProxy in a seperate method. Used to make calls to the RedditClient class.
         :param request_queue: The queue we will receive requests on.
         :param response_queue: The queue we will use to respond.
         :param user_data_filename: The data file that contains existing user data.
+        :param cache: The HistoryCache to serve repeated requests from, may be None.
+        :param idle_timeout: The number of seconds to wait for a request before stopping, None to wait forever.
         """
         # Create the reddit object we will use for the remainder of the simulation.
-        self.reddit = RedditClient(user_data_filename)
+        self.worker.reddit = self.create_client(user_data_filename, cache)
 
         while True:
             # Passively wait for a request.
-            message = request_queue.get()
+            try:
+                message = request_queue.get(timeout=idle_timeout)
+            except queue.Empty:
+                # We've stopped reading requests, so let the consumer know it may need to start a replacement.
+                response_queue.put({"retired": True})
+                break
 
             # If the message is None, that's the poison pill.
             if message is None:
                 break
 
+            # The time the command spends in each stage is sent back with its final response.
+            timings = {"enqueued": message.get("enqueued", None), "dequeued": time.perf_counter()}
+
             # Make sure we have a method to call.
             if "name" not in message:
                 logger.log("EmbeddedProxy.producer_main: Error method name not found on producer queue.")
@@ -309,8 +1264,13 @@ class EmbeddedProxy:
                                message["name"], "\"", sep="")
                     continue
 
-            # Call the method.
+            # Call the method. Any generator it returns is run on this thread, so it keeps the same priority.
             ret = None
+            name = message["name"]
+            self.limiter.set_priority(message.get("priority", RateLimiter.BACKGROUND))
+            self.sync_access_information()
+            stats = self.get_handler_stats()
+            timings["started"] = time.perf_counter()
             try:
                 args = message.get("args", None)
                 params = message.get("params", None)
@@ -327,8 +1287,58 @@ class EmbeddedProxy:
                 logger.log("EmbeddedProxy.producer_main: Caught the following exception during method invocation: ", ex,
                            sep="")
 
+            # Generators are streamed back one item per message so the consumer can act on results as they arrive,
+            # followed by a closing message that marks the end of the stream.
+            if inspect.isgenerator(ret):
+                self.stream_response(response_queue, message, ret, self.shared_memory_records)
+                response = {"id": message.get("id", None), "name": name, "closing": True}
+            else:
+                if self.shared_memory_records is not None:
+                    ret = transport.pack(ret, self.shared_memory_records)
+                response = {"id": message.get("id", None), "name": name, "return": ret}
+            self.sync_access_information()
+
+            timings["finished"] = time.perf_counter()
+            if stats is not None:
+                for stat, value in self.get_handler_stats().items():
+                    timings[stat] = value - stats[stat]
+
             # Put the response on the response queue for the other process.
-            response_queue.put({"name": message["name"], "return": ret})
+            timings["put"] = time.perf_counter()
+            response["timings"] = timings
+            response_queue.put(response)
+            logger.debug("EmbeddedProxy.producer_main: Finished a command", method=name,
+                         seconds=timings["finished"] - timings["started"])
+
+    def get_handler_stats(self):
+        """
+        Gets the statistics of the requests the handler of the current producer has made, see
+        ScheduledHandler.get_stats.
+        :return: The dictionary of statistics, None if the handler doesn't keep track.
+        """
+        get_stats = getattr(self.reddit.handler, "get_stats", None)
+        return get_stats() if get_stats is not None else None
+
+    @staticmethod
+    def stream_response(response_queue, message, generator, shared_memory_records=None):
+        """
+        Puts each item of a generator on the response queue as its own partial response.
+        :param response_queue: The queue we will use to respond.
+        :param message: The request message of the method that created the generator.
+        :param generator: The generator to stream.
+        :param shared_memory_records: The number of records a list in an item needs to be sent through shared memory,
+        None to send everything through the queue.
+        """
+        request_id = message.get("id", None)
+        name = message["name"]
+
+        try:
+            for item in generator:
+                if shared_memory_records is not None:
+                    item = transport.pack(item, shared_memory_records)
+                response_queue.put({"id": request_id, "name": name, "return": item, "partial": True})
+        except Exception as ex:
+            logger.log("EmbeddedProxy.stream_response: Caught the following exception during streaming: ", ex, sep="")
 
     def consumer_main(self, queue):
         """
@@ -338,83 +1348,138 @@ class EmbeddedProxy:
         while True:
             # Passively wait for a request.
             message = queue.get()
+            received = time.perf_counter()
 
             if message is None:
                 break
 
-            # Make sure we know who to notify.
-            if "name" not in message:
+            # A producer stopped after being idle, start another if commands arrived in the meantime.
+            if message.get("retired", False):
+                with self.scale_lock:
+                    self.live_producers -= 1
+                    self.metrics.set_workers(self.live_producers)
+                self.scale()
                 continue
 
-            # Is there someone that wants these notifications?
-            name = message["name"]
-            if name not in self.callbacks:
-                continue
+            # Large lists of records are mapped from the shared memory the producer left them in.
+            if self.shared_memory_records is not None and "return" in message:
+                try:
+                    message["return"] = transport.unpack(message["return"])
+                except OSError as e:
+                    logger.log("EmbeddedProxy.consumer_main: Error mapping a response from shared memory:", e)
+                    message["return"] = None
+
+            # Streamed responses are made up of partial messages, which don't count as a call, followed by a closing
+            # message, which counts as a call but has nothing to pass along.
+            partial = message.get("partial", False)
+            closing = message.get("closing", False)
+
+            # Notify the request that sent the command, it's finished with once the final response arrives.
+            request_id = message.get("id", None)
+            if request_id is not None:
+                with self.requests_lock:
+                    request = self.requests.get(request_id, None) if partial else self.requests.pop(request_id, None)
+                    if request is not None and request.key is not None and not partial:
+                        self.finish_leader(request)
+
+                if request is not None:
+                    request.respond(message)
+
+            # Index what was retrieved once it's been delivered.
+            if self.indexer is not None and message.get("name", None) in self.INDEXED_COMMANDS:
+                self.indexer.put(message.get("return", None))
+
+            # Make sure we know who else to notify.
+            if "name" in message:
+                self.call_callbacks(message, partial, closing)
+
+            # Final responses carry the timings of their command.
+            timings = message.get("timings", None)
+            if timings is not None and timings["enqueued"] is not None:
+                timings["received"] = received
+                timings["completed"] = time.perf_counter()
+                self.metrics.record(message["name"], timings)
+
+                if timings["completed"] - self.depths_sampled >= self.DEPTHS_INTERVAL:
+                    self.update_queue_depths()
+
+                if self.metrics_file is not None and \
+                        timings["completed"] - self.metrics_written >= self.METRICS_INTERVAL:
+                    self.write_metrics()
+
+    def call_callbacks(self, message, partial, closing):
+        """
+        Passes a response to the callbacks added for its method name.
+        :param message: The response message.
+        :param partial: True if the message is one item of a stream.
+        :param closing: True if the message marks the end of a stream.
+        """
+        # Is there someone that wants these notifications?
+        name = message["name"]
+        if name not in self.callbacks:
+            return
 
-            # Note whether or not there was a return value.
-            has_ret = "return" in message
-            ret = message["return"] if has_ret else None
+        # Note whether or not there was a return value.
+        has_ret = "return" in message
+        ret = message["return"] if has_ret else None
 
-            # Perform each callback.
-            callbacks = self.callbacks[name]
-            for callback in callbacks:
-                # Perform callback.
+        # Perform each callback. Iterate over a copy since finished callbacks are removed as we go.
+        callbacks = self.callbacks[name]
+        for callback in list(callbacks):
+            # Perform callback.
+            if not closing:
                 try:
                     if has_ret:
                         callback["callback"](ret)
                     else:
                         callback["callback"]()
                 except Exception as ex:
-                    logger.log("EmbeddedProxy.consumer_main: Caught the following exception during method invocation: ",
-                               ex, sep="")
-
-                # If this callback has a finite number of calls.
-                calls = callback["calls"]
-                if calls is not None:
-                    # Decrement the number of calls.
-                    calls -= 1
-                    if calls <= 0:
-                        # If we've run out of calls remove it from the list.
-                        self.remove_callback(name, callback["callback"])
-                    else:
-                        # Save the new value.
-                        callback["calls"] = calls
+                    logger.log("EmbeddedProxy.call_callbacks: Caught the following exception during method "
+                               "invocation: ", ex, sep="")
+
+            # If this callback has a finite number of calls.
+            calls = callback["calls"]
+            if calls is not None and not partial:
+                # Decrement the number of calls.
+                calls -= 1
+                if calls <= 0:
+                    # If we've run out of calls remove it from the list.
+                    self.remove_callback(name, callback["callback"])
+                else:
+                    # Save the new value.
+                    callback["calls"] = calls
 
     def vote(self, upvote, all_content, callback=None):
         """
         Used as a pass through to the RedditClient vote method. This is called on the main process (consumer process).
-        In order to preserve any state from main process a special callback is placed on in the callback list and the
-        producer process is informed to tell the main process when to call this special callback.
+        The content is split across the producers, each of which streams back the status of every item it votes on.
         :param upvote: True to upvote, false to downvote.
         :param all_content: The list of content.
         :param callback: The callback to call to report the status of each status item.
+        :return: The list of Requests sent to the producers.
         """
-        # If there is no callback, just do it like normal.
-        if callback is None:
-            self.add_command("vote", upvote, all_content)
-            return
-
-        # Add a callback in the consumer process to call the passed in callback as a result of execution on the
-        # producer. Must be keyed with the content name to avoid overlapping with subsequent calls to vote.
-        for content in all_content:
-            self.add_callback("consumer_vote_" + content.name, lambda ret: callback(ret[0], ret[1]), 1)
-
         # Try to evenly distribute the command across the available producers.
         size = math.ceil(len(all_content) / self.producer_processes)
         if size <= 0:
-            return
+            return []
 
+        requests = []
         for x in range(0, len(all_content), size):
-            self.add_command("producer_vote", upvote, all_content[x:x + size])
+            request = self.add_command("producer_vote", upvote, all_content[x:x + size])
+            if callback is not None:
+                request.then(lambda ret: callback(ret[0], ret[1]))
+            requests.append(request)
+
+        return requests
 
     def producer_vote(self, upvote, all_content):
         """
         A special method used by the producer process to vote.
         :param upvote: True to upvote, false to downvote.
         :param all_content: The list of content.
+        :return: A generator of the content voted on and whether it was successful.
         """
-        self.reddit.vote(upvote, all_content, lambda entry, success: self.consumer_queue.put(
-            {"name": "consumer_vote_" + entry.name, "return": [entry, success]}))
+        return self.reddit.iter_vote(upvote, all_content)
 
 
 class RedditProxy(RedditClient, EmbeddedProxy):
@@ -422,13 +1487,17 @@ class RedditProxy(RedditClient, EmbeddedProxy):
     A proxy for interacting with the RedditClient in another process.
     """
 
-    def __init__(self, user_data_filename, producer_processes):
+    def __init__(self, user_data_filename, producer_processes, cache=None, backend="process", **options):
         """
         Initializes a new instance of the RedditProxy class.
         :param user_data_filename: The file that contains previously entered user data.
         :param producer_processes: The number of producer processes to make reddit requests with.
+        :param cache: The HistoryCache the producers share, None to always retrieve everything.
+        :param backend: Either "process" or "thread", see EmbeddedProxy.
+        :param options: Any other options of the EmbeddedProxy, e.g. handler_factory.
         """
-        object.__setattr__(self, "_obj", EmbeddedProxy(user_data_filename, producer_processes))
+        object.__setattr__(self, "_obj", EmbeddedProxy(user_data_filename, producer_processes, cache, backend,
+                                                       **options))
 
     def __getattribute__(self, name):
         """
@@ -484,3 +1553,20 @@ class RedditProxy(RedditClient, EmbeddedProxy):
         :return: The string representation of the object that acts as a constructable means to recreate the object.
         """
         return repr(object.__getattribute__(self, "_obj"))
+
+
+def create_handler(handler_factory, limiter, response_cache=None):
+    """
+    Creates the PRAW handler of a client that makes its requests through a shared RateLimiter.
+    :param handler_factory: Creates the handler when passed the RateLimiter, see EmbeddedProxy. None for a
+    handlers.ScheduledHandler.
+    :param limiter: The RateLimiter, None to make requests as soon as they're asked for.
+    :param response_cache: The ResponseCache the handler answers requests from, None for none.
+    :return: The handler.
+    """
+    if handler_factory is None:
+        from handlers import ScheduledHandler
+        handler_factory = ScheduledHandler
+
+    options = {"response_cache": response_cache} if response_cache is not None else {}
+    return handler_factory(limiter, **options)
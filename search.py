@@ -0,0 +1,226 @@
+import datetime
+import queue
+import threading
+
+import logger
+from cache import SQLiteStore
+from records import Record, RecordSet
+
+
+class SearchIndex(SQLiteStore):
+    """
+    A full text index of every post and comment retrieved, stored in SQLite with FTS5, so retrieved content can be
+    found again by its text, author, subreddit and date without going back to Reddit or scanning it.
+
+    Records are stored in a table with indexes on author, subreddit and time, and the titles and bodies in an FTS5
+    table kept in step with it by triggers. A record retrieved again replaces the stored one.
+    """
+
+    # The columns stored for each record, in the order of its attributes
+    COLUMNS = Record.__slots__
+
+    # Losing the last few records in a power cut is fine, they're retrieved again next time.
+    PRAGMAS = SQLiteStore.PRAGMAS + ("synchronous=NORMAL",)
+
+    def create_schema(self, connection):
+        """
+        Creates the tables of the index.
+        :param connection: The new connection, in a transaction.
+        """
+        connection.execute("CREATE TABLE IF NOT EXISTS items (number INTEGER PRIMARY KEY, id TEXT, name TEXT UNIQUE, "
+                           "kind TEXT, author TEXT, subreddit TEXT, score INTEGER, created REAL, archived INTEGER, "
+                           "title TEXT, body TEXT, parent_id TEXT, depth INTEGER)")
+        connection.execute("CREATE INDEX IF NOT EXISTS items_author ON items (author COLLATE NOCASE, created)")
+        connection.execute("CREATE INDEX IF NOT EXISTS items_subreddit ON items (subreddit COLLATE NOCASE, created)")
+        connection.execute("CREATE INDEX IF NOT EXISTS items_created ON items (created)")
+
+        # The text is only stored once, in the items table, the FTS5 table just indexes it.
+        connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS items_text USING fts5(title, body, content='items', "
+                           "content_rowid='number', tokenize='unicode61 remove_diacritics 2')")
+        connection.execute("CREATE TRIGGER IF NOT EXISTS items_insert AFTER INSERT ON items BEGIN "
+                           "INSERT INTO items_text (rowid, title, body) VALUES (new.number, new.title, new.body); END")
+        connection.execute("CREATE TRIGGER IF NOT EXISTS items_delete AFTER DELETE ON items BEGIN "
+                           "INSERT INTO items_text (items_text, rowid, title, body) "
+                           "VALUES ('delete', old.number, old.title, old.body); END")
+        connection.execute("CREATE TRIGGER IF NOT EXISTS items_update AFTER UPDATE ON items BEGIN "
+                           "INSERT INTO items_text (items_text, rowid, title, body) "
+                           "VALUES ('delete', old.number, old.title, old.body); "
+                           "INSERT INTO items_text (rowid, title, body) VALUES (new.number, new.title, new.body); END")
+
+    def add(self, records):
+        """
+        Adds posts and comments to the index, replacing any with the same fullname. Other records are skipped.
+        :param records: An iterable of records.
+        """
+        rows = [tuple(getattr(record, column) for column in self.COLUMNS) for record in records
+                if record is not None and record.kind in ("submission", "comment") and record.name is not None]
+        if len(rows) == 0:
+            return
+
+        updates = ", ".join(column + " = excluded." + column for column in self.COLUMNS if column != "name")
+        try:
+            connection = self.connect()
+            connection.executemany("INSERT INTO items (" + ", ".join(self.COLUMNS) + ") VALUES (" +
+                                   ", ".join("?" * len(self.COLUMNS)) + ") ON CONFLICT (name) DO UPDATE SET " +
+                                   updates, rows)
+            connection.commit()
+        except Exception as e:
+            logger.log("SearchIndex.add: Error writing to the index:", e)
+
+    def search(self, text=None, author=None, subreddit=None, after=None, before=None, limit=500):
+        """
+        Finds posts and comments.
+        :param text: The words the title or body must contain, each may also be the start of a longer word, None to
+        match any text.
+        :param author: The username of the author, ignoring case, None for any author.
+        :param subreddit: The name of the subreddit, ignoring case, None for any subreddit.
+        :param after: The earliest time the content was created in seconds since the epoch, None for no limit.
+        :param before: The time the content must have been created before in seconds since the epoch, None for no
+        limit.
+        :param limit: The maximum number of records to return.
+        :return: The list of records, the newest first, or the most recently indexed first if there's only text.
+        """
+        conditions = []
+        values = []
+        for column, value in (("author", author), ("subreddit", subreddit)):
+            if value:
+                conditions.append("items." + column + " = ? COLLATE NOCASE")
+                values.append(value)
+        if after is not None:
+            conditions.append("items.created >= ?")
+            values.append(after)
+        if before is not None:
+            conditions.append("items.created < ?")
+            values.append(before)
+
+        columns = ", ".join("items." + column for column in self.COLUMNS)
+        query = create_match_query(text)
+        # Ranking every match by relevance takes far too long for common words, so matches are walked in the order
+        # of the text index, which can stop at the limit, unless the other conditions narrow them down first.
+        if query is not None and len(conditions) == 0:
+            sql = "SELECT " + columns + " FROM items_text JOIN items ON items.number = items_text.rowid " \
+                  "WHERE items_text MATCH ? ORDER BY items_text.rowid DESC LIMIT ?"
+            values.append(query)
+        elif query is not None:
+            sql = "SELECT " + columns + " FROM items WHERE " + " AND ".join(conditions) + \
+                  " AND items.number IN (SELECT rowid FROM items_text WHERE items_text MATCH ?)" \
+                  " ORDER BY items.created DESC LIMIT ?"
+            values.append(query)
+        else:
+            sql = "SELECT " + columns + " FROM items" + \
+                  (" WHERE " + " AND ".join(conditions) if conditions else "") + " ORDER BY items.created DESC LIMIT ?"
+        values.append(limit)
+
+        try:
+            rows = self.connect().execute(sql, values).fetchall()
+        except Exception as e:
+            logger.log("SearchIndex.search: Error reading from the index:", e)
+            return []
+
+        return [Record(*row[:3], author=row[3], subreddit=row[4], score=row[5], created=row[6],
+                       archived=bool(row[7]), title=row[8], body=row[9], parent_id=row[10], depth=row[11])
+                for row in rows]
+
+    def count(self):
+        """
+        Counts the records in the index.
+        :return: The number of records.
+        """
+        try:
+            return self.connect().execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        except Exception as e:
+            logger.log("SearchIndex.count: Error reading from the index:", e)
+            return 0
+
+
+class Indexer:
+    """
+    Adds the records of responses to a SearchIndex on a background thread, so whoever receives the responses isn't
+    held up writing them.
+    """
+
+    def __init__(self, index):
+        """
+        Initializes a new instance of the Indexer class and starts its thread.
+        :param index: The SearchIndex.
+        """
+        self.index = index
+        self.queue = queue.Queue()
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, value):
+        """
+        Queues the records of a response to be indexed.
+        :param value: The return value of get_user, get_user_pages or get_post: a RecordSet, a page or None.
+        """
+        if value is not None:
+            self.queue.put(value)
+
+    def run(self):
+        """
+        Indexes queued responses until stopped, a batch at a time so a burst of pages is written in one transaction.
+        """
+        while True:
+            values = [self.queue.get()]
+            while True:
+                try:
+                    values.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in values
+            self.index.add(record for value in values if value is not None for record in get_records(value))
+            if stop:
+                break
+
+    def stop(self):
+        """
+        Indexes what's been queued, then stops the thread.
+        """
+        self.queue.put(None)
+        self.thread.join(30)
+
+
+def get_records(value):
+    """
+    Gets the records in a response.
+    :param value: A RecordSet, a page of a streamed history or a Record.
+    :return: The list of records.
+    """
+    if isinstance(value, RecordSet):
+        return [value.record] + list(value.posts or []) + list(value.all_comments or [])
+    if isinstance(value, dict):
+        return value.get("items", [])
+    if isinstance(value, Record):
+        return [value]
+    return []
+
+
+def create_match_query(text):
+    """
+    Turns what someone typed into an FTS5 query, so nothing they type is taken as query syntax. Every word must match,
+    either exactly or as the start of a longer word.
+    :param text: The text, may be None.
+    :return: The query, None if there are no words.
+    """
+    words = (text or "").split()
+    if len(words) == 0:
+        return None
+
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+def parse_date(text):
+    """
+    Parses a date typed into the form.
+    :param text: The date as YYYY-MM-DD, in UTC, may be empty.
+    :return: The start of the day in seconds since the epoch, None if there's no date.
+    """
+    if text is None or text.strip() == "":
+        return None
+
+    date = datetime.datetime.strptime(text.strip(), "%Y-%m-%d")
+    return date.replace(tzinfo=datetime.timezone.utc).timestamp()
@@ -0,0 +1,146 @@
+import multiprocessing
+import pickle
+import threading
+
+import logger
+from rate_limiter import RateLimiter
+
+
+class TokenBroker:
+    """
+    Refreshes the OAuth access information once on behalf of every producer and shares it with them through
+    lock-protected shared memory, refreshing it again before it expires. Producers pick up new access information
+    before their next request instead of each refreshing their own.
+    """
+
+    def __init__(self, user_data_filename, handler_factory=None, limiter=None, refresh_interval=3000, retry_interval=60,
+                 capacity=4096):
+        """
+        Initializes a new instance of the TokenBroker class.
+        :param user_data_filename: The file that contains previously entered user data.
+        :param handler_factory: Creates the PRAW handler refreshes are made through when passed the limiter, the same
+        as the producers', None for a handlers.ScheduledHandler.
+        :param limiter: The RateLimiter the producers share, None to refresh as soon as it's time.
+        :param refresh_interval: The number of seconds between refreshes. Reddit access tokens last an hour.
+        :param retry_interval: The number of seconds to wait before trying again after a refresh fails.
+        :param capacity: The maximum size in bytes of the serialized access information.
+        """
+        self.user_data_filename = user_data_filename
+        self.handler_factory = handler_factory
+        self.limiter = limiter
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+
+        # The serialized access information and a version that changes every time it does
+        self.lock = multiprocessing.Lock()
+        self.version = multiprocessing.Value("i", 0, lock=False)
+        self.length = multiprocessing.Value("i", 0, lock=False)
+        self.data = multiprocessing.Array("c", capacity, lock=False)
+
+        # Set once the first refresh has been attempted, whether or not there was anything to refresh
+        self.ready = multiprocessing.Event()
+
+        # The timer of the next refresh and the client that refreshes, only in the process that refreshes
+        self.timer = None
+        self.client = None
+
+    def __getstate__(self):
+        """
+        Needed for pickle, the refresh timer and client stay in the process that refreshes.
+        :return: The state of the object.
+        """
+        state = self.__dict__.copy()
+        state["timer"] = None
+        state["client"] = None
+        return state
+
+    def start(self):
+        """
+        Refreshes the access information in the background and keeps refreshing it before it expires.
+        """
+        self.schedule(0)
+
+    def stop(self):
+        """
+        Stops refreshing the access information.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def schedule(self, delay):
+        """
+        Schedules the next refresh.
+        :param delay: The number of seconds until the refresh.
+        """
+        self.timer = threading.Timer(delay, self.refresh)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def refresh(self):
+        """
+        Refreshes the access information using the latest refresh token, from either a previous refresh, a producer
+        that logged in for the first time or the user data file.
+        """
+        # Everyone waits on the access information, so it goes ahead of background requests.
+        if self.limiter is not None:
+            self.limiter.set_priority(RateLimiter.INTERACTIVE)
+
+        if self.client is None:
+            # Imported here since the client is only needed in the process doing the refreshing.
+            from reddit_client import RedditClient, create_handler
+
+            self.client = RedditClient(self.user_data_filename, login=False,
+                                       handler=create_handler(self.handler_factory, self.limiter))
+
+        client = self.client
+        access_information = self.get()[1] or client.access_information
+
+        if access_information is None:
+            # Nothing to refresh until a producer logs in for the first time and publishes its access information.
+            self.ready.set()
+            self.schedule(self.retry_interval)
+            return
+
+        if client.login(access_information["refresh_token"]):
+            self.publish(client.access_information)
+            self.schedule(self.refresh_interval)
+        else:
+            logger.log("TokenBroker.refresh: Unable to refresh access information, retrying later.")
+            self.schedule(self.retry_interval)
+
+        self.ready.set()
+
+    def publish(self, access_information):
+        """
+        Shares new access information with every producer.
+        :param access_information: The access information.
+        """
+        data = pickle.dumps(access_information)
+        if len(data) > len(self.data):
+            logger.log("TokenBroker.publish: Access information is too large to share.")
+            return
+
+        with self.lock:
+            self.data[:len(data)] = data
+            self.length.value = len(data)
+            self.version.value += 1
+
+    def get(self):
+        """
+        Gets the current access information.
+        :return: A tuple of the version and the access information, which is None if there isn't any yet.
+        """
+        with self.lock:
+            if self.length.value == 0:
+                return self.version.value, None
+
+            return self.version.value, pickle.loads(self.data[:self.length.value])
+
+    def wait(self, timeout=None):
+        """
+        Waits for the first refresh to be attempted.
+        :param timeout: The maximum number of seconds to wait, None to wait forever.
+        :return: True if the first refresh was attempted, false if we timed out.
+        """
+        return self.ready.wait(timeout)
@@ -0,0 +1,307 @@
+"""
+Sends large lists of records from producer processes to the consumer through shared memory instead of pickling them
+through a pipe. The producer encodes the records into a compact batch in a new shared memory segment and only a small
+SharedRecords descriptor travels over the queue. The consumer maps the segment and gets a RecordBatch, a read only list
+that decodes records straight out of the mapping when they're first used, a chunk at a time, so the consumer thread
+that every response goes through never decodes anything itself.
+
+A batch is laid out as a header, the offsets of the text of each chunk, the fixed size fields of every record and
+then the text of each chunk: the string fields of its records in order, separated by NUL characters.
+"""
+import collections.abc
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+import logger
+from records import Record, RecordSet
+
+# The magic number, the number of records and the number of records per chunk
+HEADER = struct.Struct("<4sII")
+MAGIC = b"RB01"
+
+# The offset of the text of a chunk, relative to the start of the text
+OFFSET = struct.Struct("<Q")
+
+# The score, created, depth and archived fields of a record, and a bit for each string field that is None
+FIXED = struct.Struct("<qdiBB")
+
+# The string fields of a record, in the order they're encoded
+STRINGS = ("id", "name", "kind", "author", "subreddit", "title", "body", "parent_id")
+
+# The number of records decoded at once
+CHUNK_SIZE = 256
+
+SEPARATOR = "\0"
+
+
+class SharedRecords:
+    """
+    Describes a batch of records in a shared memory segment, which is all that's sent to the consumer in its place.
+    """
+
+    __slots__ = ("name", "count")
+
+    def __init__(self, name, count):
+        """
+        Initializes a new instance of the SharedRecords class.
+        :param name: The name of the shared memory segment.
+        :param count: The number of records.
+        """
+        self.name = name
+        self.count = count
+
+    def __getstate__(self):
+        """
+        Needed for pickle, since the class has slots.
+        :return: The state of the object.
+        """
+        return self.name, self.count
+
+    def __setstate__(self, state):
+        """
+        Needed for pickle, restores the state of the object.
+        :param state: The state of the object.
+        """
+        self.name, self.count = state
+
+    def attach(self):
+        """
+        Maps the segment and removes its name, so it's freed once the returned batch is no longer used. Can only be
+        called once.
+        :return: The RecordBatch.
+        """
+        memory = shared_memory.SharedMemory(self.name)
+
+        # Unlinking also stops this process's resource tracker from unlinking it again when we exit.
+        memory.unlink()
+        return RecordBatch(memory.buf, memory)
+
+    def discard(self):
+        """
+        Frees the segment without reading it, e.g. when nobody is left to receive it.
+        """
+        try:
+            memory = shared_memory.SharedMemory(self.name)
+            memory.unlink()
+            memory.close()
+        except OSError:
+            pass
+
+
+class RecordBatch(collections.abc.Sequence):
+    """
+    A read only list of records decoded from an encoded batch as they're used. Slices are lists of records, and a
+    pickled batch is unpickled as a list.
+    """
+
+    def __init__(self, buffer, memory=None):
+        """
+        Initializes a new instance of the RecordBatch class.
+        :param buffer: The encoded batch, a bytes-like object, which may be followed by unused bytes.
+        :param memory: The SharedMemory the buffer is mapped from, kept open for as long as the batch is used.
+        """
+        # The segment's own view is used as is, it can't be closed while views derived from it are around.
+        self.view = buffer if isinstance(buffer, memoryview) else memoryview(buffer)
+        self.memory = memory
+
+        magic, self.count, self.chunk_size = HEADER.unpack_from(self.view)
+        if magic != MAGIC:
+            raise ValueError("Not a record batch")
+
+        chunks = -(-self.count // self.chunk_size)
+        self.offsets = [offset for offset, in OFFSET.iter_unpack(self.view[HEADER.size:HEADER.size +
+                                                                           (chunks + 1) * OFFSET.size])]
+        self.fixed_start = HEADER.size + (chunks + 1) * OFFSET.size
+        self.text_start = self.fixed_start + self.count * FIXED.size
+
+        # The records of each chunk, once decoded
+        self.chunks = [None] * chunks
+
+    def __len__(self):
+        """
+        Gets the number of records.
+        :return: The number of records.
+        """
+        return self.count
+
+    def __getitem__(self, index):
+        """
+        Gets a record, decoding its chunk if it hasn't been used yet.
+        :param index: The index of the record, or a slice.
+        :return: The record, or a list of records for a slice.
+        """
+        if isinstance(index, slice):
+            return [self[x] for x in range(*index.indices(self.count))]
+
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("RecordBatch index out of range")
+
+        chunk = index // self.chunk_size
+        records = self.chunks[chunk]
+        if records is None:
+            records = self.chunks[chunk] = self.decode(chunk)
+        return records[index - chunk * self.chunk_size]
+
+    def __iter__(self):
+        """
+        Iterates over the records a chunk at a time.
+        :return: The iterator of records.
+        """
+        for chunk in range(len(self.chunks)):
+            records = self.chunks[chunk]
+            if records is None:
+                records = self.chunks[chunk] = self.decode(chunk)
+            yield from records
+
+    def __reduce__(self):
+        """
+        Needed for pickle, the records are sent on as a list since the memory they're in is only mapped here.
+        :return: How to recreate the object.
+        """
+        return list, (list(self),)
+
+    def decode(self, chunk):
+        """
+        Decodes the records of a chunk.
+        :param chunk: The index of the chunk.
+        :return: The list of records.
+        """
+        start = chunk * self.chunk_size
+        end = min(start + self.chunk_size, self.count)
+
+        fields = str(self.view[self.text_start + self.offsets[chunk]:self.text_start + self.offsets[chunk + 1]],
+                     "utf-8").split(SEPARATOR)
+        fixed = self.view[self.fixed_start + start * FIXED.size:self.fixed_start + end * FIXED.size]
+
+        records = []
+        x = 0
+        for score, created, depth, archived, nones in FIXED.iter_unpack(fixed):
+            strings = fields[x:x + len(STRINGS)]
+            x += len(STRINGS)
+            if nones:
+                strings = [None if nones & (1 << y) else value for y, value in enumerate(strings)]
+
+            id, name, kind, author, subreddit, title, body, parent_id = strings
+            records.append(Record(id, name, kind, author, subreddit, score, created, bool(archived), title, body,
+                                  parent_id, depth))
+        return records
+
+
+def encode_records(records, chunk_size=CHUNK_SIZE):
+    """
+    Encodes records into a batch.
+    :param records: The list of records.
+    :param chunk_size: The number of records decoded at once.
+    :return: The list of bytes objects that make up the batch, in order.
+    """
+    fixed = []
+    texts = []
+    for start in range(0, len(records), chunk_size):
+        strings = []
+        for record in records[start:start + chunk_size]:
+            nones = 0
+            for y, field in enumerate(STRINGS):
+                value = getattr(record, field)
+                if value is None:
+                    nones |= 1 << y
+                    value = ""
+                strings.append(value)
+
+            fixed.append(FIXED.pack(record.score, record.created, record.depth, record.archived, nones))
+
+        text = SEPARATOR.join(strings)
+        if text.count(SEPARATOR) != len(strings) - 1:
+            raise ValueError("A record contains a NUL character")
+        texts.append(text.encode("utf-8"))
+
+    offsets = [0]
+    for text in texts:
+        offsets.append(offsets[-1] + len(text))
+
+    return [HEADER.pack(MAGIC, len(records), chunk_size), b"".join(OFFSET.pack(offset) for offset in offsets),
+            b"".join(fixed)] + texts
+
+
+def share_records(records):
+    """
+    Encodes records into a new shared memory segment, which the consumer frees once it's done with them.
+    :param records: The list of records.
+    :return: The SharedRecords describing the segment, None if the records can't be encoded or shared.
+    """
+    try:
+        parts = encode_records(records)
+    except (AttributeError, TypeError, ValueError, struct.error) as e:
+        logger.debug("transport.share_records: Sending the records through the queue instead:", e)
+        return None
+
+    size = sum(len(part) for part in parts)
+    try:
+        memory = shared_memory.SharedMemory(create=True, size=size)
+    except OSError as e:
+        logger.log("transport.share_records: Error creating shared memory:", e)
+        return None
+
+    offset = 0
+    for part in parts:
+        memory.buf[offset:offset + len(part)] = part
+        offset += len(part)
+
+    # The consumer owns the segment from now on, so this process mustn't unlink it when it stops.
+    resource_tracker.unregister(memory._name, "shared_memory")
+    memory.close()
+    return SharedRecords(memory.name, len(records))
+
+
+def pack(value, min_records):
+    """
+    Replaces the large lists of records in a response with SharedRecords. Called by producers.
+    :param value: The return value of a method or an item it streamed, RecordSets and pages are packed.
+    :param min_records: The number of records a list needs for it to be shared.
+    :return: The value to send, a copy if anything was shared.
+    """
+    def share(records):
+        if isinstance(records, list) and len(records) >= min_records:
+            return share_records(records) or records
+        return records
+
+    if isinstance(value, RecordSet):
+        posts = share(value.posts)
+        all_comments = share(value.all_comments)
+        if posts is not value.posts or all_comments is not value.all_comments:
+            return RecordSet(value.record, posts, all_comments)
+    elif isinstance(value, dict) and "items" in value:
+        items = share(value["items"])
+        if items is not value["items"]:
+            return dict(value, items=items)
+    return value
+
+
+def unpack(value):
+    """
+    Replaces the SharedRecords in a response with RecordBatches. Called by the consumer.
+    :param value: The value that was sent.
+    :return: The value.
+    """
+    if isinstance(value, RecordSet):
+        if isinstance(value.posts, SharedRecords):
+            value.posts = value.posts.attach()
+        if isinstance(value.all_comments, SharedRecords):
+            value.all_comments = value.all_comments.attach()
+    elif isinstance(value, dict) and isinstance(value.get("items", None), SharedRecords):
+        value["items"] = value["items"].attach()
+    return value
+
+
+def discard(value):
+    """
+    Frees the shared memory of a response that won't be received.
+    :param value: The value that was sent.
+    """
+    if isinstance(value, RecordSet):
+        for records in (value.posts, value.all_comments):
+            if isinstance(records, SharedRecords):
+                records.discard()
+    elif isinstance(value, dict) and isinstance(value.get("items", None), SharedRecords):
+        value["items"].discard()